@@ -40,6 +40,34 @@ OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 if not OPENAI_API_KEY:
     print("WARNING: OPENAI_API_KEY is not set. LLM features will not work.")
 
+# Shared LLM gateway (one pooled connection set for every OpenAI call)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "16"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "90"))                     # default per call
+LLM_TRANSCRIBE_TIMEOUT = float(os.getenv("LLM_TRANSCRIBE_TIMEOUT", "600"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))                # on 429 / 5xx / network
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+
+# Client-side rate limiting per model, "model=rpm:tpm,..." (tokens are
+# estimated as prompt chars / 4 + output budget, then corrected)
+LLM_RATE_LIMIT_ENABLED = os.getenv("LLM_RATE_LIMIT_ENABLED", "true").lower() == "true"
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "gpt-4.1-mini=500:200000,gpt-4.1=500:30000,whisper-1=50:0")
+LLM_DEFAULT_RPM = int(os.getenv("LLM_DEFAULT_RPM", "500"))
+LLM_DEFAULT_TPM = int(os.getenv("LLM_DEFAULT_TPM", "200000"))
+# The buckets live in each process. Set this to the number of processes
+# sharing the API key (uvicorn workers + `python -m app.worker` processes)
+# so each one gets its share of the quota and together they stay within it.
+LLM_RATE_LIMIT_PROCESSES = max(1, int(os.getenv("LLM_RATE_LIMIT_PROCESSES", "1")))
+
+# LLM response cache (model + parameters + normalized prompt → output text)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", str(Path(UPLOAD_DIR) / "cache" / "llm"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))        # seconds
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "2000"))
+os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+
 # ----------------------------
 # Google Vision OCR (NEW)
 # ----------------------------
@@ -48,7 +76,158 @@ GOOGLE_OCR_API_KEY = os.getenv("GOOGLE_OCR_API_KEY", "")
 if not GOOGLE_OCR_API_KEY:
     print("WARNING: GOOGLE_OCR_API_KEY not set — scanned PDFs will fail")
 
+# Endpoint is overridable so a local stand-in server can be used in tests.
+GOOGLE_VISION_ENDPOINT = os.getenv(
+    "GOOGLE_VISION_ENDPOINT", "https://vision.googleapis.com/v1/images:annotate"
+)
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", "4"))          # requests in flight
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "4"))            # images per request
+OCR_MAX_RETRIES = int(os.getenv("OCR_MAX_RETRIES", "4"))          # on 429 / 5xx / network
+OCR_RETRY_BASE_DELAY = float(os.getenv("OCR_RETRY_BASE_DELAY", "1.0"))
+OCR_HTTP_TIMEOUT = float(os.getenv("OCR_HTTP_TIMEOUT", "60"))
+
+# Page rendering for OCR (runs on the CPU process pool)
+OCR_RENDER_DPI = int(os.getenv("OCR_RENDER_DPI", "180"))
+OCR_ADAPTIVE_DPI = os.getenv("OCR_ADAPTIVE_DPI", "true").lower() == "true"
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", "100"))
+OCR_MAX_DPI = int(os.getenv("OCR_MAX_DPI", "300"))
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", str(3_000_000)))   # per page image
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "true").lower() == "true"
+OCR_IMAGE_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "jpeg").lower()     # jpeg | png
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "80"))
+OCR_RENDER_AHEAD = int(os.getenv("OCR_RENDER_AHEAD", "2"))          # batches rendered ahead of uploads
+
+# Blank / low-information page filter before OCR (see page_filter.py).
+# Ink = share of pixels darker than OCR_BLANK_DARK_LEVEL.
+OCR_SKIP_BLANK_PAGES = os.getenv("OCR_SKIP_BLANK_PAGES", "true").lower() == "true"
+OCR_BLANK_DARK_LEVEL = int(os.getenv("OCR_BLANK_DARK_LEVEL", "128"))
+OCR_BLANK_MIN_INK = float(os.getenv("OCR_BLANK_MIN_INK", "0.002"))         # near-empty page
+OCR_BLANK_MAX_INK = float(os.getenv("OCR_BLANK_MAX_INK", "0.6"))           # picture plate
+OCR_BLANK_MIN_STD = float(os.getenv("OCR_BLANK_MIN_STD", "6.0"))           # flat page
+OCR_BLANK_MIN_CONNECTED = float(os.getenv("OCR_BLANK_MIN_CONNECTED", "0.3"))  # speckle only
+
+# OCR result cache keyed by a hash of the rendered page pixels
+OCR_PAGE_CACHE_DIR = os.getenv(
+    "OCR_PAGE_CACHE_DIR", str(Path(UPLOAD_DIR) / "cache" / "ocr_pages")
+)
+OCR_PAGE_CACHE_MAX_BYTES = int(os.getenv("OCR_PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+OCR_PAGE_CACHE_MEMORY_ITEMS = int(os.getenv("OCR_PAGE_CACHE_MEMORY_ITEMS", "5000"))
+os.makedirs(OCR_PAGE_CACHE_DIR, exist_ok=True)
+
+# After a batch exhausts its retries on 429, Vision counts as rate-limited
+# for this many seconds and "auto" OCR routes pages to Tesseract.
+OCR_VISION_COOLDOWN = float(os.getenv("OCR_VISION_COOLDOWN", "60"))
+
+# ----------------------------
+# OCR engine selection
+# ----------------------------
+# auto | vision | tesseract. "auto" uses Vision when configured and not
+# rate-limited, local Tesseract otherwise. Can be overridden per request.
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto").lower()
+
+# Local Tesseract (pages recognised on the CPU process pool).
+# TESSERACT_LANG uses Tesseract syntax ("eng", "eng+rus"); every pack
+# listed must be installed in the image (tesseract-ocr-<lang>).
+TESSERACT_LANG = os.getenv("TESSERACT_LANG", "eng+rus")
+TESSERACT_DPI = int(os.getenv("TESSERACT_DPI", "300"))
+TESSERACT_CONFIG = os.getenv("TESSERACT_CONFIG", "--oem 1 --psm 3")
+TESSERACT_PAGES_PER_TASK = int(os.getenv("TESSERACT_PAGES_PER_TASK", "2"))
+
 # ----------------------------
 # Other external services (placeholders)
 # ----------------------------
 OCR_SPACE_API_KEY = os.getenv("OCR_SPACE_API_KEY", "")
+
+# ----------------------------
+# Shared execution layer (blocking work off the event loop)
+# ----------------------------
+# IO pool — threads for sync SDK calls, downloads, light parsing.
+# CPU pool — processes for heavy parsing / rendering.
+# *_MAX_PENDING bounds queued + running jobs; extra callers wait in the loop.
+EXECUTOR_IO_WORKERS = int(os.getenv("EXECUTOR_IO_WORKERS", "32"))
+EXECUTOR_IO_MAX_PENDING = int(os.getenv("EXECUTOR_IO_MAX_PENDING", "256"))
+EXECUTOR_CPU_WORKERS = int(os.getenv("EXECUTOR_CPU_WORKERS", str(os.cpu_count() or 1)))
+EXECUTOR_CPU_MAX_PENDING = int(os.getenv("EXECUTOR_CPU_MAX_PENDING", "64"))
+
+# ----------------------------
+# Parallel PDF page extraction (shards on the CPU pool)
+# ----------------------------
+# Documents with fewer than 2 * PDF_PARALLEL_MIN_SHARD_PAGES pages stay
+# on the in-process path. Shards hold at most PDF_PARALLEL_MAX_SHARD_PAGES
+# pages and only PDF_PARALLEL_WORKERS are in flight, so reading holds
+# that many pages in memory at most, whatever the document size.
+PDF_PARALLEL_WORKERS = int(os.getenv("PDF_PARALLEL_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_SHARD_PAGES = int(os.getenv("PDF_PARALLEL_MIN_SHARD_PAGES", "50"))
+PDF_PARALLEL_MAX_SHARD_PAGES = int(os.getenv("PDF_PARALLEL_MAX_SHARD_PAGES", "100"))
+
+# Page texts of a document being extracted are spooled to disk here
+# (one temporary file per extraction), not kept in memory.
+PDF_SPOOL_DIR = os.getenv("PDF_SPOOL_DIR", str(Path(UPLOAD_DIR) / "cache" / "spool"))
+os.makedirs(PDF_SPOOL_DIR, exist_ok=True)
+
+# ----------------------------
+# Extraction backend probe
+# ----------------------------
+# A stratified sample of pages is read with every backend; only the
+# winner runs over the whole document. Pages with fewer than
+# PDF_PAGE_MIN_CHARS characters count as image-only (→ OCR).
+PDF_PROBE_SAMPLE_PAGES = int(os.getenv("PDF_PROBE_SAMPLE_PAGES", "8"))
+PDF_PAGE_MIN_CHARS = int(os.getenv("PDF_PAGE_MIN_CHARS", "20"))
+
+# ----------------------------
+# Extraction cache (content-addressed, SHA-256 of file bytes)
+# ----------------------------
+EXTRACTION_CACHE_DIR = os.getenv(
+    "EXTRACTION_CACHE_DIR", str(Path(UPLOAD_DIR) / "cache" / "extraction")
+)
+EXTRACTION_CACHE_MAX_BYTES = int(
+    os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(512 * 1024 * 1024))
+)
+os.makedirs(EXTRACTION_CACHE_DIR, exist_ok=True)
+
+# ----------------------------
+# Study plan generation
+# ----------------------------
+# LLM calls (day lessons + flashcards) in flight per /studyplan/study request
+STUDYPLAN_CONCURRENCY = int(os.getenv("STUDYPLAN_CONCURRENCY", "8"))
+
+# Days per LLM call (1 = one call per day). Days missing from a batched
+# answer are regenerated with a single-day call.
+STUDYPLAN_BATCH_DAYS = int(os.getenv("STUDYPLAN_BATCH_DAYS", "5"))
+STUDYPLAN_DAY_OUTPUT_TOKENS = int(os.getenv("STUDYPLAN_DAY_OUTPUT_TOKENS", "900"))
+STUDYPLAN_MAX_OUTPUT_TOKENS = int(os.getenv("STUDYPLAN_MAX_OUTPUT_TOKENS", "8000"))
+
+# Table of contents in day prompts: only the day's own sections plus a
+# short outline, within this many (estimated) tokens per prompt
+STUDYPLAN_TOC_TOKEN_BUDGET = int(os.getenv("STUDYPLAN_TOC_TOKEN_BUDGET", "1200"))
+STUDYPLAN_OUTLINE_ITEMS = int(os.getenv("STUDYPLAN_OUTLINE_ITEMS", "30"))
+
+# The document block every lesson prompt starts with (system message,
+# plan info, outline) is grown to this many estimated tokens when the
+# structure has enough headings: the provider only caches prompt
+# prefixes of 1024+ tokens, so a shorter block never gets cache hits.
+STUDYPLAN_SHARED_PREFIX_TOKENS = int(os.getenv("STUDYPLAN_SHARED_PREFIX_TOKENS", "1150"))
+
+# Seconds between keep-alive comments on /studyplan/study/stream
+STUDYPLAN_SSE_KEEPALIVE = float(os.getenv("STUDYPLAN_SSE_KEEPALIVE", "15"))
+
+# ----------------------------
+# Embedded store (SQLite, WAL; see database/db.py)
+# ----------------------------
+# Shared by every API / worker process: file metadata, pipeline status,
+# analysis results, job queue.
+DATABASE_PATH = os.getenv("DATABASE_PATH", str(Path(UPLOAD_DIR) / "app.sqlite3"))
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "8"))            # connections per process
+DATABASE_FLUSH_INTERVAL = float(os.getenv("DATABASE_FLUSH_INTERVAL", "0.25"))  # buffered status writes
+DATABASE_FLUSH_MAX = int(os.getenv("DATABASE_FLUSH_MAX", "200"))          # statements per batch
+DATABASE_TTL = int(os.getenv("DATABASE_TTL", str(30 * 24 * 3600)))        # files / status / results
+
+# ----------------------------
+# Background jobs (see job_queue.py / worker.py)
+# ----------------------------
+JOBS_WORKER_CONCURRENCY = int(os.getenv("JOBS_WORKER_CONCURRENCY", "2"))   # jobs per worker process
+JOBS_EMBEDDED_WORKERS = int(os.getenv("JOBS_EMBEDDED_WORKERS", "1"))       # job slots inside the API
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "1.0"))         # seconds, idle queue
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "120"))         # renewed while running
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))               # pickups after worker loss
+JOBS_RESULT_TTL = int(os.getenv("JOBS_RESULT_TTL", str(7 * 24 * 3600)))    # finished jobs kept
@@ -0,0 +1,330 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.config import (
+    DATABASE_PATH,
+    DATABASE_POOL_SIZE,
+    DATABASE_FLUSH_INTERVAL,
+    DATABASE_FLUSH_MAX,
+    DATABASE_TTL,
+)
+from app.database.models import SCHEMA, EXPIRING_TABLES
+from app.utils.logger import logger
+
+
+"""
+db.py
+
+Embedded store: one SQLite file in WAL mode, shared by every API and
+worker process, so status and results are the same whichever process
+serves the request and survive restarts.
+
+- connection() / transaction() — pooled connections (DATABASE_POOL_SIZE
+                                 per process); transaction() takes the
+                                 write lock up front (BEGIN IMMEDIATE)
+- write(sql, params)           — buffered write; a background thread
+                                 commits the buffer in one transaction
+                                 every DATABASE_FLUSH_INTERVAL seconds
+                                 (or DATABASE_FLUSH_MAX statements)
+- flush()                      — commits the buffer now
+
+Store API (tables in models.py):
+- save_file / get_file              — upload metadata
+- set_file_status / get_file_status — current status + stage timestamps;
+                                      final states are written through
+- save_analysis / get_analysis      — /analyze results
+- save_checkpoint / load_checkpoints / clear_checkpoints
+                                    — finished units of a long task
+                                      (scope + key), buffered writes
+- cleanup_expired()                 — deletes rows older than DATABASE_TTL
+
+All functions are blocking; call them through run_io from async code.
+"""
+
+# statuses written through immediately instead of buffered
+FINAL_STATUSES = {"ready", "error"}
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+_stats: Dict[str, int] = {
+    "buffered_writes": 0,
+    "flushes": 0,
+    "flushed_statements": 0,
+    "flush_errors": 0,
+    "expired_rows": 0,
+}
+
+
+# --------------------------------------------------------------
+# Connections
+# --------------------------------------------------------------
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+
+    os.makedirs(os.path.dirname(DATABASE_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+
+    with _schema_lock:
+        if not _schema_ready:
+            conn.executescript(SCHEMA)
+            _schema_ready = True
+
+    return conn
+
+
+class _Pool:
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def get(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return _connect()
+
+        return self._idle.get()   # pool exhausted → wait for a connection
+
+    def put(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        self._idle.put(conn)
+
+
+_pool = _Pool(DATABASE_POOL_SIZE)
+
+
+@contextmanager
+def connection() -> Iterator[sqlite3.Connection]:
+    conn = _pool.get()
+    try:
+        yield conn
+    finally:
+        _pool.put(conn)
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    with connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+# --------------------------------------------------------------
+# Batched writes
+# --------------------------------------------------------------
+class _WriteBuffer:
+    def __init__(self):
+        self._items: List[Tuple[str, tuple]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()   # batches commit in order
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, sql: str, params: tuple):
+        with self._lock:
+            self._items.append((sql, params))
+            full = len(self._items) >= DATABASE_FLUSH_MAX
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+        _stats["buffered_writes"] += 1
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(DATABASE_FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                items, self._items = self._items, []
+            if not items:
+                return
+
+            try:
+                with transaction() as conn:
+                    for sql, params in items:
+                        conn.execute(sql, params)
+                _stats["flushes"] += 1
+                _stats["flushed_statements"] += len(items)
+            except Exception as e:
+                # status rows are advisory; a lost batch must not kill the writer
+                _stats["flush_errors"] += 1
+                logger.error(f"[DB] Flush of {len(items)} statements failed: {e}")
+
+
+_buffer = _WriteBuffer()
+
+
+def write(sql: str, params: tuple = ()):
+    _buffer.add(sql, params)
+
+
+def flush():
+    _buffer.flush()
+
+
+# --------------------------------------------------------------
+# Store API
+# --------------------------------------------------------------
+def save_file(file_id: str, path: str, filename: Optional[str] = None,
+              size: Optional[int] = None, content_type: Optional[str] = None):
+    now = time.time()
+    with connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO files (file_id, filename, path, size, content_type, created_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (file_id, filename, path, size, content_type, now, now + DATABASE_TTL),
+        )
+
+
+def get_file(file_id: str) -> Optional[Dict[str, Any]]:
+    with connection() as conn:
+        row = conn.execute("SELECT * FROM files WHERE file_id = ?", (file_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def set_file_status(file_id: str, status: str, detail: Optional[str] = None):
+    """
+    Records the status and when the stage was entered. Intermediate
+    stages are buffered; final statuses are committed before returning.
+    """
+    now = time.time()
+    expires = now + DATABASE_TTL
+
+    statements = [
+        (
+            "INSERT INTO file_status (file_id, status, detail, updated_at, expires_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(file_id) DO UPDATE SET status = excluded.status, detail = excluded.detail, "
+            "updated_at = excluded.updated_at, expires_at = excluded.expires_at "
+            "WHERE excluded.updated_at >= file_status.updated_at",
+            (file_id, status, detail, now, expires),
+        ),
+        (
+            "INSERT OR REPLACE INTO file_stages (file_id, stage, entered_at, expires_at) VALUES (?, ?, ?, ?)",
+            (file_id, status, now, expires),
+        ),
+    ]
+
+    for sql, params in statements:
+        write(sql, params)
+
+    if status in FINAL_STATUSES:
+        flush()
+
+
+def get_file_status(file_id: str) -> Optional[Dict[str, Any]]:
+    """
+    {"status", "detail", "updated_at", "stages": {stage: entered_at}} or None.
+    """
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT status, detail, updated_at FROM file_status WHERE file_id = ?", (file_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        stages = conn.execute(
+            "SELECT stage, entered_at FROM file_stages WHERE file_id = ? ORDER BY entered_at", (file_id,)
+        ).fetchall()
+
+    return {
+        **dict(row),
+        "stages": {stage["stage"]: stage["entered_at"] for stage in stages},
+    }
+
+
+def save_analysis(file_id: str, result: Dict[str, Any]):
+    now = time.time()
+    with connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO analysis_results (file_id, result, created_at, expires_at) VALUES (?, ?, ?, ?)",
+            (file_id, json.dumps(result, ensure_ascii=False), now, now + DATABASE_TTL),
+        )
+
+
+def get_analysis(file_id: str) -> Optional[Dict[str, Any]]:
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT result FROM analysis_results WHERE file_id = ? AND expires_at > ?", (file_id, time.time())
+        ).fetchone()
+    return json.loads(row["result"]) if row else None
+
+
+def save_checkpoint(scope: str, key: str, unit: Any, data: Any):
+    """
+    Records one finished unit (buffered: a crash loses at most the last
+    DATABASE_FLUSH_INTERVAL seconds of units).
+    """
+    write(
+        "INSERT OR REPLACE INTO checkpoints (scope, key, unit, data, expires_at) VALUES (?, ?, ?, ?, ?)",
+        (scope, key, str(unit), json.dumps(data, ensure_ascii=False), time.time() + DATABASE_TTL),
+    )
+
+
+def load_checkpoints(scope: str, key: str) -> Dict[str, Any]:
+    """
+    {unit: data} of every finished unit recorded for scope + key.
+    """
+    flush()   # units of this process still in the buffer
+    with connection() as conn:
+        rows = conn.execute(
+            "SELECT unit, data FROM checkpoints WHERE scope = ? AND key = ?", (scope, key)
+        ).fetchall()
+    return {row["unit"]: json.loads(row["data"]) for row in rows}
+
+
+def clear_checkpoints(scope: str, key: str):
+    flush()
+    with connection() as conn:
+        conn.execute("DELETE FROM checkpoints WHERE scope = ? AND key = ?", (scope, key))
+
+
+def cleanup_expired() -> int:
+    now = time.time()
+    deleted = 0
+
+    with transaction() as conn:
+        for table in EXPIRING_TABLES:
+            deleted += conn.execute(f"DELETE FROM {table} WHERE expires_at < ?", (now,)).rowcount
+
+    _stats["expired_rows"] += deleted
+    if deleted:
+        logger.info(f"[DB] Removed {deleted} expired rows")
+    return deleted
+
+
+def db_stats() -> Dict[str, Any]:
+    return {
+        **_stats,
+        "path": DATABASE_PATH,
+        "pool_size": _pool.size,
+        "pool_open": _pool._created,
+    }
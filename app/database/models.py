@@ -0,0 +1,87 @@
+"""
+models.py
+
+Tables of the embedded SQLite store (see db.py).
+
+- files            — uploaded file metadata
+- file_status      — current pipeline status per file (one row → O(1) reads)
+- file_stages      — when each stage of a file was last entered
+- analysis_results — result of /analyze per file
+- jobs             — background job queue (services/job_queue.py)
+- checkpoints      — finished units of interrupted work (OCR'd pages,
+                     generated plan days), so a restarted job resumes
+
+Every row carries an expiry (expires_at / finished_at); cleanup_expired()
+in db.py deletes what is past it.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id      TEXT PRIMARY KEY,
+    filename     TEXT,
+    path         TEXT NOT NULL,
+    size         INTEGER,
+    content_type TEXT,
+    created_at   REAL NOT NULL,
+    expires_at   REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS file_status (
+    file_id    TEXT PRIMARY KEY,
+    status     TEXT NOT NULL,
+    detail     TEXT,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS file_stages (
+    file_id    TEXT NOT NULL,
+    stage      TEXT NOT NULL,
+    entered_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (file_id, stage)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS analysis_results (
+    file_id    TEXT PRIMARY KEY,
+    result     TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    stage       TEXT,
+    progress    TEXT,
+    result      TEXT,
+    error       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    lease_until REAL,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL,
+    finished_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS checkpoints (
+    scope      TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    unit       TEXT NOT NULL,
+    data       TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (scope, key, unit)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS files_expires ON files (expires_at);
+CREATE INDEX IF NOT EXISTS file_status_expires ON file_status (expires_at);
+CREATE INDEX IF NOT EXISTS file_stages_expires ON file_stages (expires_at);
+CREATE INDEX IF NOT EXISTS analysis_results_expires ON analysis_results (expires_at);
+CREATE INDEX IF NOT EXISTS checkpoints_expires ON checkpoints (expires_at);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+# tables cleaned by expires_at
+EXPIRING_TABLES = ("files", "file_status", "file_stages", "analysis_results", "checkpoints")
@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -9,9 +11,14 @@ from app.routes import (
     health,
     studyplan,
     plan_pdf,
+    jobs,
 )
 from app.utils.logger import logger
 from app.utils.error_handler import log_exceptions
+from app.utils.executor import shutdown_executors
+from app.services.llm_gateway import close_gateway
+from app.database.db import flush as flush_db
+from app.config import JOBS_EMBEDDED_WORKERS
 
 # -------------------------------------------------------------------
 # FastAPI application
@@ -40,6 +47,33 @@ app.add_middleware(
 
 logger.info("Backend started")
 
+
+# Background job workers inside the API process (0 = separate
+# `python -m app.worker` processes only)
+_job_workers = {}
+
+
+@app.on_event("startup")
+async def on_startup():
+    if JOBS_EMBEDDED_WORKERS > 0:
+        from app.worker import start_workers
+
+        stop = asyncio.Event()
+        _job_workers["stop"] = stop
+        _job_workers["tasks"] = start_workers(JOBS_EMBEDDED_WORKERS, stop)
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if _job_workers:
+        from app.worker import stop_workers
+
+        await stop_workers(_job_workers["tasks"], _job_workers["stop"])
+
+    shutdown_executors()
+    await close_gateway()
+    flush_db()
+
 # -------------------------------------------------------------------
 # Routers
 # -------------------------------------------------------------------
@@ -50,6 +84,7 @@ app.include_router(video.router, prefix="/video", tags=["Video"])
 app.include_router(health.router, prefix="/health", tags=["Health"])
 app.include_router(studyplan.router, prefix="/studyplan", tags=["StudyPlan"])
 app.include_router(plan_pdf.router, prefix="/plan", tags=["Plan"])
+app.include_router(jobs.router, prefix="/jobs", tags=["Jobs"])
 
 
 # -------------------------------------------------------------------
@@ -1,18 +1,49 @@
+import hashlib
+import json
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-import os
-from typing import Optional, Dict
+from typing import Iterable, Optional, Tuple
 from enum import Enum
 
 from app.utils.logger import logger
-from app.services.pdf_extractor import extract_pdf_text, extract_pdf_pages
-from app.services.text_cleaner import clean_text
-from app.services.chunker import chunk_text
+from app.services.pdf_extractor import extract_pdf_document, OcrCheckpoints
+from app.services.ocr import OCR_ENGINES
+from app.services.chunker import iter_chunks
 from app.services.classifier import classify_document
 from app.services.structure_extractor import extract_structure
 from app.services.language import detect_language
 from app.services.notifier import notify_admin
-from app.config import UPLOAD_DIR
+from app.services.file_storage import find_upload
+from app.services.extraction_cache import cache_get, cache_put, file_sha256
+from app.services.analysis_artifact import (
+    load_artifact,
+    new_artifact,
+    save_artifact,
+    stage_data,
+    stage_meta,
+    iter_stage_items,
+    put_stage,
+    inputs_hash,
+    StageWriter,
+)
+from app.services.job_queue import enqueue, job_progress
+from app.database.db import (
+    set_file_status,
+    get_file_status,
+    save_analysis,
+    get_analysis,
+    save_checkpoint,
+    load_checkpoints,
+    clear_checkpoints,
+)
+from app.utils.executor import run_io
+
+# chunking of the cleaned text (artifact "chunks" stage)
+CHUNK_MAX_CHARS = 2000
+CHUNK_OVERLAP = 200
+
+# leading text used for language detection
+LANGUAGE_HEAD_CHARS = 4000
 
 router = APIRouter()
 
@@ -33,12 +64,11 @@ class TaskStatus(str, Enum):
     ERROR = "error"
 
 
-task_status: Dict[str, str] = {}
-
-
-def set_status(file_id: str, status: TaskStatus):
-    task_status[file_id] = status
+async def set_status(file_id: str, status: TaskStatus):
+    # shared store: every worker process sees the same status
+    await run_io(set_file_status, file_id, status.value)
     logger.info(f"[STATUS] {file_id} → {status}")
+    await job_progress(status.value)
 
 
 # ======================================================================
@@ -47,148 +77,378 @@ def set_status(file_id: str, status: TaskStatus):
 
 class AnalyzeRequest(BaseModel):
     file_id: str
+    ocr_engine: Optional[str] = None   # auto | vision | tesseract
 
 
 # ======================================================================
-# MAIN ANALYSIS ENDPOINT
+# ANALYSIS PIPELINE (HTTP request or background job)
 # ======================================================================
 
-@router.post("/")
-async def analyze_document(body: AnalyzeRequest):
+def write_text_stages(
+    artifact: dict,
+    clean_pages: Iterable[str],
+    pages_inputs: Optional[str],
+    pages_meta: dict,
+) -> Tuple[dict, dict]:
+    """
+    One streaming pass over the cleaned pages — one page and one chunk in
+    memory, the joined text is never built. Chunks are stored as the
+    "chunks" stage; with pages_inputs the pages are stored as the
+    "pages" stage too. Returns (pages meta, chunks meta): pages_meta plus
+    the digest of the pages (chunks input), the length of the text
+    joined with "\n\n" and its first LANGUAGE_HEAD_CHARS characters;
+    the chunk count and first chunk. Blocking: run_io.
+    """
+    pages_writer = StageWriter(artifact, "pages") if pages_inputs else None
+    chunks_writer = StageWriter(artifact, "chunks")
+
+    digest = hashlib.sha256()
+    length, head = 0, ""
+
+    def pages():
+        nonlocal length, head
+        for page in clean_pages:
+            digest.update(json.dumps(page, ensure_ascii=False).encode("utf-8") + b"\n")
+            if pages_writer:
+                pages_writer.write(page)
+            if page:
+                sep = "\n\n" if length else ""
+                length += len(sep) + len(page)
+                if len(head) < LANGUAGE_HEAD_CHARS:
+                    head = (head + sep + page)[:LANGUAGE_HEAD_CHARS]
+            yield page
+
+    first = None
+    try:
+        for chunk in iter_chunks(pages(), max_chars=CHUNK_MAX_CHARS, overlap=CHUNK_OVERLAP, separator="\n\n"):
+            chunks_writer.write(chunk)
+            if first is None:
+                first = chunk
+    except Exception:
+        for writer in (pages_writer, chunks_writer):
+            if writer:
+                writer.discard()
+        raise
+
+    pages_meta = {**pages_meta, "digest": digest.hexdigest(), "length": length, "head": head}
+    chunks_meta = {"count": chunks_writer.count, "first": first}
+
+    if pages_writer:
+        pages_writer.commit(pages_inputs, pages_meta)
+    if chunks_writer.count:
+        chunks_writer.commit(inputs_hash(pages_meta["digest"], CHUNK_MAX_CHARS, CHUNK_OVERLAP), chunks_meta)
+    else:
+        chunks_writer.discard()
+
+    return pages_meta, chunks_meta
+
+
+def ocr_checkpoints(file_hash: str, ocr_engine: Optional[str] = None) -> OcrCheckpoints:
+    """
+    OCR pages of the file in the shared store (scope "ocr", key = file
+    hash, plus the engine when one is requested explicitly): a restarted
+    job, in any worker, resumes OCR where it stopped.
+    """
+    key = f"{file_hash}:{ocr_engine}" if ocr_engine else file_hash
+    return OcrCheckpoints(
+        load=lambda: load_checkpoints("ocr", key),
+        save=lambda page, text: save_checkpoint("ocr", key, page, text),   # buffered
+        clear=lambda: clear_checkpoints("ocr", key),
+    )
+
+
+def current_pages_meta(artifact: Optional[dict], file_hash: str, ocr_engine: Optional[str] = None) -> Optional[dict]:
+    """
+    Meta of the stored pages stage if it is current and was produced by
+    the requested OCR engine (any engine when none is requested).
+    """
+    pages_meta = stage_meta(artifact, "pages", inputs_hash(file_hash))
+    if pages_meta and ocr_engine and pages_meta.get("ocr_engine") != ocr_engine:
+        return None   # another OCR engine explicitly requested
+    return pages_meta
+
+
+def load_current_analysis(file_id: str, ocr_engine: Optional[str] = None, use_cache: bool = True) -> Optional[dict]:
+    """
+    Page count, classification and structure straight from the artifact
+    when every stage they depend on is current, else None. Reads only
+    the artifact's main file: the pages / chunks blobs are checked by
+    their stored meta, never opened. Blocking — call through run_io.
+    """
+    file_path = find_upload(file_id)
+    if not file_path or not use_cache:
+        return None
+
+    file_hash = file_sha256(file_path)
+    artifact = load_artifact(file_id, file_hash)
+
+    pages_meta = current_pages_meta(artifact, file_hash, ocr_engine)
+    if pages_meta is None:
+        return None
+
+    chunks_inputs = inputs_hash(pages_meta["digest"], CHUNK_MAX_CHARS, CHUNK_OVERLAP)
+    chunks_meta = stage_meta(artifact, "chunks", chunks_inputs)
+    if chunks_meta is None:
+        return None
+
+    analysis = stage_data(artifact, "classification", inputs_hash(chunks_meta["first"]))
+    structure = stage_data(artifact, "structure", inputs_hash(file_hash))
+    if analysis is None or structure is None:
+        return None
+
+    return {
+        "pages": pages_meta["page_count"],
+        "analysis": analysis,
+        "structure": structure,
+    }
+
 
-    file_id = body.file_id
+async def run_analysis(file_id: str, ocr_engine: Optional[str] = None, use_cache: bool = True) -> dict:
+    """
+    Full analysis of an uploaded file. Stages are reused from the file's
+    analysis artifact (analysis_artifact.py) when still current, so a
+    repeated call costs no extraction or LLM work. use_cache=False
+    re-runs the classification.
+    """
 
     logger.info(f"[ANALYZE] Start file_id={file_id}")
-    set_status(file_id, TaskStatus.ANALYZING)
+    await set_status(file_id, TaskStatus.ANALYZING)
 
     # -----------------------------------------------------------
     # 1) Locate file
     # -----------------------------------------------------------
-    file_path: Optional[str] = None
-
-    for fname in os.listdir(UPLOAD_DIR):
-        if fname.startswith(file_id):
-            file_path = os.path.join(UPLOAD_DIR, fname)
-            break
+    file_path = find_upload(file_id)
 
     if not file_path:
         await notify_admin(f"❌ File not found during analysis\nfile_id={file_id}")
-        set_status(file_id, TaskStatus.ERROR)
+        await set_status(file_id, TaskStatus.ERROR)
         raise HTTPException(status_code=404, detail="File not found")
 
     logger.info(f"[ANALYZE] File located → {file_path}")
 
     # -----------------------------------------------------------
-    # 2) Extract pages
+    # 2) Load the analysis artifact: stages whose code version and
+    #    inputs are unchanged are reused, the rest are rebuilt. Each
+    #    rebuilt stage is saved at once (checkpoint), so a restarted
+    #    job resumes after the last finished stage.
     # -----------------------------------------------------------
-    try:
-        set_status(file_id, TaskStatus.EXTRACTING)
-        pages = await extract_pdf_pages(file_path)
-        logger.info(f"[ANALYZE] extract_pdf_pages OK: {len(pages)} pages")
-    except Exception as e:
-        logger.exception(f"[ANALYZE] extract_pdf_pages failed: {e}")
-        pages = []
-        await notify_admin(f"❌ ANALYZE ERROR (extract_pdf_pages)\nfile_id={file_id}\n{e}")
+    file_hash = await run_io(file_sha256, file_path)
+    artifact = await run_io(load_artifact, file_id, file_hash) or new_artifact(file_id, file_hash)
+    rebuilt = []
+
+    async def checkpoint(name: str, inputs: str, data):
+        put_stage(artifact, name, inputs, data)
+        rebuilt.append(name)
+        await run_io(save_artifact, artifact)
 
     # -----------------------------------------------------------
-    # 3) Extract full text
+    # 3) Extract document (single pass: pages, text, scanned verdict)
     # -----------------------------------------------------------
-    set_status(file_id, TaskStatus.EXTRACTING_TEXT)
+    await set_status(file_id, TaskStatus.EXTRACTING)
+
+    pages_inputs = inputs_hash(file_hash)
+    pages_meta = await run_io(current_pages_meta, artifact, file_hash, ocr_engine)
+
+    extraction = None
+    if pages_meta is None:
+        try:
+            extraction = await extract_pdf_document(
+                file_path, ocr_engine=ocr_engine, checkpoints=ocr_checkpoints(file_hash, ocr_engine)
+            )
+            logger.info(f"[ANALYZE] extract_pdf_document OK: {extraction.page_count} pages")
+        except Exception as e:
+            logger.exception(f"[ANALYZE] extract_pdf_document failed: {e}")
+            await notify_admin(f"❌ ANALYZE ERROR (extract_pdf_document)\nfile_id={file_id}\n{e}")
 
-    try:
-        raw_text = await extract_pdf_text(file_path)
-        logger.info(f"[ANALYZE] extract_pdf_text OK ({len(raw_text)} chars)")
-    except Exception as e:
-        logger.error(f"[ANALYZE] extract_pdf_text crashed: {e}")
-        raw_text = ""
-        await notify_admin(f"❌ ANALYZE ERROR (extract_pdf_text)\nfile_id={file_id}\n{e}")
-
-    if not raw_text.strip():
-        if pages:
-            raw_text = "\n\n".join([p.get("text", "") for p in pages])
-
-    if not raw_text.strip():
+    # -----------------------------------------------------------
+    # 4) Check that any text was extracted
+    # -----------------------------------------------------------
+    await set_status(file_id, TaskStatus.EXTRACTING_TEXT)
+
+    if pages_meta is None and not (extraction and extraction.has_text()):
         await notify_admin(f"❌ ANALYZE ERROR: No text extracted\nfile_id={file_id}")
-        set_status(file_id, TaskStatus.ERROR)
+        await set_status(file_id, TaskStatus.ERROR)
         raise HTTPException(status_code=500, detail="Failed to extract text")
 
     # -----------------------------------------------------------
-    # 4) Clean text
+    # 5) Chunk cleaned pages: one streaming pass from the extraction
+    #    (or the stored pages) into the pages / chunks blobs
     # -----------------------------------------------------------
-    cleaned = clean_text(raw_text)
-    if not cleaned.strip():
-        await notify_admin(f"❌ ANALYZE ERROR (clean_text returned empty)\nfile_id={file_id}")
-        set_status(file_id, TaskStatus.ERROR)
-        raise HTTPException(status_code=500, detail="Text cleaning failed")
+    await set_status(file_id, TaskStatus.CHUNKING)
+
+    chunks_meta = None
+    if pages_meta is not None:
+        chunks_inputs = inputs_hash(pages_meta["digest"], CHUNK_MAX_CHARS, CHUNK_OVERLAP)
+        chunks_meta = await run_io(stage_meta, artifact, "chunks", chunks_inputs)
+
+    if chunks_meta is None:
+        if extraction is not None:
+            # pages still waiting for OCR are not checkpointed: the next
+            # run extracts again and resumes OCR from its page checkpoints
+            complete = extraction.complete()
+            if not complete:
+                logger.warning(
+                    f"[ANALYZE] {len(extraction.ocr_failed)} pages without OCR text → "
+                    f"pages stage not saved, retried on the next run"
+                )
+            pages_meta, chunks_meta = await run_io(
+                write_text_stages,
+                artifact,
+                extraction.iter_clean_pages(),
+                pages_inputs if complete else None,
+                {
+                    "page_count": extraction.page_count or len(extraction.page_texts),
+                    "report": extraction.report,
+                    "ocr_engine": ocr_engine,
+                },
+            )
+            rebuilt.extend(["pages"] if complete else [])
+        else:
+            pages_meta, chunks_meta = await run_io(
+                write_text_stages, artifact, iter_stage_items(artifact, "pages"), None, pages_meta
+            )
+
+        if not chunks_meta["count"]:
+            await notify_admin(f"❌ ANALYZE ERROR (chunking returned 0)\nfile_id={file_id}")
+            await set_status(file_id, TaskStatus.ERROR)
+            raise HTTPException(status_code=500, detail="Chunking failed")
+
+        rebuilt.append("chunks")
+        await run_io(save_artifact, artifact)
 
     # -----------------------------------------------------------
-    # 4.1 Language detection
+    # 6) Language detection
     # -----------------------------------------------------------
-    try:
-        language = detect_language(cleaned)
-        logger.info(f"[ANALYZE] Language → {language}")
-    except Exception as e:
-        logger.error(f"[ANALYZE] Language detection failed: {e}")
-        language = "en"
+    head = pages_meta["head"]
+    language_inputs = inputs_hash(head)
+    language = stage_data(artifact, "language", language_inputs)
+
+    if language is None:
+        language = await run_io(cache_get, file_hash, "language")
+
+        if language:
+            logger.info(f"[ANALYZE] Language (cached) → {language}")
+        else:
+            try:
+                language = await detect_language(head)
+                logger.info(f"[ANALYZE] Language → {language}")
+                await run_io(cache_put, file_hash, language=language)
+            except Exception as e:
+                logger.error(f"[ANALYZE] Language detection failed: {e}")
+                language = "en"
+
+        await checkpoint("language", language_inputs, language)
 
     # -----------------------------------------------------------
-    # 5) Chunk text
+    # 7) Classification
     # -----------------------------------------------------------
-    set_status(file_id, TaskStatus.CHUNKING)
+    await set_status(file_id, TaskStatus.CLASSIFYING)
 
-    chunks = chunk_text(cleaned, max_chars=2000, overlap=200)
-    if not chunks:
-        await notify_admin(f"❌ ANALYZE ERROR (chunk_text returned 0)\nfile_id={file_id}")
-        set_status(file_id, TaskStatus.ERROR)
-        raise HTTPException(status_code=500, detail="Chunking failed")
+    first_chunk = chunks_meta["first"]
+    classification_inputs = inputs_hash(first_chunk)
+    analysis = stage_data(artifact, "classification", classification_inputs) if use_cache else None
 
-    # -----------------------------------------------------------
-    # 6) Classification
-    # -----------------------------------------------------------
-    set_status(file_id, TaskStatus.CLASSIFYING)
+    if analysis is None:
+        try:
+            analysis = await classify_document(first_chunk, cache=use_cache)
+        except Exception as e:
+            await notify_admin(f"❌ ANALYZE ERROR (classify_document)\nfile_id={file_id}\n{e}")
+            await set_status(file_id, TaskStatus.ERROR)
+            raise HTTPException(status_code=500, detail="Classification failed")
 
-    try:
-        analysis = classify_document(chunks[0])
-    except Exception as e:
-        await notify_admin(f"❌ ANALYZE ERROR (classify_document)\nfile_id={file_id}\n{e}")
-        set_status(file_id, TaskStatus.ERROR)
-        raise HTTPException(status_code=500, detail="Classification failed")
+        await checkpoint("classification", classification_inputs, analysis)
 
     # -----------------------------------------------------------
-    # 7) Extract structure
+    # 8) Extract structure
     # -----------------------------------------------------------
-    set_status(file_id, TaskStatus.STRUCTURE)
+    await set_status(file_id, TaskStatus.STRUCTURE)
 
-    try:
-        structure = extract_structure(file_path) or []
-    except Exception as e:
-        logger.error(f"[ANALYZE] Structure extractor failed: {e}")
-        structure = []
-        await notify_admin(
-            f"⚠️ ANALYZE WARNING: structure extraction failed\nfile_id={file_id}\n{e}"
-        )
+    structure_inputs = inputs_hash(file_hash)
+    structure = stage_data(artifact, "structure", structure_inputs)
 
-    # -----------------------------------------------------------
-    # 8) Done
-    # -----------------------------------------------------------
-    set_status(file_id, TaskStatus.READY)
+    if structure is None:
+        try:
+            structure = await run_io(extract_structure, file_path, extraction=extraction) or []
+            await checkpoint("structure", structure_inputs, structure)
+        except Exception as e:
+            logger.error(f"[ANALYZE] Structure extractor failed: {e}")
+            structure = []
+            await notify_admin(
+                f"⚠️ ANALYZE WARNING: structure extraction failed\nfile_id={file_id}\n{e}"
+            )
 
-    logger.info(
-        f"[ANALYZE] DONE → len={len(cleaned)}, chunks={len(chunks)}, pages={len(pages)}, lang={language}"
-    )
+    logger.info(f"[ANALYZE] Stages rebuilt: {rebuilt or 'none'} (artifact {file_id}_analysis.json)")
 
-    return {
+    # -----------------------------------------------------------
+    # 9) Done — result stored before READY, so READY implies a result
+    # -----------------------------------------------------------
+    result = {
         "status": "ok",
         "file_id": file_id,
-        "total_length": len(cleaned),
-        "chunks_count": len(chunks),
-        "pages": len(pages),
+        "total_length": pages_meta["length"],
+        "chunks_count": chunks_meta["count"],
+        "pages": pages_meta["page_count"],
         "analysis": analysis,
         "structure": structure,
         "language": language,
+        "extraction": pages_meta["report"],
+        "rebuilt_stages": rebuilt,
     }
+    await run_io(save_analysis, file_id, result)
+
+    await set_status(file_id, TaskStatus.READY)
+
+    logger.info(
+        f"[ANALYZE] DONE → len={pages_meta['length']}, chunks={chunks_meta['count']}, "
+        f"pages={pages_meta['page_count']}, lang={language}"
+    )
+
+    return result
+
+
+# ======================================================================
+# ENDPOINTS
+# ======================================================================
+
+def _check_ocr_engine(ocr_engine: Optional[str]):
+    if ocr_engine and ocr_engine not in OCR_ENGINES:
+        raise HTTPException(status_code=400, detail=f"Unknown ocr_engine: {ocr_engine}")
+
+
+@router.post("/")
+async def analyze_document(body: AnalyzeRequest):
+    _check_ocr_engine(body.ocr_engine)
+    return await run_analysis(body.file_id, ocr_engine=body.ocr_engine)
+
+
+@router.post("/jobs", status_code=202)
+async def analyze_document_job(body: AnalyzeRequest):
+    """
+    Same analysis as POST /analyze/, run by a worker. Poll
+    GET /jobs/{job_id} for stage and result.
+    """
+    _check_ocr_engine(body.ocr_engine)
+    job_id = await run_io(enqueue, "analyze", body.model_dump())
+    return {"status": "queued", "job_id": job_id, "file_id": body.file_id, "status_url": f"/jobs/{job_id}"}
 
 
 @router.get("/status/{file_id}")
 async def get_status(file_id: str):
-    return {"file_id": file_id, "status": task_status.get(file_id, "unknown")}
+    status = await run_io(get_file_status, file_id)
+    if status is None:
+        return {"file_id": file_id, "status": "unknown"}
+
+    return {
+        "file_id": file_id,
+        "status": status["status"],
+        "updated_at": status["updated_at"],
+        "stages": status["stages"],
+    }
+
+
+@router.get("/result/{file_id}")
+async def get_result(file_id: str):
+    result = await run_io(get_analysis, file_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return result
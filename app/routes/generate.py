@@ -6,11 +6,11 @@ from app.utils.logger import logger
 from app.services.generator_prompt import build_prompt
 from app.services.openai_client import run_chat_completion
 from app.services.notifier import notify_admin
+from app.routes.analyze import run_analysis
 
 from app.config import UPLOAD_DIR
 
 import os
-import json
 
 router = APIRouter()
 
@@ -19,6 +19,7 @@ class GenerateRequest(BaseModel):
     file_id: str
     days: int
     language: Optional[str] = None   # en by default
+    use_cache: bool = True           # False → always ask the LLM again
 
 
 @router.post("/")
@@ -28,14 +29,9 @@ async def generate_plan(payload: GenerateRequest):
 
     gen_language = payload.language or "en"
 
-    analysis_path = os.path.join(UPLOAD_DIR, f"{payload.file_id}_analysis.json")
-
-    if not os.path.exists(analysis_path):
-        await notify_admin(f"❌ ERROR: Analysis file missing for {payload.file_id}")
-        raise HTTPException(status_code=404, detail="Analysis file not found")
-
-    with open(analysis_path, "r", encoding="utf-8") as f:
-        analysis_data = json.load(f)
+    # {file_id}_analysis.json — written by /analyze, rebuilt here only
+    # for the stages that are missing or stale
+    analysis_data = await run_analysis(payload.file_id, use_cache=payload.use_cache)
 
     prompt_messages = build_prompt(
         analysis=analysis_data,
@@ -44,7 +40,7 @@ async def generate_plan(payload: GenerateRequest):
     )
 
     try:
-        result_text = await run_chat_completion(prompt_messages)
+        result_text = await run_chat_completion(prompt_messages, cache=payload.use_cache)
     except Exception as e:
         await notify_admin(f"❌ OpenAI generation failed for {payload.file_id}\n{e}")
         raise HTTPException(status_code=500, detail="LLM generation failed")
@@ -1,7 +1,39 @@
 from fastapi import APIRouter
 
+from app.services.extraction_cache import cache_stats
+from app.services.ocr import ocr_engine_stats
+from app.services.llm_gateway import llm_stats
+from app.services.job_queue import queue_stats
+from app.database.db import db_stats
+from app.utils.executor import executor_stats, run_io
+
 router = APIRouter()
 
 @router.get("/")
 async def health():
     return {"status": "ok", "message": "AI StudyPlan Generator backend is running"}
+
+
+@router.get("/cache")
+async def health_cache():
+    return {"extraction_cache": cache_stats()}
+
+
+@router.get("/executor")
+async def health_executor():
+    return {"executor": executor_stats()}
+
+
+@router.get("/ocr")
+async def health_ocr():
+    return {"ocr": ocr_engine_stats()}
+
+
+@router.get("/llm")
+async def health_llm():
+    return {"llm": llm_stats()}
+
+
+@router.get("/jobs")
+async def health_jobs():
+    return {"jobs": await run_io(queue_stats), "db": db_stats()}
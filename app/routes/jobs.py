@@ -0,0 +1,18 @@
+from fastapi import APIRouter, HTTPException
+
+from app.services.job_queue import get_job
+from app.utils.executor import run_io
+
+router = APIRouter()
+
+
+@router.get("/{job_id}")
+async def get_job_status(job_id: str):
+    """
+    Job status (queued | running | done | error), current stage and
+    progress; result once done.
+    """
+    job = await run_io(get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
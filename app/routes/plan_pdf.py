@@ -10,6 +10,7 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
 from app.schemas.studyplan import PlanPdfRequest
+from app.utils.executor import run_cpu
 
 router = APIRouter()
 
@@ -54,10 +55,10 @@ def wrap_line(line: str, max_width: float) -> List[str]:
     return res
 
 
-@router.post("/pdf")
-async def generate_plan_pdf(payload: PlanPdfRequest):
+def render_plan_pdf(content: str) -> bytes:
     """
-    Принимает от фронтенда текст учебного плана и возвращает PDF-файл.
+    Рендерит текст плана в PDF (reportlab). Чистая CPU-функция —
+    вызывается через пул процессов.
     """
     buf = BytesIO()
 
@@ -75,7 +76,7 @@ async def generate_plan_pdf(payload: PlanPdfRequest):
     text_object = pdf.beginText(left_margin, page_height - top_margin)
     text_object.setFont(FONT_NAME, FONT_SIZE)
 
-    for raw_line in payload.content.splitlines():
+    for raw_line in content.splitlines():
         # заворачиваем строку по ширине
         for line in wrap_line(raw_line, max_text_width):
             # новая страница, если ушли за нижнее поле
@@ -90,7 +91,17 @@ async def generate_plan_pdf(payload: PlanPdfRequest):
     pdf.drawText(text_object)
     pdf.showPage()
     pdf.save()
-    buf.seek(0)
+
+    return buf.getvalue()
+
+
+@router.post("/pdf")
+async def generate_plan_pdf(payload: PlanPdfRequest):
+    """
+    Принимает от фронтенда текст учебного плана и возвращает PDF-файл.
+    """
+    pdf_bytes = await run_cpu(render_plan_pdf, payload.content)
+    buf = BytesIO(pdf_bytes)
 
     headers = {
         "Content-Disposition": f'attachment; filename="study-plan-{payload.days}-days.pdf"'
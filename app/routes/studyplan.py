@@ -1,19 +1,24 @@
-from typing import List
+from typing import Awaitable, Callable, Dict, List, Optional
 from fastapi import APIRouter, HTTPException
-import os
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+import asyncio
+import json
+import time
 
 from app.utils.logger import logger
-from app.services.pdf_extractor import (
-    extract_pdf_text,
-    extract_pdf_pages,
-)
-from app.services.structure_extractor import extract_structure
-from app.services.text_cleaner import clean_text
-from app.services.chunker import chunk_text
-from app.services.classifier import classify_document
-from app.services.llm_study import generate_day_plan
+from app.services.ocr import OCR_ENGINES
+from app.routes.analyze import run_analysis, load_current_analysis
+from app.services.file_storage import find_upload
+from app.services.llm_study import generate_day_plan, generate_days_plan, empty_day_plan, shared_outline
 from app.services.llm_flashcards import generate_flashcards_for_lesson
-from app.config import UPLOAD_DIR
+from app.services.structure_index import StructureIndex, day_page_ranges, estimate_text_tokens
+from app.schemas.studyplan import AnalysisBlock, PlanDay
+from app.services.job_queue import enqueue, job_progress
+from app.services.analysis_artifact import inputs_hash
+from app.database.db import save_checkpoint, load_checkpoints, clear_checkpoints
+from app.utils.executor import run_io
+from app.config import STUDYPLAN_CONCURRENCY, STUDYPLAN_BATCH_DAYS, STUDYPLAN_SSE_KEEPALIVE
 
 router = APIRouter()
 
@@ -51,123 +56,293 @@ def build_lesson_context(lesson: dict) -> str:
 # Add source_pages to each lesson
 # ---------------------------------------------------------------------
 def attach_page_links(plan_days: List[dict], pages_count: int) -> List[dict]:
-    total_days = len(plan_days)
-    if total_days == 0 or pages_count <= 0:
-        return plan_days
+    # same split as the structure slices in the day prompts
+    ranges = day_page_ranges(len(plan_days), pages_count)
 
-    pages_per_day = max(1, pages_count // total_days)
-
-    for i, lesson in enumerate(plan_days):
+    for lesson, (start, end) in zip(plan_days, ranges):
         if lesson.get("source_pages"):
             continue
 
-        start = i * pages_per_day + 1
-        end = pages_count if i == total_days - 1 else start + pages_per_day - 1
-        end = min(end, pages_count)
-
         lesson["source_pages"] = list(range(start, end + 1))
 
     return plan_days
 
 
+def is_finished_day(lesson: dict) -> bool:
+    """
+    A generated lesson, not a failed day or an empty placeholder — only
+    these are checkpointed and resumed.
+    """
+    if lesson.get("error"):
+        return False
+    return bool(lesson.get("theory") or lesson.get("goals") or lesson.get("practice"))
+
+
 # ---------------------------------------------------------------------
-# MAIN ENDPOINT
+# Day lessons (batched windows) + flashcards, under one concurrency limit
 # ---------------------------------------------------------------------
-@router.post("/study")
-async def generate_study_plan(
-    file_id: str,
-    days: int = 14,
+async def generate_days(
+    days: int,
+    analysis: dict,
+    structure: list,
+    pages_count: int = 0,
     include_flashcards: bool = False,
     flashcards_per_lesson: int = 5,
-):
-    logger.info(
-        f"[GENERATE] Request: file_id={file_id}, days={days}, "
-        f"flashcards={include_flashcards}"
+    use_cache: bool = True,
+    on_day: Optional[Callable[[dict], Awaitable[None]]] = None,
+    checkpoint_key: Optional[str] = None,
+) -> List[dict]:
+    """
+    Generates every day concurrently (at most STUDYPLAN_CONCURRENCY LLM
+    calls in flight). Days are requested STUDYPLAN_BATCH_DAYS at a time
+    in one call; days missing from a batched answer fall back to a
+    single-day call. A day's flashcards start as soon as its lesson is
+    ready. Each prompt carries only its days' slice of the structure
+    plus a short outline (StructureIndex). Lessons come back in day
+    order; a failed day becomes a placeholder lesson with "error" set
+    ("generation_failed" when the LLM call failed, "invalid_output" when
+    its answer did not parse) and does not affect the others.
+
+    on_day(lesson) is awaited as soon as a day (with its flashcards and
+    source_pages) is complete — in completion order, not day order.
+
+    With checkpoint_key every finished day is checkpointed; a rerun with
+    the same key (e.g. a job restarted after its worker died) only
+    generates the days that are missing. use_cache=False starts over.
+    """
+    slots = asyncio.Semaphore(STUDYPLAN_CONCURRENCY)
+    batch_days = max(1, STUDYPLAN_BATCH_DAYS)
+    t_start = time.perf_counter()
+
+    book = dict(
+        total_days=days,
+        document_type=analysis.get("document_type"),
+        main_topics=analysis.get("main_topics", []),
+        summary=analysis.get("summary", ""),
+        cache=use_cache,
     )
 
-    # -----------------------------------------------------------------
-    # 1. Resolve file path
-    # -----------------------------------------------------------------
-    file_path = None
-    for fname in os.listdir(UPLOAD_DIR):
-        if fname.startswith(file_id):
-            file_path = os.path.join(UPLOAD_DIR, fname)
-            break
+    # outline is part of the shared prompt prefix; sections are per call
+    index = StructureIndex(structure, days, pages_count)
+    book["outline"] = shared_outline(
+        index, days, book["document_type"], book["main_topics"], book["summary"]
+    )
+    page_ranges = day_page_ranges(days, pages_count)
+    finished: List[int] = []
+
+    async def single_day(day: int) -> dict:
+        # call_llm raises once the gateway gives up; bad JSON comes back
+        # from generate_day_plan already marked with "error"
+        try:
+            async with slots:
+                lesson = await generate_day_plan(day_number=day, sections=index.sections_for([day]), **book)
+        except Exception as e:
+            logger.error(f"[GENERATE] Day {day} failed: {e}")
+            return {**empty_day_plan(day), "error": "generation_failed"}
+
+        if lesson.get("error"):
+            logger.error(f"[GENERATE] Day {day} failed: {lesson['error']}")
+        return lesson
+
+    async def add_flashcards(day: int, lesson: dict) -> dict:
+        ctx = build_lesson_context(lesson)
+        if not ctx.strip():
+            return lesson
+
+        try:
+            async with slots:
+                lesson["flashcards"] = await generate_flashcards_for_lesson(
+                    content=ctx,
+                    language=analysis.get("language", "en"),
+                    count=flashcards_per_lesson,
+                    cache=use_cache,
+                )
+        except Exception as e:
+            logger.error(f"[GENERATE] Flashcards for day {day} failed: {e}")
+            lesson["flashcards"] = []
 
-    if not file_path:
-        raise HTTPException(status_code=404, detail="File not found")
+        return lesson
 
-    # -----------------------------------------------------------------
-    # 2. Extract structure (chapters, headings)
-    # -----------------------------------------------------------------
-    structure = extract_structure(file_path) or []
+    async def finish_day(day: int, lesson: dict) -> dict:
+        # Add flashcards if requested
+        if include_flashcards:
+            lesson = await add_flashcards(day, lesson)
+
+        if page_ranges and not lesson.get("source_pages"):
+            start, end = page_ranges[day - 1]
+            lesson["source_pages"] = list(range(start, end + 1))
+
+        if checkpoint_key and is_finished_day(lesson):
+            save_checkpoint("plan_days", checkpoint_key, day, lesson)   # buffered
+
+        finished.append(day)
+        await job_progress("generating", len(finished), days)
+
+        if on_day is not None:
+            await on_day(lesson)
+        return lesson
+
+    async def one_window(window: List[int]) -> List[dict]:
+        lessons = {}
+
+        if len(window) > 1:
+            try:
+                async with slots:
+                    lessons = await generate_days_plan(
+                        first_day=window[0],
+                        last_day=window[-1],
+                        sections=index.sections_for(window),
+                        **book,
+                    )
+            except Exception as e:
+                logger.error(f"[GENERATE] Days {window[0]}-{window[-1]} failed: {e}")
+
+        missing = [day for day in window if day not in lessons]
+        if missing and len(window) > 1:
+            logger.warning(f"[GENERATE] Single-day fallback for days {missing}")
+
+        fallback = await asyncio.gather(*(single_day(day) for day in missing))
+        lessons.update(zip(missing, fallback))
+
+        return list(await asyncio.gather(*(finish_day(day, lessons[day]) for day in window)))
+
+    # --- days finished by an interrupted earlier run ---
+    done: Dict[int, dict] = {}
+    if checkpoint_key and use_cache:
+        saved = await run_io(load_checkpoints, "plan_days", checkpoint_key)
+        # placeholders are regenerated (checkpoints written before failed
+        # days were marked may still hold them)
+        done = {
+            int(day): lesson for day, lesson in saved.items()
+            if 1 <= int(day) <= days and is_finished_day(lesson)
+        }
+
+    if done:
+        logger.info(f"[GENERATE] Resuming: {len(done)}/{days} days from checkpoint")
+        for day in sorted(done):
+            finished.append(day)
+            if on_day is not None:
+                await on_day(done[day])
+        await job_progress("generating", len(finished), days)
+
+    # consecutive remaining days, up to batch_days per window
+    windows: List[List[int]] = []
+    for day in range(1, days + 1):
+        if day in done:
+            continue
+        if windows and windows[-1][-1] == day - 1 and len(windows[-1]) < batch_days:
+            windows[-1].append(day)
+        else:
+            windows.append([day])
+
+    if windows:
+        outline_tokens = estimate_text_tokens(book["outline"])
+        toc_tokens = [outline_tokens + estimate_text_tokens(index.sections_for(w)) for w in windows]
+        logger.info(
+            f"[GENERATE] TOC tokens per prompt: full≈{index.full_tokens} → "
+            f"sliced avg≈{sum(toc_tokens) // len(toc_tokens)}, max≈{max(toc_tokens)} "
+            f"(budget {index.budget_tokens}, shared outline≈{outline_tokens})"
+        )
 
-    # -----------------------------------------------------------------
-    # 3. Count PDF pages
-    # -----------------------------------------------------------------
-    try:
-        pages = await extract_pdf_pages(file_path)
-        pages_count = len(pages)
-    except Exception as e:
-        logger.error(f"[GENERATE] Page extraction failed: {e}")
-        pages_count = 0
+    results = await asyncio.gather(*(one_window(w) for w in windows))
 
-    # -----------------------------------------------------------------
-    # 4. Extract text — with Google OCR fallback inside
-    # -----------------------------------------------------------------
-    raw_text = await extract_pdf_text(file_path)
+    lessons = dict(done)
+    for window, window_lessons in zip(windows, results):
+        lessons.update(zip(window, window_lessons))
+    plan_days = [lessons[day] for day in range(1, days + 1)]
 
-    if not raw_text or not raw_text.strip():
-        raise HTTPException(status_code=500, detail="Failed to extract text from PDF")
+    # complete plan → its checkpoints are no longer needed
+    if checkpoint_key and all(is_finished_day(lesson) for lesson in plan_days):
+        await run_io(clear_checkpoints, "plan_days", checkpoint_key)
 
-    # -----------------------------------------------------------------
-    # 5. Clean text
-    # -----------------------------------------------------------------
-    cleaned = clean_text(raw_text)
+    logger.info(
+        f"[GENERATE] {days} days in {time.perf_counter() - t_start:.1f}s "
+        f"({len(windows)} windows of {batch_days}, concurrency={STUDYPLAN_CONCURRENCY})"
+    )
+    return plan_days
 
-    # -----------------------------------------------------------------
-    # 6. Split into chunks
-    # -----------------------------------------------------------------
-    chunks = chunk_text(cleaned, max_chars=2500, overlap=200)
-    if not chunks:
-        raise HTTPException(status_code=500, detail="Chunking failed")
 
-    # -----------------------------------------------------------------
-    # 7. Classification
-    # -----------------------------------------------------------------
-    analysis = classify_document(chunks[0])
+# ---------------------------------------------------------------------
+# Shared preparation: analysis of the file (reused from its artifact)
+# ---------------------------------------------------------------------
+async def prepare_plan(file_id: str, ocr_engine: Optional[str] = None, use_cache: bool = True) -> dict:
+    """
+    Structure, page count and classification of the file. Read from
+    the analysis artifact written by /analyze when those stages are
+    current; otherwise run_analysis rebuilds only what is missing or
+    stale. Raises HTTPException on bad input or an unreadable document.
+    """
+    if ocr_engine and ocr_engine not in OCR_ENGINES:
+        raise HTTPException(status_code=400, detail=f"Unknown ocr_engine: {ocr_engine}")
+
+    result = await run_io(load_current_analysis, file_id, ocr_engine, use_cache)
+    if result is not None:
+        logger.info(f"[GENERATE] Analysis of {file_id} is current → no rebuild")
+    else:
+        result = await run_analysis(file_id, ocr_engine=ocr_engine, use_cache=use_cache)
 
-    # -----------------------------------------------------------------
-    # 8. Generate daily lessons
-    # -----------------------------------------------------------------
-    plan_days: List[dict] = []
+    return {
+        "structure": result["structure"],
+        "pages_count": result["pages"],
+        "analysis": result["analysis"],
+    }
 
-    for day in range(1, days + 1):
-        lesson = generate_day_plan(
-            day_number=day,
-            total_days=days,
-            document_type=analysis.get("document_type"),
-            main_topics=analysis.get("main_topics", []),
-            summary=analysis.get("summary", ""),
-            structure=structure,
-        )
 
-        # Add flashcards if requested
-        if include_flashcards:
-            ctx = build_lesson_context(lesson)
-            if ctx.strip():
-                lesson["flashcards"] = generate_flashcards_for_lesson(
-                    content=ctx,
-                    language=analysis.get("language", "en"),
-                    count=flashcards_per_lesson,
-                )
+def plan_checkpoint_key(
+    file_id: str,
+    days: int,
+    include_flashcards: bool,
+    flashcards_per_lesson: int,
+    prepared: dict,
+) -> str:
+    """
+    Day checkpoints are shared only by runs of the same plan over the
+    same analysis.
+    """
+    return inputs_hash(
+        file_id,
+        days,
+        include_flashcards,
+        flashcards_per_lesson,
+        prepared["analysis"],
+        prepared["structure"],
+        prepared["pages_count"],
+    )
+
+
+# ---------------------------------------------------------------------
+# Full plan pipeline (HTTP request or background job)
+# ---------------------------------------------------------------------
+async def run_study_plan(
+    file_id: str,
+    days: int = 14,
+    include_flashcards: bool = False,
+    flashcards_per_lesson: int = 5,
+    ocr_engine: Optional[str] = None,
+    use_cache: bool = True,
+) -> dict:
+    prepared = await prepare_plan(file_id, ocr_engine=ocr_engine, use_cache=use_cache)
+    analysis = prepared["analysis"]
+    structure = prepared["structure"]
 
-        plan_days.append(lesson)
+    # -----------------------------------------------------------------
+    # 8. Generate daily lessons — concurrently, in day order
+    # -----------------------------------------------------------------
+    plan_days = await generate_days(
+        days=days,
+        analysis=analysis,
+        structure=structure,
+        pages_count=prepared["pages_count"],
+        include_flashcards=include_flashcards,
+        flashcards_per_lesson=flashcards_per_lesson,
+        use_cache=use_cache,
+        checkpoint_key=plan_checkpoint_key(file_id, days, include_flashcards, flashcards_per_lesson, prepared),
+    )
 
     # -----------------------------------------------------------------
     # 9. Map lessons → PDF pages
     # -----------------------------------------------------------------
-    plan_days = attach_page_links(plan_days, pages_count)
+    plan_days = attach_page_links(plan_days, prepared["pages_count"])
 
     logger.info("[GENERATE] Completed OK")
 
@@ -179,3 +354,179 @@ async def generate_study_plan(
         "structure": structure,
         "plan": {"days": plan_days},
     }
+
+
+# ---------------------------------------------------------------------
+# MAIN ENDPOINT
+# ---------------------------------------------------------------------
+@router.post("/study")
+async def generate_study_plan(
+    file_id: str,
+    days: int = 14,
+    include_flashcards: bool = False,
+    flashcards_per_lesson: int = 5,
+    ocr_engine: Optional[str] = None,
+    use_cache: bool = True,
+):
+    logger.info(
+        f"[GENERATE] Request: file_id={file_id}, days={days}, "
+        f"flashcards={include_flashcards}"
+    )
+
+    return await run_study_plan(
+        file_id,
+        days=days,
+        include_flashcards=include_flashcards,
+        flashcards_per_lesson=flashcards_per_lesson,
+        ocr_engine=ocr_engine,
+        use_cache=use_cache,
+    )
+
+
+# ---------------------------------------------------------------------
+# BACKGROUND JOB ENDPOINT (202 Accepted)
+# ---------------------------------------------------------------------
+@router.post("/study/jobs", status_code=202)
+async def enqueue_study_plan(
+    file_id: str,
+    days: int = 14,
+    include_flashcards: bool = False,
+    flashcards_per_lesson: int = 5,
+    ocr_engine: Optional[str] = None,
+    use_cache: bool = True,
+):
+    """
+    Same plan as /study, run by a worker. Poll GET /jobs/{job_id} for
+    stage, day progress and the result.
+    """
+    if ocr_engine and ocr_engine not in OCR_ENGINES:
+        raise HTTPException(status_code=400, detail=f"Unknown ocr_engine: {ocr_engine}")
+
+    if not find_upload(file_id):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    job_id = await run_io(enqueue, "studyplan", {
+        "file_id": file_id,
+        "days": days,
+        "include_flashcards": include_flashcards,
+        "flashcards_per_lesson": flashcards_per_lesson,
+        "ocr_engine": ocr_engine,
+        "use_cache": use_cache,
+    })
+    logger.info(f"[GENERATE] Queued job {job_id}: file_id={file_id}, days={days}")
+
+    return {"status": "queued", "job_id": job_id, "file_id": file_id, "status_url": f"/jobs/{job_id}"}
+
+
+# ---------------------------------------------------------------------
+# STREAMING ENDPOINT (Server-Sent Events)
+# ---------------------------------------------------------------------
+def _sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def _dump(schema, data: dict) -> str:
+    """
+    JSON through the response schema; raw data if the LLM output does
+    not fit it.
+    """
+    try:
+        return schema.model_validate(data).model_dump_json()
+    except ValidationError as e:
+        logger.warning(f"[GENERATE] {schema.__name__} validation failed: {e.error_count()} errors")
+        return json.dumps(data, ensure_ascii=False)
+
+
+@router.post("/study/stream")
+async def stream_study_plan(
+    file_id: str,
+    days: int = 14,
+    include_flashcards: bool = False,
+    flashcards_per_lesson: int = 5,
+    ocr_engine: Optional[str] = None,
+    use_cache: bool = True,
+):
+    """
+    Same plan as /study, as text/event-stream:
+    - "analysis" — status, file_id, days, analysis (AnalysisBlock), structure
+    - "day"      — one PlanDay per event, as soon as it is ready
+                   (completion order; use day_number to place it)
+    - "done"     — status ("ok", or "partial" when some days failed),
+                   days sent, day numbers that failed (their "day" events
+                   carry "error"; rerun to regenerate only those days)
+    - "error"    — generation aborted
+    Errors before the stream starts (missing file, no text) are regular
+    HTTP errors.
+    """
+    logger.info(
+        f"[GENERATE] Stream request: file_id={file_id}, days={days}, "
+        f"flashcards={include_flashcards}"
+    )
+
+    prepared = await prepare_plan(file_id, ocr_engine=ocr_engine, use_cache=use_cache)
+    analysis = prepared["analysis"]
+
+    async def events():
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def on_day(lesson: dict):
+            await queue.put(lesson)
+
+        task = asyncio.create_task(generate_days(
+            days=days,
+            analysis=analysis,
+            structure=prepared["structure"],
+            pages_count=prepared["pages_count"],
+            include_flashcards=include_flashcards,
+            flashcards_per_lesson=flashcards_per_lesson,
+            use_cache=use_cache,
+            on_day=on_day,
+            checkpoint_key=plan_checkpoint_key(file_id, days, include_flashcards, flashcards_per_lesson, prepared),
+        ))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+
+        head = {
+            "status": "ok",
+            "file_id": file_id,
+            "days": days,
+            "analysis": json.loads(_dump(AnalysisBlock, analysis)),
+            "structure": prepared["structure"],
+        }
+        yield _sse("analysis", json.dumps(head, ensure_ascii=False))
+
+        sent, failed = 0, []
+        try:
+            while True:
+                try:
+                    lesson = await asyncio.wait_for(queue.get(), timeout=STUDYPLAN_SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if lesson is None:
+                    break
+
+                sent += 1
+                if lesson.get("error"):
+                    failed.append(lesson["day_number"])
+                yield _sse("day", _dump(PlanDay, lesson))
+
+            await task   # re-raises a generation error
+            status = "partial" if failed else "ok"
+            yield _sse("done", json.dumps({"status": status, "days": sent, "failed_days": sorted(failed)}))
+            logger.info(f"[GENERATE] Stream completed: {sent} days, failed: {sorted(failed) or 'none'}")
+
+        except Exception as e:
+            logger.exception(f"[GENERATE] Stream failed: {e}")
+            yield _sse("error", json.dumps({"status": "error", "detail": "Plan generation failed"}))
+
+        finally:
+            # client disconnected or generation failed → stop pending LLM calls
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,5 +1,9 @@
+import os
+
 from fastapi import APIRouter, UploadFile, File, HTTPException, status
 from app.services.file_storage import save_upload_file
+from app.database.db import save_file
+from app.utils.executor import run_io
 from app.utils.logger import logger
 
 router = APIRouter()
@@ -38,6 +42,15 @@ async def upload_file(file: UploadFile = File(...)):
         file_id, saved_path = await save_upload_file(file)
         logger.info(f"File saved successfully: id={file_id}, path={saved_path}")
 
+        await run_io(
+            save_file,
+            file_id,
+            saved_path,
+            filename=file.filename,
+            size=os.path.getsize(saved_path),
+            content_type=file.content_type,
+        )
+
     except ValueError as e:
         logger.warning(f"Upload failed: invalid extension ({e})")
         raise HTTPException(
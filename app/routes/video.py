@@ -6,10 +6,8 @@ from typing import Any
 import yt_dlp
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, HttpUrl
-from openai import OpenAI
-
-# OpenAI client (expects OPENAI_API_KEY in environment)
-client = OpenAI()
+from app.utils.executor import run_io
+from app.services.llm_gateway import transcribe
 
 router = APIRouter()
 
@@ -18,6 +16,22 @@ class VideoURLRequest(BaseModel):
     url: HttpUrl
 
 
+def _download_audio(video_url: str, temp_audio_path: str):
+    ydl_opts = {
+        "format": "bestaudio/best",
+        "outtmpl": temp_audio_path,
+        "quiet": True,
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        ydl.download([video_url])
+
+
+def _read_audio(temp_audio_path: str) -> bytes:
+    with open(temp_audio_path, "rb") as audio_file:
+        return audio_file.read()
+
+
 @router.post("/analyze_url")
 async def analyze_video_url(payload: VideoURLRequest) -> dict[str, Any]:
     """
@@ -33,21 +47,11 @@ async def analyze_video_url(payload: VideoURLRequest) -> dict[str, Any]:
             temp_audio_path = tmp_file.name
 
         # Download audio
-        ydl_opts = {
-            "format": "bestaudio/best",
-            "outtmpl": temp_audio_path,
-            "quiet": True,
-        }
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([video_url])
+        await run_io(_download_audio, str(video_url), temp_audio_path)
 
         # Send audio to Whisper (OpenAI)
-        with open(temp_audio_path, "rb") as audio_file:
-            transcript = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file
-            )
+        audio = await run_io(_read_audio, temp_audio_path)
+        transcript = await transcribe((os.path.basename(temp_audio_path), audio), model="whisper-1")
 
         os.remove(temp_audio_path)
 
@@ -18,6 +18,10 @@ class PlanDay(BaseModel):
     # Новое поле: номера страниц оригинального документа,
     # к которым относится материал этого дня
     source_pages: Optional[List[int]] = None
+    # карточки для повторения (include_flashcards=true)
+    flashcards: Optional[List[QuizItem]] = None
+    # причина, если день не удалось сгенерировать (урок-заглушка)
+    error: Optional[str] = None
 
 
 class PlanBlock(BaseModel):
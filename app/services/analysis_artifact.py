@@ -0,0 +1,239 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+from app.config import UPLOAD_DIR
+from app.utils.logger import logger
+
+
+"""
+analysis_artifact.py
+
+Versioned result of the analysis pipeline, saved next to the upload as
+{file_id}_analysis.json and reused by /studyplan and /generate.
+
+Every stage is stored with the version of the code that built it and a
+hash of its inputs:
+
+    {
+      "version": ARTIFACT_VERSION,
+      "file_id": ..., "file_hash": ..., "updated_at": ts,
+      "stages": {
+        "pages":          {"version", "inputs", "blob", "meta": {"page_count", "digest",
+                                                                 "length", "head", ...}},
+        "chunks":         {"version", "inputs", "blob", "meta": {"count", "first"}},
+        "language":       {"version", "inputs", "data": "en"},
+        "classification": {"version", "inputs", "data": {...}},
+        "structure":      {"version", "inputs", "data": [...]}
+      },
+      # flattened view of the stages for readers that only need results
+      "analysis": ..., "structure": ..., "language": ..., "pages_count": ...
+    }
+
+The large stages (BLOB_STAGES: every cleaned page, every chunk) live in
+their own file, {file_id}_analysis.{stage}.jsonl, one JSON value per
+line. StageWriter streams items into it while the stage is built and
+iter_stage_items() reads them back one at a time, so neither side holds
+the document in memory. The main file only references the blob and
+keeps the small facts later stages need (meta), so saving the artifact
+after each later stage rewrites a few KB, not the document.
+
+stage_data() / stage_meta() return a stage only if both its version and
+its inputs hash still match, so a caller rebuilds exactly the stages
+that went stale. Bump a version in STAGE_VERSIONS when the code of that
+stage changes its output. StageWriter and iter_stage_items() touch the
+disk; use them through run_io from async code.
+"""
+
+ARTIFACT_VERSION = 3
+
+STAGE_VERSIONS: Dict[str, int] = {
+    "pages": 2,      # 2: only complete extractions are stored
+    "chunks": 1,
+    "language": 1,
+    "classification": 1,
+    "structure": 1,
+}
+
+# stored in a separate file each, streamed
+BLOB_STAGES = {"pages", "chunks"}
+
+_lock = threading.Lock()
+
+
+def artifact_path(file_id: str) -> str:
+    return os.path.join(UPLOAD_DIR, f"{file_id}_analysis.json")
+
+
+def _blob_path(file_id: str, name: str) -> str:
+    return os.path.join(UPLOAD_DIR, f"{file_id}_analysis.{name}.jsonl")
+
+
+def _write_json(path: str, data: Any):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def inputs_hash(*parts: Any) -> str:
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def new_artifact(file_id: str, file_hash: str) -> Dict[str, Any]:
+    return {"version": ARTIFACT_VERSION, "file_id": file_id, "file_hash": file_hash, "stages": {}}
+
+
+# --------------------------------------------------------------
+# Read / write
+# --------------------------------------------------------------
+def load_artifact(file_id: str, file_hash: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    The artifact, or None if missing, unreadable, of another format
+    version or (when file_hash is given) built from another file.
+    """
+    try:
+        with open(artifact_path(file_id), "r", encoding="utf-8") as f:
+            artifact = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"[ARTIFACT] Unreadable artifact for {file_id}: {e}")
+        return None
+
+    if artifact.get("version") != ARTIFACT_VERSION or not isinstance(artifact.get("stages"), dict):
+        logger.info(f"[ARTIFACT] {file_id}: format version changed, rebuilding")
+        return None
+
+    if file_hash and artifact.get("file_hash") != file_hash:
+        logger.info(f"[ARTIFACT] {file_id}: file changed, rebuilding")
+        return None
+
+    return artifact
+
+
+def save_artifact(artifact: Dict[str, Any]):
+    """
+    Rewrites the main file only; blob stages were written by put_stage.
+    """
+    stages = artifact["stages"]
+
+    def data(name):
+        return stages.get(name, {}).get("data")
+
+    def meta(name):
+        return stages.get(name, {}).get("meta") or {}
+
+    artifact.update({
+        "updated_at": time.time(),
+        "analysis": data("classification"),
+        "structure": data("structure") or [],
+        "language": data("language"),
+        "pages_count": meta("pages").get("page_count", 0),
+        "chunks_count": meta("chunks").get("count", 0),
+    })
+
+    with _lock:
+        _write_json(artifact_path(artifact["file_id"]), artifact)
+
+
+# --------------------------------------------------------------
+# Stages
+# --------------------------------------------------------------
+def _fresh_stage(artifact: Optional[Dict[str, Any]], name: str, inputs: str) -> Optional[Dict[str, Any]]:
+    if not artifact:
+        return None
+
+    stage = artifact["stages"].get(name)
+    if not stage:
+        return None
+
+    if stage.get("version") != STAGE_VERSIONS[name] or stage.get("inputs") != inputs:
+        logger.info(f"[ARTIFACT] {artifact['file_id']}: stage '{name}' is stale")
+        return None
+
+    return stage
+
+
+def stage_data(artifact: Optional[Dict[str, Any]], name: str, inputs: str) -> Optional[Any]:
+    """
+    Stored data of a small stage if its code version and inputs are unchanged.
+    """
+    stage = _fresh_stage(artifact, name, inputs)
+    return stage.get("data") if stage else None
+
+
+def stage_meta(artifact: Optional[Dict[str, Any]], name: str, inputs: str) -> Optional[Dict[str, Any]]:
+    """
+    Meta of a blob stage if its code version and inputs are unchanged and
+    its blob file still exists. The blob itself is not read.
+    """
+    stage = _fresh_stage(artifact, name, inputs)
+    if not stage:
+        return None
+
+    if not os.path.exists(_blob_path(artifact["file_id"], name)):
+        logger.warning(f"[ARTIFACT] {artifact['file_id']}: stage '{name}' blob missing")
+        return None
+
+    return stage.get("meta") or {}
+
+
+def iter_stage_items(artifact: Dict[str, Any], name: str) -> Iterator[Any]:
+    """
+    Items of a blob stage, read one line at a time.
+    """
+    with open(_blob_path(artifact["file_id"], name), "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def put_stage(artifact: Dict[str, Any], name: str, inputs: str, data: Any):
+    """
+    Records a rebuilt small stage (blob stages go through StageWriter).
+    """
+    artifact["stages"][name] = {"version": STAGE_VERSIONS[name], "inputs": inputs, "data": data}
+
+
+class StageWriter:
+    """
+    Streams the items of a blob stage to a temporary file, one JSON value
+    per line. commit() moves it into place and records the stage in the
+    artifact; discard() drops it.
+    """
+
+    def __init__(self, artifact: Dict[str, Any], name: str):
+        self.artifact = artifact
+        self.name = name
+        self.count = 0
+
+        self._path = _blob_path(artifact["file_id"], name)
+        self._tmp_path = f"{self._path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = open(self._tmp_path, "w", encoding="utf-8")
+
+    def write(self, item: Any):
+        self._file.write(json.dumps(item, ensure_ascii=False))
+        self._file.write("\n")
+        self.count += 1
+
+    def commit(self, inputs: str, meta: Optional[Dict[str, Any]] = None):
+        self._file.close()
+        os.replace(self._tmp_path, self._path)
+
+        self.artifact["stages"][self.name] = {
+            "version": STAGE_VERSIONS[self.name],
+            "inputs": inputs,
+            "blob": os.path.basename(self._path),
+            "meta": meta or {},
+        }
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
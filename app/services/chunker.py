@@ -1,32 +1,36 @@
-from typing import List
-from app.utils.logger import logger
+from typing import Iterable, Iterator
 
 
-def chunk_text(
-    text: str,
+def iter_chunks(
+    pieces: Iterable[str],
     max_chars: int = 2000,
-    overlap: int = 200
-) -> List[str]:
+    overlap: int = 200,
+    separator: str = "",
+) -> Iterator[str]:
     """
-    Простое посимвольное чанкирование с перекрытием.
-    max_chars — размер одного куска.
-    overlap — перекрытие между чанками, чтобы не рвать смысл.
+    Инкрементальное чанкирование потока кусков текста (например, страниц).
+    Куски склеиваются через separator (пустые пропускаются), чанки
+    отдаются по мере заполнения — в памяти держим максимум один чанк
+    плюс один кусок.
+    Результат совпадает с посимвольным разбиением separator.join(pieces)
+    на куски max_chars с перекрытием overlap.
     """
-    logger.info(f"Chunking started, length={len(text)}, max_chars={max_chars}, overlap={overlap}")
+    step = max(1, max_chars - overlap)
+    buf = ""
+    first = True
 
-    if not text:
-        return []
+    for piece in pieces:
+        if not piece:
+            continue
 
-    chunks = []
-    start = 0
-    text_length = len(text)
+        buf += piece if first else separator + piece
+        first = False
 
-    while start < text_length:
-        end = start + max_chars
-        chunk = text[start:end]
-        chunks.append(chunk)
-        # следующий чанк начинается чуть раньше конца текущего — для перекрытия
-        start = end - overlap
+        while len(buf) >= max_chars:
+            yield buf[:max_chars]
+            # следующий чанк начинается чуть раньше конца текущего — для перекрытия
+            buf = buf[step:]
 
-    logger.info(f"Chunking finished, chunks={len(chunks)}")
-    return chunks
+    while buf:
+        yield buf[:max_chars]
+        buf = buf[step:]
@@ -1,17 +1,7 @@
 import json
 import re
-from openai import OpenAI
 from app.utils.logger import logger
-from app.config import OPENAI_API_KEY, OPENAI_BASE_URL
-
-
-# ---------------------------------------------------------
-# Init OpenAI client with explicit config
-# ---------------------------------------------------------
-client = OpenAI(
-    api_key=OPENAI_API_KEY,
-    base_url=OPENAI_BASE_URL
-)
+from app.services.llm_gateway import responses_text
 
 
 def cleanup_json(text: str) -> str:
@@ -24,7 +14,15 @@ def cleanup_json(text: str) -> str:
     return text.strip()
 
 
-def classify_document(chunk: str) -> dict:
+def _is_json(text: str) -> bool:
+    try:
+        json.loads(cleanup_json(text))
+        return True
+    except ValueError:
+        return False
+
+
+async def classify_document(chunk: str, cache: bool = True) -> dict:
     """
     Classify document by providing LLM with a short text chunk.
     Must return long JSON with:
@@ -33,6 +31,8 @@ def classify_document(chunk: str) -> dict:
       - level
       - summary
       - recommended_days
+
+    The answer is served from the LLM response cache unless cache=False.
     """
 
     logger.info("[CLASSIFIER] Starting LLM classification")
@@ -56,10 +56,10 @@ Return ONLY JSON. No markdown.
 """
 
     # -----------------------------------------------------
-    # NEW OpenAI Responses API
+    # OpenAI Responses API (via the shared gateway)
     # -----------------------------------------------------
     try:
-        resp = client.responses.create(
+        raw_output = await responses_text(
             model="gpt-4.1-mini",
             input=[
                 {
@@ -73,20 +73,13 @@ Return ONLY JSON. No markdown.
             ],
             max_output_tokens=600,
             temperature=0.2,
+            cache=cache,
+            cache_if=_is_json,
         )
     except Exception as e:
         logger.error(f"[CLASSIFIER] LLM request failed: {e}")
         raise RuntimeError("LLM request failed") from e
 
-    # -----------------------------------------------------
-    # Extract text — only valid field for Responses API
-    # -----------------------------------------------------
-    try:
-        raw_output: str = resp.output_text
-    except Exception as e:
-        logger.error(f"[CLASSIFIER] Could not read resp.output_text: {e}")
-        raise ValueError("Invalid LLM response") from e
-
     if not raw_output or not raw_output.strip():
         logger.error("[CLASSIFIER] LLM returned empty output")
         raise ValueError("Empty LLM output")
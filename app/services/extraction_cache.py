@@ -0,0 +1,332 @@
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from app.config import EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_MAX_BYTES
+from app.utils.logger import logger
+
+
+"""
+extraction_cache.py
+
+Disk-backed extraction cache keyed by SHA-256 of the uploaded file bytes.
+
+The same textbook uploaded under a new file_id hashes to the same entry,
+so extraction (and OCR for scanned books) is paid only once.
+
+Entry fields:
+- pages      — number of cleaned pages; the texts are in a separate
+               file, {hash}.pages.z (zlib stream, one JSON string per
+               line), written and read page by page
+               (cache_put_pages / iter_cached_pages)
+- page_count — number of pages in the PDF
+- backend    — extractor that produced the pages (pymupdf, google_ocr, ...)
+- scanned    — True when no page had a usable text layer
+- ocr_pages  — number of pages whose text came from OCR
+- ocr_engine — OCR engine(s) used for them ("vision", "tesseract",
+               "vision+tesseract"), None without OCR
+- structure  — structure list from extract_structure
+- language   — detected language code
+
+Entries are zlib-compressed JSON files; total size (pages files
+included) is capped by EXTRACTION_CACHE_MAX_BYTES with least-recently-
+used eviction. An in-memory LRU index (file hash → bytes on disk) and a
+running total are built by one directory scan, ordered by mtime (which
+is refreshed on every read), and then kept up to date on reads and
+writes; eviction drops the oldest hashes from the index without
+listing the directory again. cache_stats() only reads these counters.
+"""
+
+
+_lock = threading.Lock()          # read-merge-write of one entry
+_index_lock = threading.Lock()    # LRU index + size total
+_index: "Optional[OrderedDict[str, int]]" = None   # file hash → bytes, oldest access first
+_disk_bytes = 0
+
+_stats: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "writes": 0,
+    "evictions": 0,
+    "ocr_pages_saved": 0,
+}
+
+# (abs path, size, mtime_ns) -> sha256, so one request hashes a file
+# once; LRU of _HASH_MEMO_ITEMS files
+_HASH_MEMO_ITEMS = 1024
+_hash_lock = threading.Lock()
+_hash_memo: "OrderedDict[tuple, str]" = OrderedDict()
+
+
+# --------------------------------------------------------------
+# File hashing
+# --------------------------------------------------------------
+def file_sha256(path: str) -> str:
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+    with _hash_lock:
+        cached = _hash_memo.get(memo_key)
+        if cached:
+            _hash_memo.move_to_end(memo_key)
+            return cached
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+
+    digest = h.hexdigest()
+    with _hash_lock:
+        _hash_memo[memo_key] = digest
+        while len(_hash_memo) > _HASH_MEMO_ITEMS:
+            _hash_memo.popitem(last=False)
+    return digest
+
+
+# --------------------------------------------------------------
+# Internal read / write
+# --------------------------------------------------------------
+def _entry_path(file_hash: str) -> str:
+    return os.path.join(EXTRACTION_CACHE_DIR, f"{file_hash}.json.z")
+
+
+def _read_entry(file_hash: str) -> Optional[Dict[str, Any]]:
+    path = _entry_path(file_hash)
+
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return None
+
+    try:
+        entry = json.loads(zlib.decompress(raw).decode("utf-8"))
+    except Exception as e:
+        logger.warning(f"[EXTRACT_CACHE] Corrupt entry {file_hash[:12]}: {e}")
+        return None
+
+    try:
+        os.utime(path)   # LRU order for the next index scan
+    except OSError:
+        pass
+    _touch(file_hash)
+
+    return entry
+
+
+def _pages_path(file_hash: str) -> str:
+    return os.path.join(EXTRACTION_CACHE_DIR, f"{file_hash}.pages.z")
+
+
+def _write_pages(file_hash: str, pages: Iterable[str]) -> int:
+    path = _pages_path(file_hash)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    compressor = zlib.compressobj(6)
+    count = 0
+
+    with open(tmp_path, "wb") as f:
+        for page in pages:
+            f.write(compressor.compress(json.dumps(page, ensure_ascii=False).encode("utf-8") + b"\n"))
+            count += 1
+        f.write(compressor.flush())
+    os.replace(tmp_path, path)
+
+    return count
+
+
+def _write_entry(file_hash: str, entry: Dict[str, Any]):
+    path = _entry_path(file_hash)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    payload = zlib.compress(json.dumps(entry, ensure_ascii=False).encode("utf-8"), 6)
+
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _load_index():
+    # one directory scan per process (caller holds _index_lock)
+    global _index, _disk_bytes
+    if _index is not None:
+        return
+
+    files: Dict[str, list] = {}
+    for fname in os.listdir(EXTRACTION_CACHE_DIR):
+        if not fname.endswith(".z"):
+            continue
+        try:
+            st = os.stat(os.path.join(EXTRACTION_CACHE_DIR, fname))
+        except OSError:
+            continue
+        seen = files.setdefault(fname.split(".", 1)[0], [0.0, 0])
+        seen[0] = max(seen[0], st.st_mtime)
+        seen[1] += st.st_size
+
+    _index = OrderedDict(
+        (file_hash, size) for file_hash, (_, size) in sorted(files.items(), key=lambda kv: kv[1][0])
+    )
+    _disk_bytes = sum(_index.values())
+
+
+def _touch(file_hash: str):
+    with _index_lock:
+        _load_index()
+        if file_hash in _index:
+            _index.move_to_end(file_hash)
+
+
+def _track_write(file_hash: str):
+    """
+    Re-measures the files of a written hash; evicts only past the cap.
+    """
+    global _disk_bytes
+    with _index_lock:
+        _load_index()
+        size = _file_size(_entry_path(file_hash)) + _file_size(_pages_path(file_hash))
+        _disk_bytes += size - _index.pop(file_hash, 0)
+        _index[file_hash] = size
+
+        if _disk_bytes > EXTRACTION_CACHE_MAX_BYTES:
+            _evict()
+
+
+def _evict():
+    # drop least recently used hashes, never the one just written
+    # (caller holds _index_lock)
+    global _disk_bytes
+    while _disk_bytes > EXTRACTION_CACHE_MAX_BYTES and len(_index) > 1:
+        file_hash, size = _index.popitem(last=False)
+        for path in (_entry_path(file_hash), _pages_path(file_hash)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        _disk_bytes -= size
+        _stats["evictions"] += 1
+
+
+# --------------------------------------------------------------
+# Public API
+# --------------------------------------------------------------
+def cache_lookup(file_hash: Optional[str], field: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns the whole cached entry if it contains field, or None on miss.
+    """
+    if not file_hash:
+        return None
+
+    entry = _read_entry(file_hash)
+
+    # pages live in their own file: an entry without it (evicted, or
+    # written before pages were streamed) is a miss
+    if entry and field == "pages":
+        try:
+            os.utime(_pages_path(file_hash))   # LRU touch
+        except OSError:
+            entry = None
+
+    if not entry or entry.get(field) is None:
+        _stats["misses"] += 1
+        logger.info(f"[EXTRACT_CACHE] MISS {field} {file_hash[:12]}")
+        return None
+
+    _stats["hits"] += 1
+    if field == "pages":
+        _stats["ocr_pages_saved"] += int(entry.get("ocr_pages") or 0)
+
+    logger.info(f"[EXTRACT_CACHE] HIT {field} {file_hash[:12]}")
+    return entry
+
+
+def cache_get(file_hash: Optional[str], field: str) -> Optional[Any]:
+    """
+    Returns a cached field for the file hash, or None on miss.
+    """
+    entry = cache_lookup(file_hash, field)
+    return entry[field] if entry else None
+
+
+def iter_cached_pages(file_hash: str) -> Iterator[str]:
+    """
+    Cached cleaned pages, decompressed and yielded one at a time.
+    """
+    decompressor = zlib.decompressobj()
+    buf = b""
+
+    with open(_pages_path(file_hash), "rb") as f:
+        for block in iter(lambda: f.read(256 * 1024), b""):
+            buf += decompressor.decompress(block)
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                yield json.loads(line)
+
+    buf += decompressor.flush()
+    for line in buf.split(b"\n"):
+        if line:
+            yield json.loads(line)
+
+
+def cache_put_pages(file_hash: Optional[str], pages: Iterable[str], **fields):
+    """
+    Streams the cleaned pages into the pages file, then merges
+    pages=<count> and fields into the entry. Never raises.
+    """
+    if not file_hash:
+        return
+
+    try:
+        count = _write_pages(file_hash, pages)
+    except Exception as e:
+        logger.warning(f"[EXTRACT_CACHE] Pages write failed {file_hash[:12]}: {e}")
+        return
+
+    cache_put(file_hash, pages=count, **fields)
+
+
+def cache_put(file_hash: Optional[str], **fields):
+    """
+    Merges fields into the entry for the file hash.
+    Never raises — a failed cache write must not fail a request.
+    """
+    if not file_hash:
+        return
+
+    try:
+        with _lock:
+            entry = _read_entry(file_hash) or {}
+            entry.update(fields)
+            _write_entry(file_hash, entry)
+            _stats["writes"] += 1
+            _track_write(file_hash)
+    except Exception as e:
+        logger.warning(f"[EXTRACT_CACHE] Write failed {file_hash[:12]}: {e}")
+
+
+def cache_stats() -> Dict[str, Any]:
+    """
+    Counters only, no disk access: entries and bytes are None until the
+    index has been built by the first read or write.
+    """
+    lookups = _stats["hits"] + _stats["misses"]
+
+    return {
+        **_stats,
+        "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+        "entries": len(_index) if _index is not None else None,
+        "bytes": _disk_bytes if _index is not None else None,
+        "max_bytes": EXTRACTION_CACHE_MAX_BYTES,
+    }
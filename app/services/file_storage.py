@@ -41,3 +41,16 @@ async def save_upload_file(file: UploadFile):
 
     print(f"[FILE] Saved OK → {saved_path}")
     return file_id, saved_path
+
+
+def find_upload(file_id: str):
+    """
+    Путь к загруженному файлу {file_id}{ext} или None.
+    Производные файлы ({file_id}_analysis.json, {file_id}_plan.json)
+    не подходят.
+    """
+    for fname in os.listdir(UPLOAD_DIR):
+        base, ext = os.path.splitext(fname)
+        if base == file_id and ext.lower() in ALLOWED_EXT:
+            return os.path.join(UPLOAD_DIR, fname)
+    return None
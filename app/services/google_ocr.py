@@ -1,71 +1,564 @@
+import asyncio
 import base64
+import hashlib
 import json
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
 import httpx
 import fitz
+from typing import Callable, Dict, List, Optional
 
-from app.config import GOOGLE_OCR_API_KEY
+from app.config import (
+    GOOGLE_OCR_API_KEY,
+    GOOGLE_VISION_ENDPOINT,
+    OCR_CONCURRENCY,
+    OCR_BATCH_SIZE,
+    OCR_MAX_RETRIES,
+    OCR_RETRY_BASE_DELAY,
+    OCR_HTTP_TIMEOUT,
+    OCR_RENDER_DPI,
+    OCR_ADAPTIVE_DPI,
+    OCR_MIN_DPI,
+    OCR_MAX_DPI,
+    OCR_MAX_PIXELS,
+    OCR_GRAYSCALE,
+    OCR_IMAGE_FORMAT,
+    OCR_JPEG_QUALITY,
+    OCR_RENDER_AHEAD,
+    OCR_PAGE_CACHE_DIR,
+    OCR_PAGE_CACHE_MAX_BYTES,
+    OCR_PAGE_CACHE_MEMORY_ITEMS,
+    OCR_VISION_COOLDOWN,
+)
 from app.utils.logger import logger
+from app.utils.executor import run_io, run_cpu
+from app.services.page_filter import blank_reason
 
-VISION_ENDPOINT = "https://vision.googleapis.com/v1/images:annotate"
 
+"""
+google_ocr.py
 
-async def google_ocr_pdf(path: str) -> str:
+Concurrent Google Vision OCR:
+- pages are packed OCR_BATCH_SIZE at a time into one images:annotate
+  request (the endpoint accepts several "requests" entries)
+- at most OCR_CONCURRENCY requests are in flight
+- 429 / 5xx / network errors are retried with exponential backoff
+  and jitter (Retry-After is honoured) instead of dropping the page
+- pages are rendered on the CPU process pool (each worker opens its own
+  fitz handle), grayscale JPEG by default, DPI adapted to page size and
+  capped by a pixel budget; up to OCR_RENDER_AHEAD batches are rendered
+  while earlier ones are being uploaded
+- blank / picture-only / speckle pages are detected from the pixmap
+  (page_filter.py) in the render worker and never uploaded
+- recognised text is cached by a hash of the rendered pixels (memory
+  LRU + size-capped disk tier): identical pages inside one document are
+  sent once, pages seen in earlier documents are not sent at all
+- when a batch still gets 429 after all retries, Vision is marked
+  rate-limited for OCR_VISION_COOLDOWN seconds (vision_rate_limited())
+  so callers can route pages to another engine
+- pages/sec, per-batch latency, upload bytes and render time per page
+  are logged; totals in ocr_stats()
+
+GOOGLE_VISION_ENDPOINT can point to a local stand-in server.
+"""
+
+VISION_ENDPOINT = GOOGLE_VISION_ENDPOINT
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_stats: Dict[str, float] = {
+    "pages": 0,
+    "failed_pages": 0,
+    "batches": 0,
+    "retries": 0,
+    "seconds": 0.0,
+    "batch_seconds": 0.0,
+    "upload_bytes": 0,
+    "render_seconds": 0.0,
+    "cache_hits_memory": 0,
+    "cache_hits_disk": 0,
+    "cache_misses": 0,
+    "duplicate_pages": 0,
+    "blank_pages": 0,
+    "rate_limited": 0,
+}
+
+# monotonic deadline until which Vision is considered rate-limited
+_rate_limited_until = 0.0
+
+
+# ---------------------------------------------------------------------
+# Page-image hash → OCR text cache
+# ---------------------------------------------------------------------
+class _PageTextCache:
+    """
+    In-memory LRU in front of a size-capped disk directory
+    (one small text file per page hash, LRU by mtime).
+    """
+
+    def __init__(self, directory: str, max_bytes: int, memory_items: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes: Optional[int] = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def _remember(self, key: str, text: str):
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                _stats["cache_hits_memory"] += 1
+                return self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)   # LRU touch
+        except OSError:
+            _stats["cache_misses"] += 1
+            return None
+
+        with self._lock:
+            self._remember(key, text)
+        _stats["cache_hits_disk"] += 1
+        return text
+
+    def put(self, key: str, text: str):
+        with self._lock:
+            self._remember(key, text)
+
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            data = text.encode("utf-8")
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"[GOOGLE OCR] Page cache write failed: {e}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_size()
+            else:
+                self._disk_bytes += len(data)
+
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan_size(self) -> int:
+        total = 0
+        for fname in os.listdir(self.directory):
+            if fname.endswith(".txt"):
+                try:
+                    total += os.path.getsize(os.path.join(self.directory, fname))
+                except OSError:
+                    pass
+        return total
+
+    def _evict(self):
+        # drop oldest files until 90% of the cap
+        entries = []
+        for fname in os.listdir(self.directory):
+            if not fname.endswith(".txt"):
+                continue
+            path = os.path.join(self.directory, fname)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+
+        self._disk_bytes = total
+
+
+_page_cache = _PageTextCache(OCR_PAGE_CACHE_DIR, OCR_PAGE_CACHE_MAX_BYTES, OCR_PAGE_CACHE_MEMORY_ITEMS)
+
+# page hash → future of the OCR request already in flight for it
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+# ---------------------------------------------------------------------
+# Rendering (CPU pool)
+# ---------------------------------------------------------------------
+def render_options() -> dict:
+    return {
+        "dpi": OCR_RENDER_DPI,
+        "adaptive_dpi": OCR_ADAPTIVE_DPI,
+        "min_dpi": OCR_MIN_DPI,
+        "max_dpi": OCR_MAX_DPI,
+        "max_pixels": OCR_MAX_PIXELS,
+        "grayscale": OCR_GRAYSCALE,
+        "format": OCR_IMAGE_FORMAT,
+        "jpeg_quality": OCR_JPEG_QUALITY,
+    }
+
+
+def _page_dpi(rect, options: dict) -> int:
+    """
+    Adaptive DPI: fill the pixel budget (small pages get more DPI, large
+    pages less), clamped to [min_dpi, max_dpi]; never exceed the budget.
+    """
+    area_in2 = max(1e-6, (rect.width / 72) * (rect.height / 72))
+    budget_dpi = math.sqrt(options["max_pixels"] / area_in2)
+
+    if options["adaptive_dpi"]:
+        dpi = max(options["min_dpi"], min(options["max_dpi"], budget_dpi))
+    else:
+        dpi = options["dpi"]
+
+    return max(36, int(min(dpi, budget_dpi)))
+
+
+def _render_pages(path: str, page_numbers: List[int], options: dict) -> List[dict]:
+    """
+    Renders pages to base64 images. Runs in a worker process.
+    """
+    colorspace = fitz.csGRAY if options["grayscale"] else fitz.csRGB
+    rendered = []
+
+    doc = fitz.open(path)
+    try:
+        for page_number in page_numbers:
+            t0 = time.perf_counter()
+            page = doc[page_number - 1]
+            dpi = _page_dpi(page.rect, options)
+
+            pix = page.get_pixmap(dpi=dpi, colorspace=colorspace, alpha=False)
+
+            reason = blank_reason(pix)
+            if reason:
+                rendered.append({
+                    "page": page_number,
+                    "blank": reason,
+                    "bytes": 0,
+                    "dpi": dpi,
+                    "render_ms": round((time.perf_counter() - t0) * 1000, 1),
+                })
+                continue
+
+            pixel_hash = hashlib.sha256(pix.samples)
+            pixel_hash.update(f"{pix.width}x{pix.height}x{pix.n}".encode())
+
+            if options["format"] == "png":
+                img_bytes = pix.tobytes("png")
+            else:
+                img_bytes = pix.tobytes("jpeg", jpg_quality=options["jpeg_quality"])
+
+            rendered.append({
+                "page": page_number,
+                "hash": pixel_hash.hexdigest(),
+                "b64": base64.b64encode(img_bytes).decode("ascii"),
+                "bytes": len(img_bytes),
+                "dpi": dpi,
+                "size": (pix.width, pix.height),
+                "render_ms": round((time.perf_counter() - t0) * 1000, 1),
+            })
+    finally:
+        doc.close()
+
+    return rendered
+
+
+def _page_count(path: str) -> int:
+    doc = fitz.open(path)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def _parse_annotate_response(js: dict, count: int) -> List[Optional[str]]:
     """
-    Convert PDF → JPG per page → Google Vision OCR → merged text.
-    Works even with heavy scanned textbooks.
+    One text per image; None where Vision reported an error for that image.
+    """
+    responses = js.get("responses") or []
+    texts: List[Optional[str]] = []
+
+    for i in range(count):
+        item = responses[i] if i < len(responses) else {}
+
+        if "error" in item:
+            logger.error(f"[GOOGLE OCR] Image error: {item['error'].get('message')}")
+            texts.append(None)
+            continue
+
+        texts.append((item.get("fullTextAnnotation") or {}).get("text", ""))
+
+    return texts
+
+
+def _retry_delay(attempt: int, resp: Optional[httpx.Response]) -> float:
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+
+    delay = OCR_RETRY_BASE_DELAY * (2 ** attempt)
+    return delay + random.uniform(0, delay / 2)
+
+
+async def _annotate_batch(client: httpx.AsyncClient, images_b64: List[str]) -> List[Optional[str]]:
+    """
+    Sends several page images in one images:annotate request.
+    Retries on 429 / 5xx / network errors; returns None for pages
+    that still failed.
+    """
+    request_body = {
+        "requests": [
+            {
+                "image": {"content": img_b64},
+                "features": [{"type": "DOCUMENT_TEXT_DETECTION"}],
+            }
+            for img_b64 in images_b64
+        ]
+    }
+
+    params = {"key": GOOGLE_OCR_API_KEY}
+
+    for attempt in range(OCR_MAX_RETRIES + 1):
+        resp = None
+        try:
+            resp = await client.post(VISION_ENDPOINT, params=params, json=request_body)
+        except httpx.TransportError as e:
+            logger.warning(f"[GOOGLE OCR] Network error: {e}")
+        else:
+            if resp.status_code == 200:
+                return _parse_annotate_response(resp.json(), len(images_b64))
+
+            if resp.status_code not in RETRY_STATUSES:
+                logger.error(f"[GOOGLE OCR] HTTP {resp.status_code}: {resp.text[:200]}")
+                return [None] * len(images_b64)
+
+            logger.warning(f"[GOOGLE OCR] HTTP {resp.status_code}")
+
+        if attempt == OCR_MAX_RETRIES:
+            break
+
+        delay = _retry_delay(attempt, resp)
+        _stats["retries"] += 1
+        logger.warning(f"[GOOGLE OCR] Retry {attempt + 1}/{OCR_MAX_RETRIES} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    if resp is not None and resp.status_code == 429:
+        _mark_rate_limited()
+
+    logger.error(f"[GOOGLE OCR] Batch of {len(images_b64)} pages failed after retries")
+    return [None] * len(images_b64)
+
+
+def _mark_rate_limited():
+    global _rate_limited_until
+    _rate_limited_until = time.monotonic() + OCR_VISION_COOLDOWN
+    _stats["rate_limited"] += 1
+    logger.warning(f"[GOOGLE OCR] Rate-limited, cooling down for {OCR_VISION_COOLDOWN:.0f}s")
+
+
+def vision_rate_limited() -> bool:
+    return time.monotonic() < _rate_limited_until
+
+
+async def google_ocr_pages(
+    path: str,
+    pages: Optional[List[int]] = None,
+    on_page: Optional[Callable[[int, str], None]] = None,
+    skipped: Optional[List[int]] = None,
+) -> Dict[int, str]:
+    """
+    OCR only the given 1-based pages (all pages if None).
+    Returns {page_number: text}; pages that failed or were skipped as
+    blank are missing (blank page numbers are appended to skipped).
+    on_page(page_number, text) is called as soon as each page is ready.
     """
 
     if not GOOGLE_OCR_API_KEY:
         logger.error("[GOOGLE OCR] Missing GOOGLE_OCR_API_KEY")
-        return ""
+        return {}
+
+    results: Dict[int, str] = {}
+
+    def emit(page_number: int, text: str):
+        results[page_number] = text
+        if on_page is not None:
+            on_page(page_number, text)
 
     try:
-        doc = fitz.open(path)
-        pages_text = []
+        page_numbers = pages if pages is not None else list(range(1, await run_io(_page_count, path) + 1))
+    except Exception as e:
+        logger.error(f"[GOOGLE OCR] Exception: {e}")
+        return results
 
-        async with httpx.AsyncClient(timeout=60) as client:
+    batches = [
+        page_numbers[i:i + OCR_BATCH_SIZE]
+        for i in range(0, len(page_numbers), OCR_BATCH_SIZE)
+    ]
+    options = render_options()
 
-            for i, page in enumerate(doc):
+    # uploads in flight + batches rendered ahead of them
+    upload_slots = asyncio.Semaphore(OCR_CONCURRENCY)
+    render_slots = asyncio.Semaphore(OCR_CONCURRENCY + OCR_RENDER_AHEAD)
 
-                # render page as image (PNG recommended)
-                pix = page.get_pixmap(dpi=180)
-                img_bytes = pix.tobytes("png")
-                img_b64 = base64.b64encode(img_bytes).decode("utf-8")
-
-                request_body = {
-                    "requests": [
-                        {
-                            "image": {"content": img_b64},
-                            "features": [{"type": "DOCUMENT_TEXT_DETECTION"}],
-                        }
-                    ]
-                }
-
-                params = {"key": GOOGLE_OCR_API_KEY}
-
-                resp = await client.post(
-                    VISION_ENDPOINT,
-                    params=params,
-                    json=request_body,
-                )
+    limits = httpx.Limits(
+        max_connections=OCR_CONCURRENCY,
+        max_keepalive_connections=OCR_CONCURRENCY,
+    )
+    t_start = time.perf_counter()
 
-                if resp.status_code != 200:
-                    logger.error(f"[GOOGLE OCR] HTTP {resp.status_code}")
-                    continue
+    try:
+        async with httpx.AsyncClient(timeout=OCR_HTTP_TIMEOUT, limits=limits) as client:
 
-                js = resp.json()
+            async def run_batch(batch: List[int]):
+                waiters = []
+                latency = 0.0
 
-                try:
-                    text = js["responses"][0]["fullTextAnnotation"]["text"]
-                except Exception:
-                    text = ""
+                async with render_slots:
+                    rendered = await run_cpu(_render_pages, path, batch, options)
+                    _log_rendered(rendered)
 
-                pages_text.append(text)
-                logger.info(f"[GOOGLE OCR] Page {i+1}/{len(doc)} OK, {len(text)} chars")
+                    # cache hits / duplicates already in flight / pages to send
+                    to_send = []
+                    blank = 0
+                    for r in rendered:
+                        if r.get("blank"):
+                            blank += 1
+                            _stats["blank_pages"] += 1
+                            if skipped is not None:
+                                skipped.append(r["page"])
+                            continue
 
-        doc.close()
-        return "\n\n".join(pages_text)
+                        cached = await run_io(_page_cache.get, r["hash"])
+                        if cached is not None:
+                            emit(r["page"], cached)
+                            continue
+
+                        pending = _inflight.get(r["hash"])
+                        if pending is not None:
+                            _stats["duplicate_pages"] += 1
+                            waiters.append((r["page"], pending))
+                            continue
+
+                        _inflight[r["hash"]] = asyncio.get_running_loop().create_future()
+                        to_send.append(r)
+
+                    if to_send:
+                        texts: List[Optional[str]] = [None] * len(to_send)
+                        try:
+                            async with upload_slots:
+                                # another batch hit the rate limit: leave these
+                                # pages to the caller's fallback engine
+                                if not vision_rate_limited():
+                                    _stats["upload_bytes"] += sum(r["bytes"] for r in to_send)
+                                    t0 = time.perf_counter()
+                                    texts = await _annotate_batch(client, [r["b64"] for r in to_send])
+                                    latency = time.perf_counter() - t0
+                        finally:
+                            for r, text in zip(to_send, texts):
+                                future = _inflight.pop(r["hash"], None)
+                                if future is not None and not future.done():
+                                    future.set_result(text)
+
+                        _stats["batches"] += 1
+                        _stats["batch_seconds"] += latency
+
+                        for r, text in zip(to_send, texts):
+                            if text is None:
+                                _stats["failed_pages"] += 1
+                                continue
+                            emit(r["page"], text)
+                            _stats["pages"] += 1
+                            await run_io(_page_cache.put, r["hash"], text)
+
+                for page_number, future in waiters:
+                    text = await future
+                    if text is not None:
+                        emit(page_number, text)
+
+                logger.info(
+                    f"[GOOGLE OCR] Pages {batch[0]}-{batch[-1]}: "
+                    f"{len(to_send)} sent, {len(batch) - len(to_send) - len(waiters) - blank} cached, "
+                    f"{len(waiters)} duplicates, {blank} blank, {latency:.2f}s"
+                )
+
+            await asyncio.gather(*(run_batch(b) for b in batches))
 
     except Exception as e:
         logger.error(f"[GOOGLE OCR] Exception: {e}")
-        return ""
+
+    elapsed = time.perf_counter() - t_start
+    _stats["seconds"] += elapsed
+
+    logger.info(
+        f"[GOOGLE OCR] {len(results)}/{len(page_numbers)} pages in {elapsed:.1f}s "
+        f"({len(results) / elapsed if elapsed else 0:.2f} pages/s, "
+        f"{len(batches)} batches)"
+    )
+    return results
+
+
+def _log_rendered(rendered: List[dict]):
+    total_bytes = sum(r["bytes"] for r in rendered)
+    _stats["render_seconds"] += sum(r["render_ms"] for r in rendered) / 1000
+
+    details = ", ".join(
+        f"p{r['page']} blank:{r['blank']}" if r.get("blank") else
+        f"p{r['page']} {r['bytes'] // 1024}KB {r['dpi']}dpi {r['render_ms']:.0f}ms"
+        for r in rendered
+    )
+    logger.info(f"[GOOGLE OCR] Rendered {len(rendered)} pages, {total_bytes // 1024}KB: {details}")
+
+
+async def google_ocr_pdf(path: str) -> List[dict]:
+    """
+    Convert PDF → image per page → Google Vision OCR.
+    Returns [{"page": n, "text": ...}] with real page numbers, in page
+    order; pages that failed are left out.
+    """
+    results = await google_ocr_pages(path)
+    return [{"page": p, "text": results[p]} for p in sorted(results)]
+
+
+def ocr_stats() -> Dict[str, float]:
+    batches = _stats["batches"]
+    pages_sent = _stats["pages"] + _stats["failed_pages"]
+    cache_hits = _stats["cache_hits_memory"] + _stats["cache_hits_disk"]
+    return {
+        **_stats,
+        "pages_per_sec": round(_stats["pages"] / _stats["seconds"], 2) if _stats["seconds"] else 0.0,
+        "avg_batch_ms": round(_stats["batch_seconds"] / batches * 1000, 1) if batches else 0.0,
+        "avg_upload_kb_per_page": round(_stats["upload_bytes"] / 1024 / pages_sent, 1) if pages_sent else 0.0,
+        "avg_render_ms_per_page": round(_stats["render_seconds"] / pages_sent * 1000, 1) if pages_sent else 0.0,
+        "cache_hit_rate": round(cache_hits / (cache_hits + _stats["cache_misses"]), 3)
+        if cache_hits + _stats["cache_misses"] else 0.0,
+    }
@@ -0,0 +1,223 @@
+import contextvars
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from app.config import JOBS_LEASE_SECONDS, JOBS_MAX_ATTEMPTS, JOBS_RESULT_TTL
+from app.database.db import connection, transaction
+from app.utils.logger import logger
+from app.utils.executor import run_io
+
+
+"""
+job_queue.py
+
+Durable job queue in the jobs table of the embedded store
+(database/db.py), shared by the API process and any number of worker
+processes (app/worker.py) — no external broker.
+
+Job lifecycle: queued → running → done | error
+- enqueue(kind, payload)     — new job, returns its id
+- claim(worker_id)           — atomically takes the oldest queued job,
+                               or a running one whose lease expired
+                               (its worker died); JOBS_MAX_ATTEMPTS caps
+                               how often a job is picked up
+- heartbeat(job_id)          — extends the lease of a running job
+- complete / fail            — final state with result JSON / error
+- release(job_id)            — back to queued (worker shutting down)
+- job_progress(stage, ...)   — stage + done/total of the job running in
+                               the current context (no-op outside a job)
+- get_job(job_id)            — status, stage, progress, result
+
+Finished jobs are deleted JOBS_RESULT_TTL seconds after they finish.
+All functions except job_progress are blocking; call them through
+run_io from async code.
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+_current_job: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_job", default=None)
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "job_id": row["id"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "stage": row["stage"],
+        "progress": json.loads(row["progress"]) if row["progress"] else None,
+        "attempts": row["attempts"],
+        "error": row["error"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "finished_at": row["finished_at"],
+    }
+
+
+def _execute(sql: str, params: tuple = ()) -> int:
+    with connection() as conn:
+        return conn.execute(sql, params).rowcount
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# --------------------------------------------------------------
+# Public API
+# --------------------------------------------------------------
+def enqueue(kind: str, payload: Dict[str, Any]) -> str:
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    _execute(
+        "INSERT INTO jobs (id, kind, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (job_id, kind, json.dumps(payload, ensure_ascii=False), QUEUED, now, now),
+    )
+    logger.info(f"[JOBS] Enqueued {kind} job {job_id}")
+    return job_id
+
+
+def claim(worker_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Takes the next job for this worker: {"job_id", "kind", "payload",
+    "attempts"}, or None when the queue is empty.
+    """
+    now = time.time()
+
+    # BEGIN IMMEDIATE: one writer at a time → no double claims
+    with transaction() as conn:
+        # jobs of dead workers that already used up their attempts
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ?, updated_at = ? "
+            "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+            (ERROR, "worker lost", now, now, RUNNING, now, JOBS_MAX_ATTEMPTS),
+        )
+
+        row = conn.execute(
+            "SELECT id, kind, payload, attempts FROM jobs "
+            "WHERE status = ? OR (status = ? AND lease_until < ?) "
+            "ORDER BY created_at LIMIT 1",
+            (QUEUED, RUNNING, now),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        conn.execute(
+            "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, "
+            "lease_until = ?, updated_at = ? WHERE id = ?",
+            (RUNNING, worker_id, now + JOBS_LEASE_SECONDS, now, row["id"]),
+        )
+
+    if row["attempts"]:
+        logger.warning(f"[JOBS] Re-running job {row['id']} (attempt {row['attempts'] + 1})")
+
+    return {
+        "job_id": row["id"],
+        "kind": row["kind"],
+        "payload": json.loads(row["payload"]),
+        "attempts": row["attempts"] + 1,
+    }
+
+
+def heartbeat(job_id: str):
+    now = time.time()
+    _execute(
+        "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND status = ?",
+        (now + JOBS_LEASE_SECONDS, now, job_id, RUNNING),
+    )
+
+
+def complete(job_id: str, result: Any):
+    now = time.time()
+    _execute(
+        "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_until = NULL, "
+        "finished_at = ?, updated_at = ? WHERE id = ?",
+        (DONE, json.dumps(result, ensure_ascii=False), now, now, job_id),
+    )
+
+
+def fail(job_id: str, error: str):
+    now = time.time()
+    _execute(
+        "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, "
+        "finished_at = ?, updated_at = ? WHERE id = ?",
+        (ERROR, error, now, now, job_id),
+    )
+
+
+def release(job_id: str):
+    """
+    Puts a running job back in the queue (graceful worker shutdown); the
+    interrupted attempt is not counted.
+    """
+    _execute(
+        "UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL, "
+        "attempts = MAX(0, attempts - 1), updated_at = ? WHERE id = ? AND status = ?",
+        (QUEUED, time.time(), job_id, RUNNING),
+    )
+
+
+def set_progress(job_id: str, stage: str, progress: Optional[Dict[str, Any]] = None):
+    _execute(
+        "UPDATE jobs SET stage = ?, progress = ?, updated_at = ? WHERE id = ?",
+        (stage, json.dumps(progress) if progress else None, time.time(), job_id),
+    )
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with connection() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def purge_finished() -> int:
+    return _execute(
+        "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+        (DONE, ERROR, time.time() - JOBS_RESULT_TTL),
+    )
+
+
+def queue_stats() -> Dict[str, int]:
+    with connection() as conn:
+        rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+    return {row["status"]: row["n"] for row in rows}
+
+
+# --------------------------------------------------------------
+# Progress of the job running in the current context
+# --------------------------------------------------------------
+def set_current_job(job_id: Optional[str]) -> contextvars.Token:
+    return _current_job.set(job_id)
+
+
+def reset_current_job(token: contextvars.Token):
+    _current_job.reset(token)
+
+
+def current_job() -> Optional[str]:
+    return _current_job.get()
+
+
+async def job_progress(stage: str, done: Optional[int] = None, total: Optional[int] = None):
+    """
+    Records the stage of the current job. Never raises — progress
+    reporting must not fail the pipeline.
+    """
+    job_id = _current_job.get()
+    if job_id is None:
+        return
+
+    progress = {"done": done, "total": total} if total is not None else None
+    try:
+        await run_io(set_progress, job_id, stage, progress)
+    except Exception as e:
+        logger.warning(f"[JOBS] Progress update failed for {job_id}: {e}")
@@ -1,6 +1,4 @@
-from openai import OpenAI
-
-client = OpenAI()
+from app.services.llm_gateway import chat_text
 
 SYSTEM_PROMPT = """
 You are a language detector.
@@ -8,14 +6,14 @@ Respond ONLY with the language name in English
 (e.g. "Russian", "English", "German", "Spanish").
 """
 
-def detect_language(text: str) -> str:
+async def detect_language(text: str) -> str:
     text = (text or "")[:4000]
 
     if not text.strip():
         return "en"
 
     try:
-        resp = client.chat.completions.create(
+        raw = await chat_text(
             model="gpt-4.1-mini",
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT},
@@ -24,7 +22,7 @@ def detect_language(text: str) -> str:
             max_tokens=3,
         )
 
-        raw = resp.choices[0].message.content.lower()
+        raw = raw.lower()
 
         if "russian" in raw or "рус" in raw:
             return "ru"
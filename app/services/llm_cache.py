@@ -0,0 +1,285 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.config import (
+    LLM_CACHE_DIR,
+    LLM_CACHE_TTL,
+    LLM_CACHE_MAX_BYTES,
+    LLM_CACHE_MEMORY_ITEMS,
+)
+from app.utils.logger import logger
+
+
+"""
+llm_cache.py
+
+LLM response cache keyed by SHA-256 of (call kind, model, parameters,
+normalized prompt). Whitespace runs in prompts are collapsed before
+hashing, so re-indented f-strings still hit.
+
+Tiers:
+- memory — LRU of LLM_CACHE_MEMORY_ITEMS entries
+- disk   — zlib-compressed JSON per key, expires after LLM_CACHE_TTL
+           seconds, total size capped by LLM_CACHE_MAX_BYTES with
+           least-recently-used eviction (mtime refreshed on read).
+           The total is tracked incrementally (one directory scan at
+           first write); the directory is only scanned again when the
+           total exceeds the cap, and then trimmed to 90% of it
+
+Entry: {"text": ..., "created": ts, "usage": {"input_tokens", "output_tokens"}}
+
+Only the output text is cached, never SDK objects. Empty outputs are
+not stored. Metrics: hits per tier, misses, bytes and tokens saved.
+"""
+
+
+_lock = threading.Lock()          # memory tier
+_disk_lock = threading.Lock()     # disk size accounting + eviction
+_memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_disk_bytes: Optional[int] = None
+
+_stats: Dict[str, int] = {
+    "hits_memory": 0,
+    "hits_disk": 0,
+    "misses": 0,
+    "writes": 0,
+    "expired": 0,
+    "evictions": 0,
+    "bytes_saved": 0,
+    "tokens_saved": 0,
+}
+
+_WS = re.compile(r"\s+")
+
+
+# --------------------------------------------------------------
+# Keys
+# --------------------------------------------------------------
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return _WS.sub(" ", value).strip()
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+def cache_key(kind: str, model: str, prompt: Any, params: Dict[str, Any]) -> str:
+    payload = json.dumps(
+        {"kind": kind, "model": model, "params": params, "prompt": _normalize(prompt)},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# --------------------------------------------------------------
+# Internal read / write
+# --------------------------------------------------------------
+def _entry_path(key: str) -> str:
+    return os.path.join(LLM_CACHE_DIR, f"{key}.json.z")
+
+
+def _remember(key: str, entry: Dict[str, Any]):
+    _memory[key] = entry
+    _memory.move_to_end(key)
+    while len(_memory) > LLM_CACHE_MEMORY_ITEMS:
+        _memory.popitem(last=False)
+
+
+def _expired(entry: Dict[str, Any]) -> bool:
+    return time.time() - float(entry.get("created") or 0) > LLM_CACHE_TTL
+
+
+def _read_entry(key: str) -> Optional[Dict[str, Any]]:
+    path = _entry_path(key)
+
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return None
+
+    try:
+        entry = json.loads(zlib.decompress(raw).decode("utf-8"))
+    except Exception as e:
+        logger.warning(f"[LLM_CACHE] Corrupt entry {key[:12]}: {e}")
+        return None
+
+    if _expired(entry):
+        _stats["expired"] += 1
+        try:
+            os.remove(path)
+            _account(-len(raw))
+        except OSError:
+            pass
+        return None
+
+    try:
+        os.utime(path)   # LRU touch
+    except OSError:
+        pass
+
+    return entry
+
+
+def _write_entry(key: str, entry: Dict[str, Any]) -> int:
+    path = _entry_path(key)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    payload = zlib.compress(json.dumps(entry, ensure_ascii=False).encode("utf-8"), 6)
+
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return len(payload)
+
+
+def _scan_size() -> int:
+    total = 0
+    for fname in os.listdir(LLM_CACHE_DIR):
+        if fname.endswith(".json.z"):
+            try:
+                total += os.path.getsize(os.path.join(LLM_CACHE_DIR, fname))
+            except OSError:
+                pass
+    return total
+
+
+def _account(delta: int):
+    global _disk_bytes
+    with _disk_lock:
+        if _disk_bytes is not None:
+            _disk_bytes = max(0, _disk_bytes + delta)
+
+
+def _track_write(size: int):
+    """
+    Adds a written entry to the disk total; evicts only past the cap.
+    """
+    global _disk_bytes
+    with _disk_lock:
+        if _disk_bytes is None:
+            _disk_bytes = _scan_size()   # includes the entry just written
+        else:
+            _disk_bytes += size
+
+        if _disk_bytes > LLM_CACHE_MAX_BYTES:
+            _evict()
+
+
+def _evict():
+    # drop oldest files until 90% of the cap (caller holds _disk_lock)
+    global _disk_bytes
+    entries = []
+
+    for fname in os.listdir(LLM_CACHE_DIR):
+        if not fname.endswith(".json.z"):
+            continue
+        path = os.path.join(LLM_CACHE_DIR, fname)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    target = int(LLM_CACHE_MAX_BYTES * 0.9)
+
+    # oldest access first
+    for _, size, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            _stats["evictions"] += 1
+        except OSError:
+            continue
+
+    _disk_bytes = total
+
+
+def _count_saved(entry: Dict[str, Any]):
+    usage = entry.get("usage") or {}
+    _stats["bytes_saved"] += len((entry.get("text") or "").encode("utf-8")) + int(entry.get("prompt_bytes") or 0)
+    _stats["tokens_saved"] += int(usage.get("input_tokens") or 0) + int(usage.get("output_tokens") or 0)
+
+
+# --------------------------------------------------------------
+# Public API
+# --------------------------------------------------------------
+def llm_cache_get(key: str) -> Optional[str]:
+    """
+    Cached output text for the key, or None on miss / expiry.
+    """
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None and _expired(entry):
+            del _memory[key]
+            entry = None
+        if entry is not None:
+            _memory.move_to_end(key)
+            _stats["hits_memory"] += 1
+            _count_saved(entry)
+            return entry["text"]
+
+    entry = _read_entry(key)
+    if entry is None:
+        _stats["misses"] += 1
+        return None
+
+    with _lock:
+        _remember(key, entry)
+    _stats["hits_disk"] += 1
+    _count_saved(entry)
+
+    logger.info(f"[LLM_CACHE] HIT {key[:12]}")
+    return entry["text"]
+
+
+def llm_cache_put(key: str, text: str, usage: Optional[Dict[str, int]] = None, prompt_bytes: int = 0):
+    """
+    Stores an output text. Never raises — a failed cache write must not
+    fail a request.
+    """
+    if not text or not text.strip():
+        return
+
+    entry = {
+        "text": text,
+        "created": time.time(),
+        "usage": usage or {},
+        "prompt_bytes": prompt_bytes,
+    }
+
+    with _lock:
+        _remember(key, entry)
+
+    try:
+        size = _write_entry(key, entry)
+        _stats["writes"] += 1
+        _track_write(size)
+    except Exception as e:
+        logger.warning(f"[LLM_CACHE] Write failed {key[:12]}: {e}")
+
+
+def llm_cache_stats() -> Dict[str, Any]:
+    hits = _stats["hits_memory"] + _stats["hits_disk"]
+    lookups = hits + _stats["misses"]
+
+    return {
+        **_stats,
+        "memory_items": len(_memory),
+        "disk_bytes": _disk_bytes,
+        "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+    }
@@ -86,13 +86,15 @@ def parse_flashcards_json(raw: str) -> List[Dict]:
 # -------------------------------------------------------------------
 # Public API
 # -------------------------------------------------------------------
-def generate_flashcards_for_lesson(
+async def generate_flashcards_for_lesson(
     content: str,
     language: str = "en",
     count: int = 5,
+    cache: bool = True,
 ) -> List[Dict]:
     """
     Generate flashcards for a lesson using the unified LLM caller.
+    cache=False bypasses the LLM response cache.
     """
     if not content.strip():
         return []
@@ -100,7 +102,7 @@ def generate_flashcards_for_lesson(
     prompt = build_flashcards_prompt(content, language, count)
 
     try:
-        raw = call_llm(prompt)
+        raw = await call_llm(prompt, cache=cache)
     except Exception as e:
         print(f"[FLASHCARDS] LLM call failed: {e}")
         return []
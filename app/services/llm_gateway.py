@@ -0,0 +1,357 @@
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+from openai import (
+    AsyncOpenAI,
+    APIConnectionError,
+    APIStatusError,
+    RateLimitError,
+)
+
+from app.config import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE,
+    LLM_CONNECT_TIMEOUT,
+    LLM_TIMEOUT,
+    LLM_TRANSCRIBE_TIMEOUT,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BASE_DELAY,
+    LLM_CACHE_ENABLED,
+)
+from app.utils.logger import logger
+from app.utils.executor import run_io
+from app.services.llm_cache import cache_key, llm_cache_get, llm_cache_put, llm_cache_stats
+from app.services.rate_limiter import acquire, settle, estimate_tokens, rate_limiter_stats
+
+
+"""
+llm_gateway.py
+
+Single async entry point for every OpenAI call:
+- one AsyncOpenAI client over one pooled httpx connection set
+  (LLM_MAX_CONNECTIONS / LLM_MAX_KEEPALIVE)
+- responses(...)  — Responses API
+- chat(...)       — Chat Completions
+- transcribe(...) — audio transcriptions (Whisper)
+- responses_text(...) / chat_text(...) — output text only, served from
+  the response cache (llm_cache.py) when the same model, parameters and
+  normalized prompt were seen before; cache=False opts a call out,
+  cache_if(text) keeps unusable answers (e.g. broken JSON) out of it
+- every attempt first passes the per-model RPM / TPM limiter
+  (rate_limiter.py); interactive callers go before background ones
+- per-call timeout (default LLM_TIMEOUT) and retries with exponential
+  backoff + jitter on 429 / 5xx / network errors (Retry-After honoured);
+  the SDK's own retries are disabled so there is one policy
+- provider prompt caching: cached input tokens are read from the usage
+  fields (input_tokens_details / prompt_tokens_details) and latency is
+  tracked separately for calls that did and did not hit the prefix cache
+- llm_stats(): calls, retries, failures, latency, token usage, cache metrics
+"""
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+_client: Optional[AsyncOpenAI] = None
+
+_stats: Dict[str, float] = {
+    "calls": 0,
+    "retries": 0,
+    "failures": 0,
+    "seconds": 0.0,
+    "input_tokens": 0,
+    "cached_tokens": 0,
+    "output_tokens": 0,
+    "prefix_hit_calls": 0,       # calls with cached_tokens > 0
+    "prefix_hit_seconds": 0.0,
+    "prefix_miss_calls": 0,
+    "prefix_miss_seconds": 0.0,
+}
+
+
+def get_client() -> AsyncOpenAI:
+    global _client
+    if _client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+        _client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            http_client=http_client,
+            max_retries=0,
+        )
+    return _client
+
+
+async def close_gateway():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+# --------------------------------------------------------------
+# Retry policy
+# --------------------------------------------------------------
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, (APIConnectionError, RateLimitError)):   # includes timeouts
+        return True
+    if isinstance(e, APIStatusError):
+        return e.status_code in RETRY_STATUSES
+    return False
+
+
+def _retry_delay(attempt: int, e: Exception) -> float:
+    response = getattr(e, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+
+    delay = LLM_RETRY_BASE_DELAY * (2 ** attempt)
+    return delay + random.uniform(0, delay / 2)
+
+
+async def _call(
+    label: str,
+    call: Callable[[], Awaitable[Any]],
+    retries: Optional[int] = None,
+    model: str = "",
+    tokens: int = 0,
+) -> Any:
+    retries = LLM_MAX_RETRIES if retries is None else retries
+
+    for attempt in range(retries + 1):
+        await acquire(model, tokens)
+
+        t0 = time.perf_counter()
+        try:
+            result = await call()
+            elapsed = time.perf_counter() - t0
+            _stats["calls"] += 1
+            _stats["seconds"] += elapsed
+
+            usage = _usage(result)
+            settle(model, tokens, usage.get("input_tokens", 0) + usage.get("output_tokens", 0))
+            if usage:
+                _record_usage(label, usage, elapsed)
+            return result
+
+        except Exception as e:
+            if attempt == retries or not _is_retryable(e):
+                _stats["failures"] += 1
+                logger.error(f"[LLM] {label} failed: {e}")
+                raise
+
+            delay = _retry_delay(attempt, e)
+            _stats["retries"] += 1
+            logger.warning(f"[LLM] {label} retry {attempt + 1}/{retries} in {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
+
+
+# --------------------------------------------------------------
+# Public API
+# --------------------------------------------------------------
+async def responses(
+    input: Any,
+    model: str = "gpt-4.1-mini",
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+    **kwargs,
+):
+    """
+    Responses API call; returns the SDK response (use .output_text).
+    """
+    client = get_client()
+    return await _call(
+        f"responses model={model}",
+        lambda: client.responses.create(
+            model=model,
+            input=input,
+            timeout=timeout or LLM_TIMEOUT,
+            **kwargs,
+        ),
+        retries,
+        model=model,
+        tokens=estimate_tokens(input, kwargs.get("max_output_tokens") or 1000),
+    )
+
+
+async def chat(
+    messages: list,
+    model: str = "gpt-4.1-mini",
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+    **kwargs,
+):
+    """
+    Chat Completions call; returns the SDK response.
+    """
+    client = get_client()
+    return await _call(
+        f"chat model={model}",
+        lambda: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            timeout=timeout or LLM_TIMEOUT,
+            **kwargs,
+        ),
+        retries,
+        model=model,
+        tokens=estimate_tokens(messages, kwargs.get("max_tokens") or 1000),
+    )
+
+
+async def transcribe(
+    file: Any,
+    model: str = "whisper-1",
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+):
+    """
+    Audio transcription; file is a (filename, bytes) tuple.
+    """
+    client = get_client()
+    return await _call(
+        f"transcribe model={model}",
+        lambda: client.audio.transcriptions.create(
+            model=model,
+            file=file,
+            timeout=timeout or LLM_TRANSCRIBE_TIMEOUT,
+        ),
+        retries,
+        model=model,
+    )
+
+
+# --------------------------------------------------------------
+# Cached text helpers
+# --------------------------------------------------------------
+def _usage(resp) -> Dict[str, int]:
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return {}
+
+    # Responses API: input_tokens_details; Chat Completions: prompt_tokens_details
+    details = getattr(usage, "input_tokens_details", None) or getattr(usage, "prompt_tokens_details", None)
+
+    return {
+        "input_tokens": getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", 0) or 0,
+        "output_tokens": getattr(usage, "output_tokens", None) or getattr(usage, "completion_tokens", 0) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+    }
+
+
+def _record_usage(label: str, usage: Dict[str, int], elapsed: float):
+    _stats["input_tokens"] += usage["input_tokens"]
+    _stats["cached_tokens"] += usage["cached_tokens"]
+    _stats["output_tokens"] += usage["output_tokens"]
+
+    if usage["cached_tokens"]:
+        _stats["prefix_hit_calls"] += 1
+        _stats["prefix_hit_seconds"] += elapsed
+    else:
+        _stats["prefix_miss_calls"] += 1
+        _stats["prefix_miss_seconds"] += elapsed
+
+    logger.info(
+        f"[LLM] {label}: in={usage['input_tokens']} cached={usage['cached_tokens']} "
+        f"out={usage['output_tokens']} {elapsed * 1000:.0f}ms"
+    )
+
+
+async def _cached_text(
+    kind: str,
+    model: str,
+    prompt: Any,
+    params: Dict[str, Any],
+    cache: bool,
+    cache_if: Optional[Callable[[str], bool]],
+    fetch: Callable[[], Awaitable[Any]],
+) -> str:
+    use_cache = cache and LLM_CACHE_ENABLED
+    key = cache_key(kind, model, prompt, params) if use_cache else None
+
+    if key:
+        cached = await run_io(llm_cache_get, key)
+        if cached is not None:
+            return cached
+
+    resp = await fetch()
+    text = _extract_text(kind, resp)
+
+    if key and text and (cache_if is None or cache_if(text)):
+        prompt_bytes = len(str(prompt).encode("utf-8"))
+        await run_io(llm_cache_put, key, text, _usage(resp), prompt_bytes)
+
+    return text
+
+
+def _extract_text(kind: str, resp) -> str:
+    if kind == "responses":
+        return (resp.output_text or "").strip()
+    return resp.choices[0].message.content or ""
+
+
+async def responses_text(
+    input: Any,
+    model: str = "gpt-4.1-mini",
+    cache: bool = True,
+    cache_if: Optional[Callable[[str], bool]] = None,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+    **kwargs,
+) -> str:
+    """
+    Responses API call returning output_text (stripped); cached unless cache=False.
+    """
+    return await _cached_text(
+        "responses", model, input, kwargs, cache, cache_if,
+        lambda: responses(input, model=model, timeout=timeout, retries=retries, **kwargs),
+    )
+
+
+async def chat_text(
+    messages: list,
+    model: str = "gpt-4.1-mini",
+    cache: bool = True,
+    cache_if: Optional[Callable[[str], bool]] = None,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+    **kwargs,
+) -> str:
+    """
+    Chat Completions call returning the first choice's content; cached
+    unless cache=False.
+    """
+    return await _cached_text(
+        "chat", model, messages, kwargs, cache, cache_if,
+        lambda: chat(messages, model=model, timeout=timeout, retries=retries, **kwargs),
+    )
+
+
+def llm_stats() -> Dict[str, Any]:
+    calls = _stats["calls"]
+    return {
+        **_stats,
+        "avg_call_ms": round(_stats["seconds"] / calls * 1000, 1) if calls else 0.0,
+        "cached_input_ratio": round(_stats["cached_tokens"] / _stats["input_tokens"], 3)
+        if _stats["input_tokens"] else 0.0,
+        "avg_prefix_hit_ms": round(_stats["prefix_hit_seconds"] / _stats["prefix_hit_calls"] * 1000, 1)
+        if _stats["prefix_hit_calls"] else 0.0,
+        "avg_prefix_miss_ms": round(_stats["prefix_miss_seconds"] / _stats["prefix_miss_calls"] * 1000, 1)
+        if _stats["prefix_miss_calls"] else 0.0,
+        "cache": llm_cache_stats(),
+        "rate_limiter": rate_limiter_stats(),
+    }
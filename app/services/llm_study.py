@@ -1,100 +1,112 @@
 from typing import List, Dict, Any
+import hashlib
 import json
 
-from openai import OpenAI
-from app.config import OPENAI_API_KEY, OPENAI_BASE_URL
 from app.utils.logger import logger
+from app.services.llm_gateway import responses_text
+from app.services.structure_index import StructureIndex, render_toc, estimate_text_tokens
+from app.config import (
+    STUDYPLAN_DAY_OUTPUT_TOKENS,
+    STUDYPLAN_MAX_OUTPUT_TOKENS,
+    STUDYPLAN_SHARED_PREFIX_TOKENS,
+)
 
 
 """
 llm_study.py
 
 Responsibilities:
-– Safe LLM call (Responses API)
-– Build prompts for daily lessons
+– LLM call (Responses API, shared async gateway); failures propagate
+– Build prompts for daily lessons (one day, or a window of days):
+  shared document context first, per-call instructions last; the
+  context is sized to STUDYPLAN_SHARED_PREFIX_TOKENS (shared_outline)
+  so it is long enough for provider-side prompt caching
 – Parse JSON with protection
 """
 
 
-# --------------------------------------------------------------
-# Init OpenAI client (explicit)
-# --------------------------------------------------------------
-client = OpenAI(
-    api_key=OPENAI_API_KEY,
-    base_url=OPENAI_BASE_URL,
-)
+SYSTEM_PROMPT = "You are an expert study planner. Always return JSON only."
 
 
 # --------------------------------------------------------------
 # Base LLM caller using Responses API
 # --------------------------------------------------------------
-def call_llm(prompt: str, model: str = "gpt-4.1-mini") -> str:
+def _is_json(text: str) -> bool:
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+
+async def call_llm(
+    prompt: str,
+    model: str = "gpt-4.1-mini",
+    max_output_tokens: int = STUDYPLAN_DAY_OUTPUT_TOKENS,
+    cache: bool = True,
+    prompt_cache_key: str | None = None,
+) -> str:
     """
-    Safe LLM call using OpenAI Responses API.
-
-    Always returns *string* (may be empty).
-    Never throws errors to FastAPI layer.
+    LLM call using OpenAI Responses API; returns the output text.
+
+    Raises when the call still fails after the gateway's retries
+    (e.g. 429 after backoff), so the caller can mark what it was
+    generating as failed instead of treating it as an empty answer.
+    Answers that are valid JSON go to the LLM response cache unless
+    cache=False.
+    prompt_cache_key groups calls that share a prompt prefix (provider-side
+    prompt caching).
     """
-    try:
-        logger.info("[LLM_STUDY] Calling LLM...")
+    logger.info("[LLM_STUDY] Calling LLM...")
+
+    extra = {"prompt_cache_key": prompt_cache_key} if prompt_cache_key else {}
 
-        resp = client.responses.create(
+    try:
+        return await responses_text(
             model=model,
             input=[
                 {
                     "role": "system",
-                    "content": "You are an expert study planner. Always return JSON only."
+                    "content": SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
                     "content": prompt
                 },
             ],
-            max_output_tokens=900,
+            max_output_tokens=max_output_tokens,
             temperature=0.4,
+            cache=cache,
+            cache_if=_is_json,
+            **extra,
         )
 
-        # Unified safe accessor
-        output = resp.output_text or ""
-        return output.strip()
-
     except Exception as e:
         logger.error(f"[LLM_STUDY] LLM call failed: {e}")
-        return ""
+        raise
 
 
 # --------------------------------------------------------------
-# Build prompt for one day lesson
+# Shared document context (prompt prefix)
 # --------------------------------------------------------------
-def _build_day_prompt(
-    day_number: int,
+def _document_context(
     total_days: int,
     document_type: str,
     main_topics: List[str],
     summary: str,
     structure: List[Dict[str, Any]] | None = None,
+    outline: str | None = None,
 ) -> str:
-
+    """
+    Document-level part of every lesson prompt. It is byte-identical for
+    all calls of one plan and always comes first, so the provider can
+    reuse its prompt-prefix cache; per-call text goes after it.
+    """
     topics_text = ", ".join(main_topics) if main_topics else "Unknown topics"
-
-    # Build TOC preview
-    if structure:
-        toc_lines = []
-        for ch in structure:
-            title = ch.get("title") or ch.get("name") or ""
-            if not title:
-                continue
-
-            page = ch.get("page") or ch.get("start_page")
-            line = f"- p.{page}: {title}" if page else f"- {title}"
-            toc_lines.append(line)
-
-        structure_text = "\n".join(toc_lines) if toc_lines else "No explicit structure."
-    else:
-        structure_text = "No explicit structure."
+    structure_text = outline if outline is not None else render_toc(structure)
 
     return f"""
-Create a detailed study lesson for DAY {day_number} of {total_days}.
+You are preparing a {total_days}-day study plan for this textbook.
 
 TEXTBOOK INFO:
 - Document type: {document_type}
@@ -105,8 +117,57 @@ SHORT SUMMARY:
 
 TABLE OF CONTENTS:
 {structure_text}
+"""
+
+
+def shared_outline(
+    index: StructureIndex,
+    total_days: int,
+    document_type: str,
+    main_topics: List[str],
+    summary: str,
+) -> str:
+    """
+    Outline for the shared prefix. Its budget is whatever the system
+    message and plan info leave up to STUDYPLAN_SHARED_PREFIX_TOKENS
+    (at least the index's default), so the prefix crosses the provider's
+    caching minimum whenever the structure has enough headings.
+    """
+    base = _document_context(total_days, document_type, main_topics, summary, outline="")
+    base_tokens = estimate_text_tokens(SYSTEM_PROMPT + base)
+
+    outline = index.outline_text(max(index.budget_tokens // 4, STUDYPLAN_SHARED_PREFIX_TOKENS - base_tokens))
+
+    prefix_tokens = base_tokens + estimate_text_tokens(outline)
+    logger.info(
+        f"[LLM_STUDY] Shared prompt prefix≈{prefix_tokens} tokens"
+        + ("" if prefix_tokens >= STUDYPLAN_SHARED_PREFIX_TOKENS else " (too little structure to be cached)")
+    )
+    return outline
+
+
+def _prompt_cache_key(context: str) -> str:
+    # routes calls sharing the prefix to the same provider cache
+    return "plan-" + hashlib.sha256(context.encode("utf-8")).hexdigest()[:24]
+
 
+def _sections_block(label: str, sections: str | None) -> str:
+    return f"\nSECTIONS FOR {label}:\n{sections}\n" if sections else ""
+
+
+# --------------------------------------------------------------
+# Build prompt for one day lesson
+# --------------------------------------------------------------
+def _build_day_prompt(
+    day_number: int,
+    total_days: int,
+    context: str,
+    sections: str | None = None,
+) -> str:
+
+    return context + _sections_block(f"DAY {day_number}", sections) + f"""
 TASK:
+Create a detailed study lesson for DAY {day_number} of {total_days}.
 Return STRICT JSON for DAY {day_number}:
 
 {{
@@ -132,83 +193,232 @@ RULES:
 # --------------------------------------------------------------
 # Parse JSON with fallback
 # --------------------------------------------------------------
+def empty_day_plan(day_number: int) -> Dict[str, Any]:
+    """
+    Safe placeholder lesson used when a day could not be generated.
+    """
+    return {
+        "day_number": day_number,
+        "title": f"Day {day_number}",
+        "goals": [],
+        "theory": "",
+        "practice": [],
+        "summary": "",
+        "quiz": [],
+    }
+
+
+def _normalize_day(data: Any, day_number: int) -> Dict[str, Any]:
+    """
+    Normalizes one parsed day object; raises ValueError if it is not a dict.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Expected JSON object")
+
+    result = {
+        "day_number": data.get("day_number", day_number),
+        "title": data.get("title") or f"Day {day_number}",
+        "goals": data.get("goals") or [],
+        "theory": data.get("theory") or "",
+        "practice": data.get("practice") or [],
+        "summary": data.get("summary") or "",
+        "quiz": data.get("quiz") or [],
+    }
+
+    # normalize lists
+    if not isinstance(result["goals"], list):
+        result["goals"] = [str(result["goals"])]
+
+    if not isinstance(result["practice"], list):
+        result["practice"] = [str(result["practice"])]
+
+    # normalize quiz items
+    quiz_ok = []
+    for q in result["quiz"]:
+        if isinstance(q, dict):
+            qq = (q.get("q") or "").strip()
+            aa = (q.get("a") or "").strip()
+            if qq and aa:
+                quiz_ok.append({"q": qq, "a": aa})
+    result["quiz"] = quiz_ok
+
+    return result
+
+
 def _parse_day_plan(raw: str, day_number: int) -> Dict[str, Any]:
     """
     Converts raw JSON from LLM into a normalized lesson dict.
-    On any error — returns safe empty placeholder.
+    Empty or unparseable output → placeholder with "error" set, so the
+    day is reported as failed (and never checkpointed).
     """
     try:
         if not raw.strip():
             raise ValueError("Empty LLM output")
 
-        data = json.loads(raw)
-
-        if not isinstance(data, dict):
-            raise ValueError("Expected JSON object")
-
-        result = {
-            "day_number": data.get("day_number", day_number),
-            "title": data.get("title") or f"Day {day_number}",
-            "goals": data.get("goals") or [],
-            "theory": data.get("theory") or "",
-            "practice": data.get("practice") or [],
-            "summary": data.get("summary") or "",
-            "quiz": data.get("quiz") or [],
-        }
-
-        # normalize lists
-        if not isinstance(result["goals"], list):
-            result["goals"] = [str(result["goals"])]
-
-        if not isinstance(result["practice"], list):
-            result["practice"] = [str(result["practice"])]
-
-        # normalize quiz items
-        quiz_ok = []
-        for q in result["quiz"]:
-            if isinstance(q, dict):
-                qq = (q.get("q") or "").strip()
-                aa = (q.get("a") or "").strip()
-                if qq and aa:
-                    quiz_ok.append({"q": qq, "a": aa})
-        result["quiz"] = quiz_ok
-
-        return result
+        return _normalize_day(json.loads(raw), day_number)
 
     except Exception as e:
         logger.error(f"[LLM_STUDY] Failed to parse JSON: {e}")
+        return {**empty_day_plan(day_number), "error": "invalid_output"}
+
+
+def _parse_days_plan(raw: str, day_numbers: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Splits a JSON array of lessons (or {"days": [...]}) into per-day
+    dicts of the _parse_day_plan shape. Only days that parsed are
+    returned — the caller regenerates the rest one by one.
+    """
+    try:
+        if not raw.strip():
+            raise ValueError("Empty LLM output")
 
-        return {
-            "day_number": day_number,
-            "title": f"Day {day_number}",
-            "goals": [],
-            "theory": "",
-            "practice": [],
-            "summary": "",
-            "quiz": [],
-        }
+        data = json.loads(raw)
+        if isinstance(data, dict):
+            data = data.get("days")
+        if not isinstance(data, list):
+            raise ValueError("Expected JSON array")
+
+    except Exception as e:
+        logger.error(f"[LLM_STUDY] Failed to parse batched JSON: {e}")
+        return {}
+
+    wanted = set(day_numbers)
+    parsed: Dict[int, Dict[str, Any]] = {}
+
+    for position, item in enumerate(data):
+        # trust the model's day_number when it is in the window, else position
+        day_number = item.get("day_number") if isinstance(item, dict) else None
+        if not isinstance(day_number, int) or day_number not in wanted:
+            if position >= len(day_numbers):
+                continue
+            day_number = day_numbers[position]
+
+        if day_number in parsed:
+            continue
+
+        try:
+            lesson = _normalize_day(item, day_number)
+        except ValueError as e:
+            logger.error(f"[LLM_STUDY] Day {day_number} in batch invalid: {e}")
+            continue
+
+        lesson["day_number"] = day_number
+        parsed[day_number] = lesson
+
+    return parsed
 
 
 # --------------------------------------------------------------
 # Public function — generate full day lesson
 # --------------------------------------------------------------
-def generate_day_plan(
+async def generate_day_plan(
     day_number: int,
     total_days: int,
     document_type: str,
     main_topics: List[str],
     summary: str,
     structure: List[Dict[str, Any]] | None = None,
+    outline: str | None = None,
+    sections: str | None = None,
+    cache: bool = True,
 ) -> Dict[str, Any]:
-
+    """
+    outline replaces the full structure in the shared prompt prefix;
+    sections (the day's own headings) go after it.
+    """
+    context = _document_context(total_days, document_type, main_topics, summary, structure, outline)
     prompt = _build_day_prompt(
         day_number=day_number,
         total_days=total_days,
-        document_type=document_type,
-        main_topics=main_topics,
-        summary=summary,
-        structure=structure,
+        context=context,
+        sections=sections,
     )
 
-    raw = call_llm(prompt)
+    raw = await call_llm(prompt, cache=cache, prompt_cache_key=_prompt_cache_key(context))
     return _parse_day_plan(raw, day_number=day_number)
+
+
+# --------------------------------------------------------------
+# Batched mode — one call for a window of consecutive days
+# --------------------------------------------------------------
+def _build_days_prompt(
+    first_day: int,
+    last_day: int,
+    total_days: int,
+    context: str,
+    sections: str | None = None,
+) -> str:
+
+    count = last_day - first_day + 1
+
+    return context + _sections_block(f"DAYS {first_day}-{last_day}", sections) + f"""
+TASK:
+Create detailed study lessons for DAYS {first_day}-{last_day} of {total_days}.
+Return a STRICT JSON array with exactly {count} objects, one per day,
+in order from DAY {first_day} to DAY {last_day}:
+
+[
+  {{
+    "day_number": {first_day},
+    "title": "Short lesson title",
+    "goals": ["Goal 1", "Goal 2"],
+    "theory": "Explanation of the concepts learned that day.",
+    "practice": ["Task 1", "Task 2"],
+    "summary": "Short wrap-up of the day.",
+    "quiz": [
+      {{ "q": "Question 1", "a": "Answer 1" }},
+      {{ "q": "Question 2", "a": "Answer 2" }}
+    ]
+  }}
+]
+
+RULES:
+- Each lesson MUST relate only to its own day; days follow each other.
+- No markdown. No comments.
+- Only valid JSON.
+"""
+
+
+async def generate_days_plan(
+    first_day: int,
+    last_day: int,
+    total_days: int,
+    document_type: str,
+    main_topics: List[str],
+    summary: str,
+    structure: List[Dict[str, Any]] | None = None,
+    outline: str | None = None,
+    sections: str | None = None,
+    cache: bool = True,
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Generates days first_day..last_day in one LLM call.
+    Returns {day_number: lesson} for the days that parsed; missing days
+    should be generated with generate_day_plan.
+    """
+    day_numbers = list(range(first_day, last_day + 1))
+
+    context = _document_context(total_days, document_type, main_topics, summary, structure, outline)
+    prompt = _build_days_prompt(
+        first_day=first_day,
+        last_day=last_day,
+        total_days=total_days,
+        context=context,
+        sections=sections,
+    )
+
+    max_output_tokens = min(
+        STUDYPLAN_MAX_OUTPUT_TOKENS,
+        STUDYPLAN_DAY_OUTPUT_TOKENS * len(day_numbers) + 200,
+    )
+
+    raw = await call_llm(
+        prompt,
+        max_output_tokens=max_output_tokens,
+        cache=cache,
+        prompt_cache_key=_prompt_cache_key(context),
+    )
+    parsed = _parse_days_plan(raw, day_numbers)
+
+    logger.info(f"[LLM_STUDY] Days {first_day}-{last_day}: {len(parsed)}/{len(day_numbers)} parsed")
+    return parsed
@@ -0,0 +1,283 @@
+import os
+import shutil
+import time
+import asyncio
+import importlib.util
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+
+import fitz
+
+from app.config import (
+    GOOGLE_OCR_API_KEY,
+    OCR_ENGINE,
+    TESSERACT_LANG,
+    TESSERACT_DPI,
+    TESSERACT_CONFIG,
+    TESSERACT_PAGES_PER_TASK,
+)
+from app.utils.logger import logger
+from app.utils.executor import run_cpu
+from app.services.google_ocr import google_ocr_pages, vision_rate_limited, ocr_stats
+from app.services.page_filter import blank_reason
+
+
+"""
+ocr.py
+
+OCR backend interface. Every engine implements
+
+    available() -> bool
+    async ocr_pages(path, pages, skipped=None, on_page=None) -> {page_number: text}
+
+Pages the blank-page filter (page_filter.py) rejects are not recognised;
+their numbers are appended to skipped. on_page(page_number, text) is
+called as soon as a page is recognised (used for resumable checkpoints).
+
+- VisionOcrEngine    — Google Vision (batched, concurrent, cached;
+                       see google_ocr.py)
+- TesseractOcrEngine — local Tesseract: pages are rendered and
+                       recognised on the CPU process pool,
+                       TESSERACT_PAGES_PER_TASK pages per task,
+                       language packs from TESSERACT_LANG
+
+ocr_pages(path, pages, engine) picks the engine: "vision" / "tesseract"
+explicitly (per request or OCR_ENGINE), or "auto" — Vision when it is
+configured and not rate-limited, Tesseract otherwise. In "auto" mode
+pages Vision dropped because of a rate limit are retried on Tesseract.
+"""
+
+OCR_ENGINES = ("auto", "vision", "tesseract")
+
+_tesseract_stats: Dict[str, float] = {
+    "pages": 0,
+    "failed_pages": 0,
+    "blank_pages": 0,
+    "seconds": 0.0,
+}
+
+
+# ---------------------------------------------------------------------
+# Engines
+# ---------------------------------------------------------------------
+OnPage = Optional[Callable[[int, str], None]]
+
+
+class OcrEngine(ABC):
+    name = "base"
+
+    @abstractmethod
+    def available(self) -> bool:
+        ...
+
+    @abstractmethod
+    async def ocr_pages(
+        self,
+        path: str,
+        pages: List[int],
+        skipped: Optional[List[int]] = None,
+        on_page: OnPage = None,
+    ) -> Dict[int, str]:
+        ...
+
+
+class VisionOcrEngine(OcrEngine):
+    name = "vision"
+
+    def available(self) -> bool:
+        return bool(GOOGLE_OCR_API_KEY)
+
+    async def ocr_pages(
+        self,
+        path: str,
+        pages: List[int],
+        skipped: Optional[List[int]] = None,
+        on_page: OnPage = None,
+    ) -> Dict[int, str]:
+        return await google_ocr_pages(path, pages, on_page=on_page, skipped=skipped)
+
+
+class TesseractOcrEngine(OcrEngine):
+    name = "tesseract"
+
+    def __init__(self, lang: str = TESSERACT_LANG):
+        self.lang = lang
+        self._available: Optional[bool] = None
+
+    def available(self) -> bool:
+        if self._available is None:
+            self._available = (
+                importlib.util.find_spec("pytesseract") is not None
+                and shutil.which("tesseract") is not None
+            )
+
+            if not self._available:
+                logger.warning("[TESSERACT] pytesseract or tesseract binary not found")
+
+        return self._available
+
+    async def ocr_pages(
+        self,
+        path: str,
+        pages: List[int],
+        skipped: Optional[List[int]] = None,
+        on_page: OnPage = None,
+    ) -> Dict[int, str]:
+        tasks = [
+            pages[i:i + TESSERACT_PAGES_PER_TASK]
+            for i in range(0, len(pages), TESSERACT_PAGES_PER_TASK)
+        ]
+        t_start = time.perf_counter()
+        results: Dict[int, str] = {}
+
+        async def run_task(task: List[int]):
+            try:
+                output = await run_cpu(_tesseract_pages, path, task, self.lang)
+            except Exception as e:
+                logger.error(f"[TESSERACT] Pages {task[0]}-{task[-1]} failed: {e}")
+                _tesseract_stats["failed_pages"] += len(task)
+                return
+
+            # results are reported per task, as soon as it finishes
+            for page_number, text in output.items():
+                if text is None:
+                    _tesseract_stats["blank_pages"] += 1
+                    if skipped is not None:
+                        skipped.append(page_number)
+                    continue
+                results[page_number] = text
+                if on_page is not None:
+                    on_page(page_number, text)
+
+        await asyncio.gather(*(run_task(task) for task in tasks))
+
+        elapsed = time.perf_counter() - t_start
+        _tesseract_stats["pages"] += len(results)
+        _tesseract_stats["seconds"] += elapsed
+
+        logger.info(
+            f"[TESSERACT] {len(results)}/{len(pages)} pages in {elapsed:.1f}s "
+            f"({len(results) / elapsed if elapsed else 0:.2f} pages/s, lang={self.lang})"
+        )
+        return results
+
+
+def _tesseract_pages(path: str, page_numbers: List[int], lang: str) -> Dict[int, Optional[str]]:
+    """
+    Renders and recognises pages. Runs in a worker process.
+    None for pages skipped as blank.
+    """
+    import pytesseract
+    from PIL import Image
+
+    # one Tesseract thread per worker; parallelism comes from the pool
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+    texts: Dict[int, Optional[str]] = {}
+
+    doc = fitz.open(path)
+    try:
+        for page_number in page_numbers:
+            pix = doc[page_number - 1].get_pixmap(dpi=TESSERACT_DPI, colorspace=fitz.csGRAY, alpha=False)
+            if blank_reason(pix):
+                texts[page_number] = None
+                continue
+
+            image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+            texts[page_number] = pytesseract.image_to_string(image, lang=lang, config=TESSERACT_CONFIG)
+    finally:
+        doc.close()
+
+    return texts
+
+
+_engines: Dict[str, OcrEngine] = {
+    "vision": VisionOcrEngine(),
+    "tesseract": TesseractOcrEngine(),
+}
+
+
+# ---------------------------------------------------------------------
+# Selection
+# ---------------------------------------------------------------------
+def select_engine(preferred: Optional[str] = None) -> Optional[OcrEngine]:
+    """
+    Resolves "auto" / "vision" / "tesseract" to an available engine.
+    An explicitly requested engine that is unavailable falls back to auto.
+    """
+    name = (preferred or OCR_ENGINE).lower()
+
+    if name in _engines:
+        engine = _engines[name]
+        if engine.available():
+            return engine
+        logger.warning(f"[OCR] Engine '{name}' unavailable, falling back to auto")
+
+    vision, tesseract = _engines["vision"], _engines["tesseract"]
+
+    if vision.available() and not vision_rate_limited():
+        return vision
+    if tesseract.available():
+        return tesseract
+    if vision.available():
+        return vision   # rate-limited, but still better than nothing
+
+    logger.error("[OCR] No OCR engine available")
+    return None
+
+
+async def ocr_pages(
+    path: str,
+    pages: List[int],
+    engine: Optional[str] = None,
+    on_page: OnPage = None,
+) -> Tuple[Dict[int, str], dict]:
+    """
+    OCR the given 1-based pages.
+    Returns ({page_number: text}, info) where info has "engines" (names
+    of the engines used) and "skipped_blank" (pages the filter rejected).
+    on_page(page_number, text) is called for every page as it is ready.
+    """
+    used: List[str] = []
+    skipped: List[int] = []
+    info = {"engines": used, "skipped_blank": skipped}
+
+    selected = select_engine(engine)
+    if selected is None or not pages:
+        return {}, info
+
+    logger.info(f"[OCR] {len(pages)} pages → {selected.name}")
+    results = await selected.ocr_pages(path, pages, skipped=skipped, on_page=on_page)
+    used.append(selected.name)
+
+    # --- auto mode: pages Vision dropped under a rate limit → Tesseract ---
+    auto = (engine or OCR_ENGINE).lower() not in _engines
+    missing = [p for p in pages if p not in results and p not in skipped]
+    tesseract = _engines["tesseract"]
+
+    if (
+        auto
+        and missing
+        and selected.name == "vision"
+        and vision_rate_limited()
+        and tesseract.available()
+    ):
+        logger.warning(f"[OCR] Vision rate-limited → Tesseract for {len(missing)} pages")
+        results.update(await tesseract.ocr_pages(path, missing, skipped=skipped, on_page=on_page))
+        used.append(tesseract.name)
+
+    return results, info
+
+
+def ocr_engine_stats() -> dict:
+    return {
+        "default": OCR_ENGINE,
+        "available": {name: engine.available() for name, engine in _engines.items()},
+        "vision_rate_limited": vision_rate_limited(),
+        "google_ocr": ocr_stats(),
+        "tesseract": {
+            **_tesseract_stats,
+            "pages_per_sec": round(_tesseract_stats["pages"] / _tesseract_stats["seconds"], 2)
+            if _tesseract_stats["seconds"] else 0.0,
+        },
+    }
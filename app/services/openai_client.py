@@ -1,28 +1,27 @@
-# app/services/openai_client.py
-
-from openai import AsyncOpenAI
-from app.utils.logger import logger
-
-client = AsyncOpenAI()   # API key is taken from env OPENAI_API_KEY
-
-
-async def run_chat_completion(messages: list, model: str = "gpt-4.1"):
-    """
-    Run async chat completion and return text content.
-    """
-
-    logger.info(f"[OpenAI] Calling model={model}")
-
-    try:
-        resp = await client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=0.4,
-            max_tokens=4096
-        )
-
-        return resp.choices[0].message.content
-
-    except Exception as e:
-        logger.error(f"[OpenAI] ChatCompletion error: {e}")
-        raise
+# app/services/openai_client.py
+
+from app.utils.logger import logger
+from app.services.llm_gateway import chat_text
+
+
+async def run_chat_completion(messages: list, model: str = "gpt-4.1", cache: bool = True):
+    """
+    Run async chat completion and return text content.
+    Repeated identical requests are served from the LLM response cache
+    unless cache=False.
+    """
+
+    logger.info(f"[OpenAI] Calling model={model}")
+
+    try:
+        return await chat_text(
+            messages,
+            model=model,
+            temperature=0.4,
+            max_tokens=4096,
+            cache=cache,
+        )
+
+    except Exception as e:
+        logger.error(f"[OpenAI] ChatCompletion error: {e}")
+        raise
@@ -0,0 +1,79 @@
+from typing import Optional
+
+import numpy as np
+
+from app.config import (
+    OCR_SKIP_BLANK_PAGES,
+    OCR_BLANK_DARK_LEVEL,
+    OCR_BLANK_MIN_INK,
+    OCR_BLANK_MAX_INK,
+    OCR_BLANK_MIN_STD,
+    OCR_BLANK_MIN_CONNECTED,
+)
+
+
+"""
+page_filter.py
+
+Cheap pre-OCR check on a rendered page (fitz.Pixmap), so blank versos,
+full-page plates and near-empty pages are not sent to an OCR engine.
+
+Statistics, on a 2x-downsampled grayscale copy of the pixmap samples:
+- ink      — share of dark pixels (< OCR_BLANK_DARK_LEVEL)
+- std      — pixel standard deviation (flat pages ≈ 0)
+- connected — share of dark pixels with a dark 4-neighbour; text strokes
+              are connected, scanner dust and speckle are not
+
+A page is skipped when ink < OCR_BLANK_MIN_INK, ink > OCR_BLANK_MAX_INK
+(picture plate), std < OCR_BLANK_MIN_STD or connected <
+OCR_BLANK_MIN_CONNECTED. Runs in the render worker processes.
+"""
+
+
+def page_statistics(pix) -> dict:
+    arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+    if pix.n > 1:
+        gray = arr[:, :, :3].mean(axis=2)
+    else:
+        gray = arr[:, :, 0]
+
+    gray = gray[::2, ::2]
+    dark = gray < OCR_BLANK_DARK_LEVEL
+    dark_count = int(dark.sum())
+
+    if dark_count:
+        neighbour = np.zeros_like(dark)
+        neighbour[1:, :] |= dark[:-1, :]
+        neighbour[:-1, :] |= dark[1:, :]
+        neighbour[:, 1:] |= dark[:, :-1]
+        neighbour[:, :-1] |= dark[:, 1:]
+        connected = float((dark & neighbour).sum()) / dark_count
+    else:
+        connected = 0.0
+
+    return {
+        "ink": float(dark_count) / dark.size if dark.size else 0.0,
+        "std": float(gray.std()) if gray.size else 0.0,
+        "connected": connected,
+    }
+
+
+def blank_reason(pix) -> Optional[str]:
+    """
+    Why the page cannot hold meaningful text, or None if it should be OCR'd.
+    """
+    if not OCR_SKIP_BLANK_PAGES:
+        return None
+
+    stats = page_statistics(pix)
+
+    if stats["std"] < OCR_BLANK_MIN_STD:
+        return "flat"
+    if stats["ink"] < OCR_BLANK_MIN_INK:
+        return "no_ink"
+    if stats["ink"] > OCR_BLANK_MAX_INK:
+        return "image"
+    if stats["connected"] < OCR_BLANK_MIN_CONNECTED:
+        return "noise"
+    return None
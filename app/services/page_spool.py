@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+import threading
+import weakref
+from typing import Iterable, Iterator, List
+
+from app.config import PDF_SPOOL_DIR
+
+
+"""
+page_spool.py
+
+Page texts of one document kept in a temporary file instead of memory.
+
+Every page is one JSON string per line; memory holds only the file
+offset and the stripped length of each page, so a 2,000-page book costs
+a few KB of RAM however much text it has.
+
+- append(text)         — next page, while the PDF is read in order
+- replace(index, text) — writes a new record and repoints the page
+                         (OCR results merged after the text layer)
+- spool[i], iter(spool) — read back, one page at a time
+- lengths              — stripped characters per page (no disk read)
+
+The file lives in PDF_SPOOL_DIR and is deleted by close() or when the
+spool is garbage-collected. Reads and writes are blocking file IO: use
+them from worker threads (run_io), not from the event loop.
+"""
+
+
+def _remove(f, path: str):
+    try:
+        f.close()
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class PageSpool:
+    def __init__(self, pages: Iterable[str] = ()):
+        fd, self.path = tempfile.mkstemp(prefix="pages_", suffix=".jsonl", dir=PDF_SPOOL_DIR)
+        self._file = os.fdopen(fd, "w+b")
+        self._finalizer = weakref.finalize(self, _remove, self._file, self.path)
+        self._lock = threading.Lock()
+
+        self._offsets: List[int] = []
+        self.lengths: List[int] = []
+
+        self.extend(pages)
+
+    def _write(self, text: str) -> int:
+        # caller holds _lock
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        self._file.write(json.dumps(text or "", ensure_ascii=False).encode("utf-8") + b"\n")
+        return offset
+
+    def append(self, text: str):
+        with self._lock:
+            self._offsets.append(self._write(text))
+            self.lengths.append(len((text or "").strip()))
+
+    def extend(self, pages: Iterable[str]):
+        for text in pages:
+            self.append(text)
+
+    def replace(self, index: int, text: str):
+        with self._lock:
+            self._offsets[index] = self._write(text)
+            self.lengths[index] = len((text or "").strip())
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, index: int) -> str:
+        with self._lock:
+            self._file.seek(self._offsets[index])
+            return json.loads(self._file.readline())
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self):
+        self._finalizer()
@@ -2,237 +2,602 @@ import fitz  # PyMuPDF
 import pdfplumber
 from PyPDF2 import PdfReader
 import os
+import time
+import asyncio
 import httpx
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 from app.utils.logger import logger
-from app.services.google_ocr import google_ocr_pdf   # <-- GOOGLE OCR
-from app.config import GOOGLE_OCR_API_KEY
+from app.utils.executor import run_io, run_cpu
+from app.services.ocr import ocr_pages
+from app.services.extraction_cache import file_sha256, cache_lookup, cache_put_pages, iter_cached_pages
+from app.services.page_spool import PageSpool
+from app.services.text_cleaner import iter_clean_pages
+from app.config import (
+    GOOGLE_OCR_API_KEY,
+    PDF_PARALLEL_WORKERS,
+    PDF_PARALLEL_MIN_SHARD_PAGES,
+    PDF_PARALLEL_MAX_SHARD_PAGES,
+    PDF_PROBE_SAMPLE_PAGES,
+    PDF_PAGE_MIN_CHARS,
+)
 
 
 """
 Unified PDF extraction pipeline:
 
 Order:
-1) Detect scanned PDF (no text layer)
-2) PyMuPDF
-3) pdfplumber
-4) PyPDF2
-5) Google Vision OCR fallback (async)
+0) Extraction cache (SHA-256 of file bytes)
+1) Probe: a stratified sample of pages is read with PyMuPDF, pdfplumber
+   and PyPDF2; each backend is scored by text yield and quality
+2) Only the winning backend runs over the whole document
+3) OCR (async), per page: only pages without a usable text layer
+   (< PDF_PAGE_MIN_CHARS) are sent; the others keep the backend's text.
+   A fully scanned book simply has every page sent. The engine (Google
+   Vision or local Tesseract) is chosen by app.services.ocr.
+   With OcrCheckpoints from the caller every recognised page is saved
+   until the extraction reaches the cache, so an interrupted run only
+   OCRs the pages it had not finished. Where they are stored is up to
+   the caller (the analysis route keeps them in the database).
+4) The result is cached only when it is complete: it has text and every
+   page sent to OCR (minus pages skipped as blank) was recognised. With
+   OCR missing, rate-limited or failing the checkpoints are kept and the
+   next run retries the pages still without text.
+
+The probe decision and timings are kept in PdfExtraction.report.
+
+Bounded memory: pages are read lazily (iter_pdf_pages) and spooled to
+a temporary file (page_spool.PageSpool) as they come; PdfExtraction
+keeps only per-page offsets and lengths. Large documents are read in
+page-range shards on the shared CPU pool, at most PDF_PARALLEL_WORKERS
+shards of PDF_PARALLEL_MAX_SHARD_PAGES pages in flight; small ones are
+read on the IO thread pool. Cleaning and caching stream from the spool
+page by page. Nothing blocks the event loop. (OCR engines still return
+the recognised pages of one call together before they are spooled.)
 
 APIs:
-- extract_pdf_text(path)  -> str
-- extract_pdf_pages(path) -> [{page, text}]
+- extract_pdf_document(path, ocr_engine=None, checkpoints=None) -> PdfExtraction
+- iter_pdf_pages(path, backend) -> yields page texts, one page in memory
 """
 
 
+BACKENDS = ("pymupdf", "pdfplumber", "pypdf2")
+
+
 # =====================================================================
-# DETECT IF PDF IS SCANNED (NO TEXT LAYER)
+# PAGE READERS (one thread, or sharded over the CPU process pool)
 # =====================================================================
 
-def detect_scanned_pdf(path: str) -> bool:
+class _PageReader:
     """
-    Checks if PDF contains no text (images only).
+    Random access to page texts with one backend. Opens its own handle,
+    so it is safe to use inside a worker process.
     """
-    try:
-        doc = fitz.open(path)
-        total_text = 0
 
-        for page in doc:
-            t = page.get_text("text")
-            if t:
-                total_text += len(t)
+    def __init__(self, path: str, backend: str):
+        self.backend = backend
 
-        doc.close()
+        if backend == "pymupdf":
+            self._handle = fitz.open(path)
+            self._pages = self._handle
+        elif backend == "pdfplumber":
+            self._handle = pdfplumber.open(path)
+            self._pages = self._handle.pages
+        elif backend == "pypdf2":
+            self._handle = None
+            self._pages = PdfReader(path).pages
+        else:
+            raise ValueError(f"Unknown PDF backend: {backend}")
 
-        if total_text < 20:
-            logger.info(f"[PDF] No text layer detected → scanned PDF")
-            return True
+    def __len__(self) -> int:
+        return len(self._pages)
 
-        return False
+    def text(self, index: int) -> str:
+        page = self._pages[index]
 
-    except Exception:
-        logger.warning("[PDF] detect_scanned_pdf failed → assuming scanned")
-        return True
+        if self.backend == "pymupdf":
+            return page.get_text("text") or ""
 
+        text = page.extract_text() or ""
+        if self.backend == "pdfplumber":
+            page.flush_cache()
+        return text
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
-# =====================================================================
-# INTERNAL: SPLIT OCR TEXT INTO PAGES
-# =====================================================================
 
-def split_text_into_pages(text: str, page_count: int) -> list:
+def iter_pdf_pages(path: str, backend: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
     """
-    Splits OCR text into page_count equal segments.
+    Lazily yields page texts [start, end) with one backend.
     """
-    if page_count <= 1:
-        return [{"page": 1, "text": text}]
+    with _PageReader(path, backend) as reader:
+        stop = len(reader) if end is None else end
+        for i in range(start, stop):
+            yield reader.text(i)
 
-    length = len(text)
-    chunk = max(1, length // page_count)
 
-    pages = []
-    for i in range(page_count):
-        start = i * chunk
-        end = (i + 1) * chunk
-        pages.append({
-            "page": i + 1,
-            "text": text[start:end].strip()
-        })
+def _read_page_range(path: str, backend: str, start: int = 0, end: Optional[int] = None) -> List[str]:
+    return list(iter_pdf_pages(path, backend, start, end))
 
-    return pages
 
+def _shard_ranges(page_count: int) -> List[Tuple[int, int]]:
+    """
+    Splits [0, page_count) into contiguous ranges: one per worker, but
+    no more than PDF_PARALLEL_MAX_SHARD_PAGES pages each. Returns a
+    single range when the document is too small to shard.
+    """
+    if PDF_PARALLEL_WORKERS <= 1 or page_count < 2 * PDF_PARALLEL_MIN_SHARD_PAGES:
+        return [(0, page_count)]
 
-# =====================================================================
-# EXTRACT TEXT (Main function)
-# =====================================================================
+    shards = min(PDF_PARALLEL_WORKERS, page_count // PDF_PARALLEL_MIN_SHARD_PAGES)
+    size = min(-(-page_count // shards), max(1, PDF_PARALLEL_MAX_SHARD_PAGES))   # ceil, capped
+
+    return [(s, min(s + size, page_count)) for s in range(0, page_count, size)]
+
+
+async def read_pages(path: str, backend: str, page_count: int = 0) -> PageSpool:
+    """
+    Spools the text of every page, in page order.
+    page_count = 0 means unknown → single range.
+    """
+    ranges = _shard_ranges(page_count) if page_count > 0 else [(0, None)]
 
-async def extract_pdf_text(path: str) -> str:
-    logger.info(f"[PDF] extract_pdf_text: {path}")
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        return await run_io(lambda: PageSpool(iter_pdf_pages(path, backend, start, end)))
 
-    # --- scanned PDF → OCR immediately ---
-    if detect_scanned_pdf(path):
-        logger.warning("[PDF] Scanned PDF → Google Vision OCR fallback")
-        return await google_ocr_pdf(path)
+    t0 = time.perf_counter()
+    spool = PageSpool()
+    pending: deque = deque()
 
-    # --- PyMuPDF ---
+    # shards are read ahead on the CPU pool, appended in page order
+    try:
+        for start, end in ranges:
+            pending.append(asyncio.ensure_future(run_cpu(_read_page_range, path, backend, start, end)))
+            if len(pending) >= PDF_PARALLEL_WORKERS:
+                await run_io(spool.extend, await pending.popleft())
+        while pending:
+            await run_io(spool.extend, await pending.popleft())
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        spool.close()
+        raise
+
+    logger.info(
+        f"[PDF] {backend}: {page_count} pages in {len(ranges)} shards, "
+        f"{time.perf_counter() - t0:.2f}s"
+    )
+
+    return spool
+
+
+def count_pages(path: str) -> int:
+    doc = fitz.open(path)
     try:
-        doc = fitz.open(path)
-        text = "\n".join((page.get_text("text") or "") for page in doc)
+        return len(doc)
+    finally:
         doc.close()
 
-        if len(text.strip()) > 20:
-            logger.info("[PDF] PyMuPDF OK")
-            return text
 
-        logger.warning("[PDF] PyMuPDF empty → pdfplumber")
+# =====================================================================
+# BACKEND PROBE (stratified page sample)
+# =====================================================================
 
-    except Exception as e:
-        logger.warning(f"[PDF] PyMuPDF failed: {e}")
+_GOOD_PUNCT = set(".,;:!?()[]-–—'\"«»/%")
 
-    # --- pdfplumber ---
-    try:
-        tmp = ""
-        with pdfplumber.open(path) as pdf:
-            for page in pdf.pages:
-                t = page.extract_text()
-                if t:
-                    tmp += t + "\n"
 
-        if len(tmp.strip()) > 20:
-            logger.info("[PDF] pdfplumber OK")
-            return tmp
+def _sample_indices(page_count: int, sample_size: int) -> List[int]:
+    """
+    Evenly spread 0-based page indices, always including first and last.
+    """
+    if page_count <= sample_size:
+        return list(range(page_count))
+    if sample_size <= 1:
+        return [0]
 
-        logger.warning("[PDF] pdfplumber empty → PyPDF2")
+    step = (page_count - 1) / (sample_size - 1)
+    return sorted({round(i * step) for i in range(sample_size)})
 
-    except Exception as e:
-        logger.warning(f"[PDF] pdfplumber failed: {e}")
 
-    # --- PyPDF2 ---
-    try:
-        tmp = ""
-        reader = PdfReader(path)
-        for page in reader.pages:
-            t = page.extract_text()
-            if t:
-                tmp += t + "\n"
+def _text_quality(text: str) -> float:
+    """
+    Share of characters that look like real text (letters, digits,
+    whitespace, common punctuation). Garbled encodings score low.
+    """
+    if not text.strip():
+        return 0.0
 
-        if len(tmp.strip()) > 20:
-            logger.info("[PDF] PyPDF2 OK")
-            return tmp
+    good = sum(1 for ch in text if ch.isalnum() or ch.isspace() or ch in _GOOD_PUNCT)
+    return good / len(text)
 
-        logger.warning("[PDF] PyPDF2 empty → OCR fallback")
 
-    except Exception as e:
-        logger.warning(f"[PDF] PyPDF2 failed: {e}")
+def _probe_backend(path: str, backend: str, indices: List[int]) -> Dict:
+    t0 = time.perf_counter()
 
-    # --- OCR fallback ---
-    logger.warning("[PDF] Switching to Google Vision OCR fallback")
-    return await google_ocr_pdf(path)
+    try:
+        with _PageReader(path, backend) as reader:
+            texts = [reader.text(i) for i in indices]
+    except Exception as e:
+        return {
+            "backend": backend,
+            "error": str(e),
+            "score": 0.0,
+            "ms": round((time.perf_counter() - t0) * 1000, 1),
+        }
+
+    chars = sum(len(t.strip()) for t in texts)
+    quality = _text_quality("".join(texts))
+
+    return {
+        "backend": backend,
+        "chars": chars,
+        "quality": round(quality, 3),
+        "score": round(chars * quality, 1),
+        "image_only_pages": [
+            indices[i] + 1 for i, t in enumerate(texts) if len(t.strip()) < PDF_PAGE_MIN_CHARS
+        ],
+        "ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+
+async def probe_backends(path: str, page_count: int) -> Dict:
+    """
+    Reads a stratified sample of pages with every backend (concurrently)
+    and picks the best one. Result:
+      backend  — winner, or None if no backend yields text
+      ocr      — expected OCR need from the sample:
+                 "none" | "pages" (image-only pages seen) | "full"
+      probes   — per-backend score, quality, timings
+    """
+    t0 = time.perf_counter()
+    indices = _sample_indices(page_count, PDF_PROBE_SAMPLE_PAGES)
+
+    probes = await asyncio.gather(*(
+        run_io(_probe_backend, path, backend, indices) for backend in BACKENDS
+    ))
+
+    ranked = sorted(
+        (p for p in probes if p["score"] > 0),
+        key=lambda p: p["score"],
+        reverse=True,
+    )
+
+    if not ranked:
+        backend, ocr = None, "full"
+    else:
+        backend = ranked[0]["backend"]
+        ocr = "pages" if ranked[0]["image_only_pages"] else "none"
+
+    decision = {
+        "backend": backend,
+        "ranking": [p["backend"] for p in ranked],
+        "ocr": ocr,
+        "sample_pages": [i + 1 for i in indices],
+        "probes": {p["backend"]: p for p in probes},
+        "probe_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+    logger.info(
+        f"[PDF] Probe → backend={backend}, ocr={ocr}, "
+        f"scores={ {p['backend']: p['score'] for p in probes} }, "
+        f"{decision['probe_ms']}ms"
+    )
+
+    return decision
 
 
 # =====================================================================
-# EXTRACT TEXT PER PAGE
+# PER-DOCUMENT EXTRACTION RESULT
 # =====================================================================
 
-async def extract_pdf_pages(path: str) -> list:
-    logger.info(f"[PDF] extract_pdf_pages: {path}")
+class PdfExtraction:
+    """
+    Everything one PDF yields, read in a single pass over its pages.
+
+    - page_texts — final text of every page (after fallbacks / OCR),
+                   spooled to disk (PageSpool)
+    - text_layer — raw PyMuPDF text per page (used for structure)
+    - scanned    — True when no page has a usable text layer
+    - ocr_pages  — 1-based pages whose text came from OCR
+    - ocr_failed — 1-based pages sent to OCR that no engine recognised
+    - backend    — which extractor produced page_texts
+    - file_hash  — SHA-256 of the file (extraction cache key)
+    - from_cache — True when page_texts came from the extraction cache
+    - report     — probe decision, OCR pages and timings
+    """
 
-    # --- scanned → OCR immediately ---
-    if detect_scanned_pdf(path):
-        logger.warning("[PDF] Scanned → Google Vision OCR for pages")
+    def __init__(self, path: str, file_hash: Optional[str] = None):
+        self.path = path
+        self.file_hash = file_hash
+        self.from_cache = False
+        self.page_count = 0
+        self.text_layer: Optional[PageSpool] = None
+        self.page_texts = PageSpool()
+        self.ocr_pages: List[int] = []
+        self.ocr_failed: List[int] = []
+        self.scanned = False
+        self.backend: Optional[str] = None
+        self.report: Dict = {}
+
+    @classmethod
+    def from_cache_entry(cls, path: str, file_hash: str, entry: dict) -> "PdfExtraction":
+        """
+        Rebuilds an extraction from a cache entry (cleaned pages, no text
+        layer), streaming the pages into the spool. Blocking: run_io.
+        """
+        extraction = cls(path, file_hash)
+        extraction.from_cache = True
+        extraction.page_texts.extend(iter_cached_pages(file_hash))
+        extraction.page_count = int(entry.get("page_count") or len(extraction.page_texts))
+        extraction.backend = entry.get("backend")
+        extraction.scanned = bool(entry.get("scanned"))
+        extraction.report = {
+            "backend": extraction.backend,
+            "from_cache": True,
+            "ocr_engine": entry.get("ocr_engine"),
+        }
+        return extraction
+
+    def has_text(self) -> bool:
+        return any(self.page_texts.lengths)
+
+    def complete(self) -> bool:
+        """
+        True when the result may be cached: there is text and no page
+        is still waiting for OCR.
+        """
+        return self.has_text() and not self.ocr_failed
+
+    def iter_clean_pages(self) -> Iterator[str]:
+        """
+        Cleaned page texts, one at a time (cached pages are already
+        clean). Reads the spool: iterate on a worker thread.
+        """
+        if self.from_cache:
+            return iter(self.page_texts)
+        return iter_clean_pages(self.page_texts)
+
+    def page_lines(self):
+        """
+        Yields (page_number, lines) from the PyMuPDF text layer.
+        """
+        for page_num, text in enumerate(self.text_layer or (), start=1):
+            yield page_num, (text or "").splitlines()
+
+
+class OcrCheckpoints:
+    """
+    Per-page OCR progress of one file, supplied by the caller:
+    load() -> {page_number: text}, save(page_number, text), clear().
+    load and clear run on the IO pool; save is called for every page
+    as it is recognised and must not block.
+    """
 
-        text = await google_ocr_pdf(path)
-        if not text.strip():
-            return []
+    def __init__(
+        self,
+        load: Callable[[], Dict],
+        save: Callable[[int, str], None],
+        clear: Callable[[], None],
+    ):
+        self.load = load
+        self.save = save
+        self.clear = clear
 
-        doc = fitz.open(path)
-        page_count = len(doc)
-        doc.close()
 
-        return split_text_into_pages(text, page_count)
+# =====================================================================
+# DETECT PAGES WITHOUT A TEXT LAYER
+# =====================================================================
 
-    # --- PyMuPDF ---
-    try:
-        doc = fitz.open(path)
-        pages = [
-            {"page": i + 1, "text": (page.get_text("text") or "").strip()}
-            for i, page in enumerate(doc)
-        ]
-        doc.close()
+def image_only_pages(page_lengths: List[int]) -> List[int]:
+    """
+    1-based numbers of pages with no usable text (< PDF_PAGE_MIN_CHARS
+    stripped characters).
+    """
+    return [i + 1 for i, n in enumerate(page_lengths) if n < PDF_PAGE_MIN_CHARS]
 
-        if any(p["text"] for p in pages):
-            logger.info("[PDF] PyMuPDF per-page OK")
-            return pages
 
-        logger.warning("[PDF] PyMuPDF empty → pdfplumber")
+# =====================================================================
+# EXTRACT DOCUMENT (Main function)
+# =====================================================================
 
-    except Exception as e:
-        logger.warning(f"[PDF] PyMuPDF page extraction failed: {e}")
+async def _apply_page_ocr(
+    extraction: PdfExtraction,
+    ocr_engine: Optional[str] = None,
+    checkpoints: Optional[OcrCheckpoints] = None,
+) -> PdfExtraction:
+    """
+    OCR only the pages without a usable text layer; pages with text keep
+    the backend's output and their real page numbers.
+    """
+    missing = image_only_pages(extraction.page_texts.lengths)
+    extraction.scanned = bool(missing) and len(missing) == extraction.page_count
+    extraction.report["ocr_pages"] = len(missing)
+
+    if not missing:
+        return extraction
+
+    # --- pages recognised by an interrupted earlier run ---
+    done = await run_io(checkpoints.load) if checkpoints else {}
+    resumed = {int(page): text for page, text in done.items() if int(page) in missing}
+    missing = [p for p in missing if p not in resumed]
+    extraction.report["ocr_resumed_pages"] = len(resumed)
+
+    logger.info(
+        f"[PDF] Per-page OCR for {len(missing)}/{extraction.page_count} pages"
+        + (f" ({len(resumed)} resumed from checkpoint)" if resumed else "")
+    )
+
+    t0 = time.perf_counter()
+    ocr_results, ocr_info = {}, {"engines": [], "skipped_blank": []}
+    if missing:
+        ocr_results, ocr_info = await ocr_pages(
+            extraction.path, missing, ocr_engine, on_page=checkpoints.save if checkpoints else None
+        )
+    engines_used = ocr_info["engines"]
+    extraction.report["ocr_engine"] = "+".join(engines_used) or None
+    extraction.report["ocr_skipped_blank"] = len(ocr_info["skipped_blank"])
+    extraction.report["ocr_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+    ocr_results.update(resumed)
+    extraction.ocr_pages = await run_io(_merge_ocr, extraction.page_texts, ocr_results)
+
+    # no engine, rate limit or errors → these pages are retried next run
+    skipped = set(ocr_info["skipped_blank"])
+    extraction.ocr_failed = [p for p in missing if p not in ocr_results and p not in skipped]
+    extraction.report["ocr_failed_pages"] = len(extraction.ocr_failed)
+    if extraction.ocr_failed:
+        logger.warning(f"[PDF] OCR failed for {len(extraction.ocr_failed)} pages")
+
+    if extraction.backend is None and extraction.ocr_pages:
+        engine = engines_used[0] if engines_used else "ocr"   # all pages resumed
+        backend = "google_ocr" if engine == "vision" else engine
+        extraction.backend = backend
+        extraction.report["backend"] = backend
+
+    return extraction
+
+
+def _merge_ocr(page_texts: PageSpool, ocr_results: Dict[int, str]) -> List[int]:
+    # recognised pages replace their (empty) text layer in the spool
+    merged = []
+    for page_number, text in sorted(ocr_results.items()):
+        if text.strip():
+            page_texts.replace(page_number - 1, text)
+            merged.append(page_number)
+    return merged
+
+
+async def extract_pdf_document(
+    path: str,
+    ocr_engine: Optional[str] = None,
+    checkpoints: Optional[OcrCheckpoints] = None,
+) -> PdfExtraction:
+    """
+    Runs the extraction pipeline once and returns a PdfExtraction
+    shared by text, per-page and structure consumers.
+    ocr_engine — "auto" / "vision" / "tesseract" for image-only pages
+    (None → OCR_ENGINE). An explicit engine skips a cached extraction
+    whose OCR pages came from another engine.
+    checkpoints — where recognised OCR pages are kept until the result
+    is cached (None → an interrupted run starts OCR over).
+    """
+    logger.info(f"[PDF] extract_pdf_document: {path}")
 
-    # --- pdfplumber ---
     try:
-        pages = []
-        with pdfplumber.open(path) as pdf:
-            for i, page in enumerate(pdf.pages):
-                pages.append({
-                    "page": i + 1,
-                    "text": (page.extract_text() or "").strip()
-                })
-
-        if any(p["text"] for p in pages):
-            logger.info("[PDF] pdfplumber per-page OK")
-            return pages
-
-        logger.warning("[PDF] pdfplumber empty → PyPDF2")
-
-    except Exception as e:
-        logger.warning(f"[PDF] pdfplumber failed: {e}")
+        file_hash = await run_io(file_sha256, path)
+    except OSError as e:
+        logger.warning(f"[PDF] Could not hash file: {e}")
+        file_hash = None
+
+    entry = await run_io(cache_lookup, file_hash, "pages")
+    if entry and _ocr_by_other_engine(entry, ocr_engine):
+        logger.info(f"[PDF] Cached OCR by {entry.get('ocr_engine')} → re-running with {ocr_engine}")
+        entry = None
+    if entry:
+        logger.info("[PDF] Extraction served from cache")
+        return await run_io(PdfExtraction.from_cache_entry, path, file_hash, entry)
+
+    extraction = await _extract_uncached(PdfExtraction(path, file_hash), ocr_engine, checkpoints)
+
+    if extraction.complete():
+        await run_io(_store_in_cache, extraction)
+        if checkpoints:
+            await run_io(checkpoints.clear)   # cache entry supersedes them
+    else:
+        # partial result: not cached, OCR checkpoints kept for the next run
+        logger.warning("[PDF] Extraction incomplete → not cached")
+
+    return extraction
+
+
+def _ocr_by_other_engine(entry: dict, ocr_engine: Optional[str]) -> bool:
+    # an explicitly requested engine only reuses OCR it produced itself
+    return bool(
+        ocr_engine
+        and ocr_engine != "auto"
+        and entry.get("ocr_pages")
+        and entry.get("ocr_engine") != ocr_engine
+    )
+
+
+def _store_in_cache(extraction: PdfExtraction):
+    cache_put_pages(
+        extraction.file_hash,
+        extraction.iter_clean_pages(),
+        page_count=extraction.page_count or len(extraction.page_texts),
+        backend=extraction.backend,
+        scanned=extraction.scanned,
+        ocr_pages=len(extraction.ocr_pages),
+        ocr_engine=extraction.report.get("ocr_engine"),
+    )
+
+
+async def _extract_uncached(
+    extraction: PdfExtraction,
+    ocr_engine: Optional[str] = None,
+    checkpoints: Optional[OcrCheckpoints] = None,
+) -> PdfExtraction:
+    """
+    Cache miss: probe backends on a sample, run the winner, then OCR
+    only the pages that are still without text.
+    """
+    path = extraction.path
 
-    # --- PyPDF2 ---
     try:
-        pages = []
-        reader = PdfReader(path)
-        for i, page in enumerate(reader.pages):
-            pages.append({
-                "page": i + 1,
-                "text": (page.extract_text() or "").strip()
-            })
-
-        if any(p["text"] for p in pages):
-            logger.info("[PDF] PyPDF2 per-page OK")
-            return pages
-
-        logger.warning("[PDF] PyPDF2 empty → OCR fallback")
-
+        extraction.page_count = await run_io(count_pages, path)
     except Exception as e:
-        logger.warning(f"[PDF] PyPDF2 failed: {e}")
-
-    # --- OCR fallback ---
-    text = await google_ocr_pdf(path)
-    if not text.strip():
-        return []
-
-    doc = fitz.open(path)
-    page_count = len(doc)
-    doc.close()
-
-    return split_text_into_pages(text, page_count)
+        logger.warning(f"[PDF] PyMuPDF could not open file: {e}")
+        extraction.report = {"backend": None, "error": str(e)}
+        return extraction
+
+    decision = await probe_backends(path, extraction.page_count)
+    extraction.report = dict(decision)
+
+    # --- try backends best-first; the probe already ruled out empty ones.
+    #     With an all-image sample still read the PyMuPDF text layer, so
+    #     unsampled text pages are not sent to OCR. ---
+    for backend in decision["ranking"] or ["pymupdf"]:
+        t0 = time.perf_counter()
+        try:
+            page_texts = await read_pages(path, backend, extraction.page_count)
+        except Exception as e:
+            logger.warning(f"[PDF] {backend} failed: {e}")
+            continue
+
+        extraction.report["extract_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+        if not _has_text(page_texts.lengths):
+            logger.warning(f"[PDF] {backend} empty on full document")
+            page_texts.close()
+            continue
+
+        logger.info(f"[PDF] {backend} OK")
+        extraction.backend = backend
+        extraction.report["backend"] = backend
+        extraction.page_texts.close()
+        extraction.page_texts = page_texts
+        if backend == "pymupdf":
+            extraction.text_layer = page_texts
+        break
+    else:
+        logger.warning("[PDF] No text from any backend → OCR for all pages")
+        extraction.report["backend"] = None
+        await run_io(extraction.page_texts.extend, [""] * extraction.page_count)
+
+    # --- pages without a text layer → OCR, page by page ---
+    return await _apply_page_ocr(extraction, ocr_engine, checkpoints)
+
+
+def _has_text(page_lengths: List[int]) -> bool:
+    # same threshold as before: more than 20 meaningful characters
+    return sum(page_lengths) > 20
@@ -0,0 +1,234 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import (
+    LLM_RATE_LIMIT_ENABLED,
+    LLM_RATE_LIMITS,
+    LLM_DEFAULT_RPM,
+    LLM_DEFAULT_TPM,
+    LLM_RATE_LIMIT_PROCESSES,
+)
+from app.utils.logger import logger
+
+
+"""
+rate_limiter.py
+
+Client-side token buckets in front of every LLM call, per model:
+- requests per minute (RPM) and estimated tokens per minute (TPM);
+  both buckets refill continuously, capacity = one minute of quota
+- waiters are served strictly in (priority, arrival) order, so one
+  large request cannot be starved by a stream of small ones
+- INTERACTIVE (default) is served before BACKGROUND; background work
+  runs inside `with llm_priority(BACKGROUND):`
+- the token estimate is corrected with real usage once the call returns
+- wait time is recorded per model and priority (rate_limiter_stats())
+
+Limits come from LLM_RATE_LIMITS ("model=rpm:tpm,...") with
+LLM_DEFAULT_RPM / LLM_DEFAULT_TPM for other models.
+
+The buckets are per process: API workers and job workers do not share
+them. Each process gets 1 / LLM_RATE_LIMIT_PROCESSES of every limit, so
+with that set to the number of processes using the key their sum stays
+within the provider quota.
+"""
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def llm_priority(priority: int):
+    """
+    Sets the priority of LLM calls made in this context (and in tasks
+    started from it).
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def _parse_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    limits = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            model, values = part.split("=", 1)
+            rpm, tpm = values.split(":", 1)
+            limits[model.strip()] = (int(rpm), int(tpm))
+        except ValueError:
+            logger.warning(f"[RATE_LIMIT] Bad LLM_RATE_LIMITS entry: {part}")
+    return limits
+
+
+class _ModelLimiter:
+    def __init__(self, model: str, rpm: int, tpm: int):
+        self.model = model
+        self.rpm = max(1, rpm)
+        self.tpm = max(1, tpm)
+
+        self.requests = float(self.rpm)
+        self.tokens = float(self.tpm)
+        self._updated = time.monotonic()
+
+        self._waiters: List[tuple] = []
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self.stats: Dict[str, Dict[str, float]] = {
+            name: {"requests": 0, "waited": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            for name in _PRIORITY_NAMES.values()
+        }
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def _fits(self, tokens: int) -> bool:
+        # a request larger than the whole bucket waits for a full bucket
+        return self.requests >= 1 and self.tokens >= min(tokens, self.tpm)
+
+    def _take(self, tokens: int):
+        self.requests -= 1
+        self.tokens -= tokens
+
+    def _delay_for(self, tokens: int) -> float:
+        need_requests = max(0.0, 1 - self.requests) * 60 / self.rpm
+        need_tokens = max(0.0, min(tokens, self.tpm) - self.tokens) * 60 / self.tpm
+        return max(need_requests, need_tokens, 0.01)
+
+    async def acquire(self, tokens: int, priority: int):
+        t0 = time.perf_counter()
+        self._refill()
+
+        if not self._waiters and self._fits(tokens):
+            self._take(tokens)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+            if self._dispatcher is None or self._dispatcher.done():
+                self._dispatcher = asyncio.create_task(self._dispatch())
+            await future
+
+        self._record(priority, time.perf_counter() - t0)
+
+    async def _dispatch(self):
+        while self._waiters:
+            priority, _, tokens, future = self._waiters[0]
+            if future.done():   # caller was cancelled
+                heapq.heappop(self._waiters)
+                continue
+
+            self._refill()
+            if self._fits(tokens):
+                heapq.heappop(self._waiters)
+                self._take(tokens)
+                future.set_result(None)
+                continue
+
+            await asyncio.sleep(self._delay_for(tokens))
+
+    def adjust(self, tokens: int):
+        # estimate → real usage (negative gives tokens back)
+        self._refill()
+        self.tokens = min(self.tpm, self.tokens - tokens)
+
+    def _record(self, priority: int, waited: float):
+        stats = self.stats[_PRIORITY_NAMES.get(priority, "background")]
+        stats["requests"] += 1
+        stats["wait_seconds"] += waited
+        if waited > 0.001:
+            stats["waited"] += 1
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "available_requests": round(self.requests, 1),
+            "available_tokens": int(self.tokens),
+            "queued": len(self._waiters),
+            "by_priority": {
+                name: {
+                    **s,
+                    "avg_wait_ms": round(s["wait_seconds"] / s["requests"] * 1000, 1) if s["requests"] else 0.0,
+                }
+                for name, s in self.stats.items()
+            },
+        }
+
+
+_limits = _parse_limits(LLM_RATE_LIMITS)
+_limiters: Dict[str, _ModelLimiter] = {}
+
+
+def _limiter(model: str) -> _ModelLimiter:
+    limiter = _limiters.get(model)
+    if limiter is None:
+        rpm, tpm = _limits.get(model, (LLM_DEFAULT_RPM, LLM_DEFAULT_TPM))
+        # this process's share of the key's quota
+        rpm, tpm = rpm // LLM_RATE_LIMIT_PROCESSES, tpm // LLM_RATE_LIMIT_PROCESSES
+        limiter = _limiters[model] = _ModelLimiter(model, rpm, tpm)
+    return limiter
+
+
+# --------------------------------------------------------------
+# Public API
+# --------------------------------------------------------------
+def estimate_tokens(prompt: Any, max_output_tokens: int = 0) -> int:
+    """
+    Rough token estimate: ~4 characters per token of the prompt text
+    plus the requested output budget.
+    """
+    if isinstance(prompt, list):
+        chars = sum(len(str(m.get("content", "")) if isinstance(m, dict) else str(m)) for m in prompt)
+    else:
+        chars = len(str(prompt))
+    return chars // 4 + int(max_output_tokens or 0)
+
+
+async def acquire(model: str, tokens: int, priority: Optional[int] = None):
+    """
+    Waits until the model's RPM and TPM buckets admit one request of
+    ~tokens tokens.
+    """
+    if not LLM_RATE_LIMIT_ENABLED:
+        return
+    await _limiter(model).acquire(tokens, current_priority() if priority is None else priority)
+
+
+def settle(model: str, estimated: int, actual: int):
+    """
+    Corrects the TPM bucket once real usage is known.
+    """
+    if LLM_RATE_LIMIT_ENABLED and actual:
+        _limiter(model).adjust(actual - estimated)
+
+
+def rate_limiter_stats() -> Dict[str, Any]:
+    return {
+        "enabled": LLM_RATE_LIMIT_ENABLED,
+        "processes": LLM_RATE_LIMIT_PROCESSES,
+        "models": {model: limiter.snapshot() for model, limiter in _limiters.items()},
+    }
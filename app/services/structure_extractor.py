@@ -2,39 +2,86 @@
 
 import fitz
 from app.utils.logger import logger
+from app.services.extraction_cache import file_sha256, cache_get, cache_put
 
-def extract_structure(path: str):
+
+def _is_heading(line_clean: str) -> bool:
+    # Simple naive heuristic:
+    return (
+        len(line_clean) > 3
+        and len(line_clean) < 80
+        and line_clean[0].isupper()
+        and (line_clean.endswith(".") is False)
+    )
+
+
+def structure_from_lines(page_lines) -> list:
+    """
+    Builds the structure list from (page_number, lines) pairs.
+    """
+    structure = []
+
+    for page_num, lines in page_lines:
+        for line in lines:
+            line_clean = line.strip()
+
+            if _is_heading(line_clean):
+                structure.append({
+                    "page": page_num,
+                    "title": line_clean
+                })
+
+    return structure
+
+
+def extract_structure(path: str, extraction=None):
     """
     Extracts headings/chapters using simple heuristics from PDF text.
     Fully synchronous — NO async calls inside.
+
+    Checks the extraction cache first. If a PdfExtraction is passed,
+    its already-read text layer is reused and the PDF is not opened again.
     """
+    file_hash = extraction.file_hash if extraction is not None else None
+    if not file_hash:
+        try:
+            file_hash = file_sha256(path)
+        except OSError:
+            file_hash = None
+
+    cached = cache_get(file_hash, "structure")
+    if cached is not None:
+        logger.info(f"[STRUCTURE] Units from cache: {len(cached)}")
+        return cached
+
+    structure = _extract_structure_uncached(path, extraction)
+
+    if structure:
+        cache_put(file_hash, structure=structure)
+
+    logger.info(f"[STRUCTURE] Units found: {len(structure)}")
+    return structure
+
+
+def _extract_structure_uncached(path: str, extraction=None) -> list:
+    if extraction is not None and extraction.text_layer:
+        try:
+            return structure_from_lines(extraction.page_lines())
+        except Exception as e:
+            logger.error(f"[STRUCTURE] Error: {e}")
+            return []
+
     try:
         doc = fitz.open(path)
     except Exception as e:
         logger.error(f"[STRUCTURE] Failed to open PDF: {e}")
         return []
 
-    structure = []
-
     try:
-        for page_num, page in enumerate(doc, start=1):
-            text = page.get_text("text") or ""
-            lines = text.splitlines()
-
-            for line in lines:
-                line_clean = line.strip()
-
-                # Simple naive heuristic:
-                if (
-                    len(line_clean) > 3
-                    and len(line_clean) < 80
-                    and line_clean[0].isupper()
-                    and (line_clean.endswith(".") is False)
-                ):
-                    structure.append({
-                        "page": page_num,
-                        "title": line_clean
-                    })
+        return structure_from_lines(
+            (page_num, (page.get_text("text") or "").splitlines())
+            for page_num, page in enumerate(doc, start=1)
+        )
 
     except Exception as e:
         logger.error(f"[STRUCTURE] Error: {e}")
@@ -42,6 +89,3 @@ def extract_structure(path: str):
 
     finally:
         doc.close()
-
-    logger.info(f"[STRUCTURE] Units found: {len(structure)}")
-    return structure
@@ -0,0 +1,173 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import STUDYPLAN_TOC_TOKEN_BUDGET, STUDYPLAN_OUTLINE_ITEMS
+
+
+"""
+structure_index.py
+
+Splits the extracted structure (headings) into contiguous per-day slices
+so a day prompt carries only its own sections plus a short global
+outline instead of the whole table of contents.
+
+- day_page_ranges()   — page range of every day (same split as the
+                        source_pages attached to lessons)
+- StructureIndex      — headings → days by page (or evenly by position
+                        when pages are unknown); outline_text(budget) is
+                        the shared outline, sections_for(days) the
+                        per-call slice (3/4 of STUDYPLAN_TOC_TOKEN_BUDGET)
+- render_toc()        — "- p.N: Title" lines, the prompt TOC format
+
+Tokens are estimated as characters / 4.
+"""
+
+NO_STRUCTURE = "No explicit structure."
+
+
+def estimate_text_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+def _toc_line(entry: Dict[str, Any]) -> Optional[str]:
+    title = entry.get("title") or entry.get("name") or ""
+    if not title:
+        return None
+
+    page = entry.get("page") or entry.get("start_page")
+    return f"- p.{page}: {title}" if page else f"- {title}"
+
+
+def render_toc(structure: Optional[List[Dict[str, Any]]]) -> str:
+    """
+    Full TOC preview, one line per titled entry.
+    """
+    lines = [line for line in map(_toc_line, structure or []) if line]
+    return "\n".join(lines) if lines else NO_STRUCTURE
+
+
+def _fit_lines(lines: List[str], budget_tokens: int) -> List[str]:
+    """
+    Keeps evenly spaced lines so the text fits the budget; notes how many
+    were left out.
+    """
+    if not lines or estimate_text_tokens("\n".join(lines)) <= budget_tokens:
+        return lines
+
+    avg_tokens = max(1, estimate_text_tokens("\n".join(lines)) // len(lines))
+    keep = max(1, budget_tokens // avg_tokens - 1)
+    if keep >= len(lines):
+        return lines
+
+    step = len(lines) / keep
+    kept = [lines[int(i * step)] for i in range(keep)]
+    kept.append(f"- ... ({len(lines) - keep} more sections)")
+    return kept
+
+
+def day_page_ranges(total_days: int, pages_count: int) -> List[Tuple[int, int]]:
+    """
+    (start, end) pages per day, 1-based and inclusive; the last day takes
+    the remainder.
+    """
+    if total_days <= 0 or pages_count <= 0:
+        return []
+
+    pages_per_day = max(1, pages_count // total_days)
+    ranges = []
+
+    for i in range(total_days):
+        start = i * pages_per_day + 1
+        end = pages_count if i == total_days - 1 else start + pages_per_day - 1
+        ranges.append((min(start, pages_count), min(end, pages_count)))
+
+    return ranges
+
+
+class StructureIndex:
+    """
+    Contiguous structure slices per day (1-based day numbers).
+    """
+
+    def __init__(
+        self,
+        structure: Optional[List[Dict[str, Any]]],
+        total_days: int,
+        pages_count: int = 0,
+        budget_tokens: int = STUDYPLAN_TOC_TOKEN_BUDGET,
+        outline_items: int = STUDYPLAN_OUTLINE_ITEMS,
+    ):
+        self.total_days = max(1, total_days)
+        self.budget_tokens = budget_tokens
+
+        entries = [e for e in (structure or []) if _toc_line(e)]
+        self.toc_lines = [_toc_line(e) for e in entries]
+        self.full_tokens = estimate_text_tokens(render_toc(entries))
+        self.slices: List[List[Dict[str, Any]]] = self._assign(entries, pages_count)
+
+        # outline: the first heading of every day, thinned to outline_items
+        firsts = [day_slice[0] for day_slice in self.slices if day_slice]
+        if len(firsts) > outline_items > 0:
+            step = len(firsts) / outline_items
+            firsts = [firsts[int(i * step)] for i in range(outline_items)]
+        self.outline_lines = [_toc_line(e) for e in firsts]
+
+    def _assign(self, entries: List[Dict[str, Any]], pages_count: int) -> List[List[Dict[str, Any]]]:
+        slices: List[List[Dict[str, Any]]] = [[] for _ in range(self.total_days)]
+        if not entries:
+            return slices
+
+        ranges = day_page_ranges(self.total_days, pages_count)
+        has_pages = ranges and any(e.get("page") or e.get("start_page") for e in entries)
+
+        if has_pages:
+            day = 0
+            for entry in entries:
+                page = entry.get("page") or entry.get("start_page")
+                if page:
+                    # headings are in page order; move forward to the day holding the page
+                    day = next(
+                        (i for i, (start, end) in enumerate(ranges) if start <= page <= end),
+                        day,
+                    )
+                slices[day].append(entry)   # no page → stays with the previous heading
+            return slices
+
+        # pages unknown: even contiguous split by position
+        per_day = len(entries) / self.total_days
+        for i, entry in enumerate(entries):
+            slices[min(self.total_days - 1, int(i / per_day))].append(entry)
+        return slices
+
+    def outline_text(self, budget_tokens: Optional[int] = None) -> str:
+        """
+        Global outline — identical for every day of the plan, so it
+        belongs to the shared prompt prefix. Default budget: a quarter of
+        the TOC budget. A larger budget (to make the prefix cacheable)
+        is filled from the full TOC, evenly thinned, instead of one
+        heading per day.
+        """
+        budget = self.budget_tokens // 4 if budget_tokens is None else budget_tokens
+
+        lines = self.outline_lines
+        if len(self.toc_lines) > len(lines) and estimate_text_tokens("\n".join(lines)) < budget:
+            lines = self.toc_lines
+
+        outline = _fit_lines(lines, budget)
+        return "\n".join(outline) if outline else NO_STRUCTURE
+
+    def sections_for(self, days: List[int]) -> str:
+        """
+        The sections of the given days, within the three quarters of the
+        budget not reserved for the outline.
+        """
+        section_lines = [
+            line
+            for day in days
+            if 1 <= day <= self.total_days
+            for line in map(_toc_line, self.slices[day - 1])
+        ]
+        if not section_lines:
+            return "(continue from the previous day)"
+
+        sections = _fit_lines(section_lines, max(1, self.budget_tokens - self.budget_tokens // 4))
+        return "\n".join(sections)
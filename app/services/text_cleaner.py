@@ -1,5 +1,5 @@
 import re
-from app.utils.logger import logger
+from typing import Iterable, Iterator
 
 
 def normalize_whitespace(text: str) -> str:
@@ -27,19 +27,21 @@ def remove_page_artifacts(text: str) -> str:
     return "\n".join(cleaned_lines)
 
 
-def clean_text(raw_text: str) -> str:
+def clean_page(raw_text: str) -> str:
     """
-    Базовая очистка текста после извлечения из PDF.
+    Очистка одной страницы — без логов, для постраничных вызовов.
     """
-    logger.info("Text cleaning started")
     if not raw_text:
         return ""
 
-    text = raw_text
-
-    text = normalize_whitespace(text)
+    text = normalize_whitespace(raw_text)
     text = remove_page_artifacts(text)
+    return text.strip()
 
-    text = text.strip()
-    logger.info(f"Text cleaning finished, length={len(text)}")
-    return text
+
+def iter_clean_pages(pages: Iterable[str]) -> Iterator[str]:
+    """
+    Ленивая постраничная очистка: в памяти одна страница за раз.
+    """
+    for page in pages:
+        yield clean_page(page)
@@ -0,0 +1,186 @@
+import asyncio
+import functools
+import multiprocessing
+import time
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from app.config import (
+    EXECUTOR_IO_WORKERS,
+    EXECUTOR_IO_MAX_PENDING,
+    EXECUTOR_CPU_WORKERS,
+    EXECUTOR_CPU_MAX_PENDING,
+)
+from app.utils.logger import logger
+
+
+"""
+executor.py
+
+Shared, bounded execution layer for blocking work called from async code.
+
+- run_io(fn, *args, **kwargs)  — thread pool: sync SDK calls, downloads,
+                                 file IO, light parsing
+- run_cpu(fn, *args, **kwargs) — process pool: heavy parsing / rendering.
+                                 fn and args must be picklable.
+
+Each pool admits at most *_MAX_PENDING jobs (queued + running); callers
+beyond that wait on an asyncio semaphore, so the event loop itself never
+blocks and /health stays responsive.
+
+CPU workers are started with "forkserver" (or "spawn" where it is not
+available), never forked from this process: by then it runs the IO
+pool and the db writer thread, and a forked child could inherit a lock
+held by one of them and deadlock.
+
+A worker process that dies (e.g. OOM-killed while rendering) breaks the
+whole ProcessPoolExecutor; the broken executor is then replaced with a
+fresh one and the call is retried once.
+
+executor_stats() reports queue depth and saturation per pool.
+"""
+
+
+class _BoundedPool:
+    def __init__(self, name: str, factory: Callable[[], Executor], workers: int, max_pending: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+
+        self._factory = factory
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.waiting = 0        # callers waiting for a pending slot
+        self.in_flight = 0      # submitted to the executor (queued + running)
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0       # broken executors replaced
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self._factory()
+        return self._executor
+
+    def _replace_broken(self, executor: Executor):
+        # concurrent callers see the same broken executor; replace it once
+        if self._executor is not executor:
+            return
+        logger.error(f"[EXECUTOR] {self.name} pool broken (worker died) → restarting it")
+        executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self.restarts += 1
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        return self._semaphore
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        call = functools.partial(fn, *args, **kwargs) if kwargs else fn
+        call_args = () if kwargs else args
+
+        semaphore = self._get_semaphore()
+        loop = asyncio.get_running_loop()
+
+        t_wait = time.perf_counter()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        t_start = time.perf_counter()
+        self.wait_seconds += t_start - t_wait
+        self.in_flight += 1
+
+        try:
+            for attempt in range(2):
+                executor = self._get_executor()
+                try:
+                    result = await loop.run_in_executor(executor, call, *call_args)
+                    break
+                except BrokenExecutor:
+                    self._replace_broken(executor)
+                    if attempt:
+                        raise
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.run_seconds += time.perf_counter() - t_start
+            semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        running = min(self.in_flight, self.workers)
+        finished = self.completed + self.failed
+
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "running": running,
+            "queued": self.waiting + max(0, self.in_flight - self.workers),
+            "saturation": round(running / self.workers, 3),
+            "completed": self.completed,
+            "failed": self.failed,
+            "restarts": self.restarts,
+            "avg_wait_ms": round(self.wait_seconds / finished * 1000, 1) if finished else 0.0,
+            "avg_run_ms": round(self.run_seconds / finished * 1000, 1) if finished else 0.0,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_io_pool = _BoundedPool(
+    "io",
+    lambda: ThreadPoolExecutor(max_workers=EXECUTOR_IO_WORKERS, thread_name_prefix="io"),
+    EXECUTOR_IO_WORKERS,
+    EXECUTOR_IO_MAX_PENDING,
+)
+
+def _cpu_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+_cpu_pool = _BoundedPool(
+    "cpu",
+    lambda: ProcessPoolExecutor(max_workers=EXECUTOR_CPU_WORKERS, mp_context=_cpu_context()),
+    EXECUTOR_CPU_WORKERS,
+    EXECUTOR_CPU_MAX_PENDING,
+)
+
+
+# --------------------------------------------------------------
+# Public API
+# --------------------------------------------------------------
+async def run_io(fn: Callable, *args, **kwargs) -> Any:
+    """
+    Runs a blocking (IO-bound / sync SDK) call on the shared thread pool.
+    """
+    return await _io_pool.run(fn, *args, **kwargs)
+
+
+async def run_cpu(fn: Callable, *args, **kwargs) -> Any:
+    """
+    Runs a CPU-bound call on the shared process pool.
+    """
+    return await _cpu_pool.run(fn, *args, **kwargs)
+
+
+def executor_stats() -> Dict[str, Any]:
+    return {"io": _io_pool.stats(), "cpu": _cpu_pool.stats()}
+
+
+def shutdown_executors():
+    logger.info("[EXECUTOR] Shutting down pools")
+    _io_pool.shutdown()
+    _cpu_pool.shutdown()
@@ -0,0 +1,171 @@
+import asyncio
+import signal
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from app.config import (
+    JOBS_WORKER_CONCURRENCY,
+    JOBS_POLL_INTERVAL,
+    JOBS_LEASE_SECONDS,
+)
+from app.utils.logger import logger
+from app.utils.executor import run_io, shutdown_executors
+from app.services.llm_gateway import close_gateway
+from app.services.rate_limiter import llm_priority, BACKGROUND
+from app.database.db import cleanup_expired, flush
+from app.services.job_queue import (
+    claim,
+    complete,
+    fail,
+    heartbeat,
+    release,
+    purge_finished,
+    set_current_job,
+    reset_current_job,
+    worker_name,
+)
+from app.routes.analyze import run_analysis
+from app.routes.studyplan import run_study_plan
+
+
+"""
+worker.py
+
+Background job worker for the SQLite job queue (services/job_queue.py).
+
+    python -m app.worker
+
+Runs JOBS_WORKER_CONCURRENCY jobs at a time; start as many processes
+(on as many machines sharing the data volume) as needed. The API can
+also run workers in-process (JOBS_EMBEDDED_WORKERS, see main.py).
+
+- every LLM call of a job runs at BACKGROUND priority, so interactive
+  requests go first through the rate limiter
+- the job lease is renewed while it runs; a killed worker's job is
+  picked up again once the lease expires and resumes from its
+  checkpoints: finished analysis stages (analysis artifact), OCR'd
+  pages and generated plan days (checkpoints table)
+- on SIGTERM / SIGINT running jobs are put back in the queue
+"""
+
+JOB_HANDLERS: Dict[str, Callable[..., Awaitable[Any]]] = {
+    "analyze": run_analysis,
+    "studyplan": run_study_plan,
+}
+
+
+async def _keep_lease(job_id: str):
+    while True:
+        await asyncio.sleep(JOBS_LEASE_SECONDS / 3)
+        try:
+            await run_io(heartbeat, job_id)
+        except Exception as e:
+            logger.warning(f"[WORKER] Heartbeat failed for {job_id}: {e}")
+
+
+async def run_job(job: Dict[str, Any]):
+    job_id = job["job_id"]
+    handler = JOB_HANDLERS.get(job["kind"])
+
+    if handler is None:
+        await run_io(fail, job_id, f"Unknown job kind: {job['kind']}")
+        return
+
+    logger.info(f"[WORKER] Job {job_id} ({job['kind']}) started, attempt {job['attempts']}")
+    lease = asyncio.create_task(_keep_lease(job_id))
+    token = set_current_job(job_id)
+
+    try:
+        with llm_priority(BACKGROUND):
+            result = await handler(**job["payload"])
+        await run_io(complete, job_id, result)
+        logger.info(f"[WORKER] Job {job_id} done")
+
+    except asyncio.CancelledError:
+        await run_io(release, job_id)
+        logger.warning(f"[WORKER] Job {job_id} interrupted, back in queue")
+        raise
+
+    except HTTPException as e:
+        await run_io(fail, job_id, str(e.detail))
+        logger.error(f"[WORKER] Job {job_id} failed: {e.detail}")
+
+    except Exception as e:
+        logger.exception(f"[WORKER] Job {job_id} failed: {e}")
+        await run_io(fail, job_id, str(e) or type(e).__name__)
+
+    finally:
+        reset_current_job(token)
+        lease.cancel()
+
+
+async def worker_loop(worker_id: str, stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            job = await run_io(claim, worker_id)
+        except Exception as e:
+            logger.error(f"[WORKER] Claim failed: {e}")
+            job = None
+
+        if job is None:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=JOBS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        await run_job(job)
+
+
+async def _purge_loop(stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            purged = await run_io(purge_finished)
+            if purged:
+                logger.info(f"[WORKER] Purged {purged} finished jobs")
+            await run_io(cleanup_expired)
+        except Exception as e:
+            logger.warning(f"[WORKER] Purge failed: {e}")
+
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=3600)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_workers(concurrency: int, stop: asyncio.Event) -> List[asyncio.Task]:
+    worker_id = worker_name()
+    logger.info(f"[WORKER] {worker_id}: {concurrency} job slots")
+
+    tasks = [asyncio.create_task(worker_loop(worker_id, stop)) for _ in range(max(1, concurrency))]
+    tasks.append(asyncio.create_task(_purge_loop(stop)))
+    return tasks
+
+
+async def stop_workers(tasks: List[asyncio.Task], stop: asyncio.Event):
+    stop.set()
+    for task in tasks:
+        task.cancel()   # running jobs are released back to the queue
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def main(concurrency: Optional[int] = None):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    tasks = start_workers(concurrency or JOBS_WORKER_CONCURRENCY, stop)
+    try:
+        await stop.wait()
+    finally:
+        await stop_workers(tasks, stop)
+        await close_gateway()
+        flush()   # buffered status writes
+        shutdown_executors()
+        logger.info("[WORKER] Stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
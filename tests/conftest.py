@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# app.config reads the environment at import time: point every store at
+# a throwaway directory before any app module is imported
+_data_dir = tempfile.mkdtemp(prefix="app_tests_")
+os.environ.setdefault("UPLOAD_DIR", _data_dir)
+os.environ.setdefault("DATABASE_PATH", os.path.join(_data_dir, "app.sqlite3"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,110 @@
+import asyncio
+import os
+
+import fitz
+
+from app.config import UPLOAD_DIR
+from app.routes import analyze
+from app.services import pdf_extractor
+from app.services.analysis_artifact import load_artifact
+
+
+PAGE_TEXT = "Chapter 1. Introduction to the subject of this book. " * 20
+OCR_TEXT = "Recognised text of the scanned second page."
+
+
+def _make_pdf(file_id: str) -> str:
+    # page 1 has a text layer, page 2 is image-only and needs OCR
+    path = os.path.join(UPLOAD_DIR, f"{file_id}.pdf")
+    doc = fitz.open()
+    doc.new_page().insert_textbox(fitz.Rect(36, 36, 560, 800), PAGE_TEXT)
+    doc.new_page()
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def test_failed_ocr_page_is_retried_on_next_run(monkeypatch):
+    file_id = "ocrretry"
+    _make_pdf(file_id)
+    calls = []
+
+    async def fake_ocr_pages(path, pages, engine=None, on_page=None):
+        calls.append(list(pages))
+        info = {"engines": ["tesseract"], "skipped_blank": []}
+        if len(calls) == 1:
+            return {}, info   # engine failed on every page
+        for page in pages:
+            on_page(page, OCR_TEXT)
+        return {page: OCR_TEXT for page in pages}, info
+
+    async def fake_classify(text, cache=True):
+        return {"document_type": "textbook", "main_topics": ["intro"], "summary": "s"}
+
+    async def fake_language(text):
+        return "en"
+
+    async def no_notify(message):
+        return None
+
+    monkeypatch.setattr(pdf_extractor, "ocr_pages", fake_ocr_pages)
+    monkeypatch.setattr(analyze, "classify_document", fake_classify)
+    monkeypatch.setattr(analyze, "detect_language", fake_language)
+    monkeypatch.setattr(analyze, "notify_admin", no_notify)
+
+    first = asyncio.run(analyze.run_analysis(file_id))
+
+    assert first["extraction"]["ocr_failed_pages"] == 1
+    assert "pages" not in load_artifact(file_id)["stages"]
+
+    second = asyncio.run(analyze.run_analysis(file_id))
+
+    assert calls == [[2], [2]]
+    assert second["extraction"]["ocr_failed_pages"] == 0
+    assert "pages" in second["rebuilt_stages"]
+    assert second["total_length"] > first["total_length"]
+
+    # a third run reuses the now complete stage without any OCR
+    third = asyncio.run(analyze.run_analysis(file_id))
+    assert len(calls) == 2
+    assert "pages" not in third["rebuilt_stages"]
+
+
+def test_prepare_plan_reads_current_stages_without_analysis(monkeypatch):
+    from app.routes import studyplan
+
+    file_id = "planready"
+    _make_pdf(file_id)
+
+    async def fake_ocr_pages(path, pages, engine=None, on_page=None):
+        for page in pages:
+            on_page(page, OCR_TEXT)
+        return {page: OCR_TEXT for page in pages}, {"engines": ["tesseract"], "skipped_blank": []}
+
+    async def fake_classify(text, cache=True):
+        return {"document_type": "textbook", "main_topics": ["intro"], "summary": "s"}
+
+    async def fake_language(text):
+        return "en"
+
+    async def no_notify(message):
+        return None
+
+    monkeypatch.setattr(pdf_extractor, "ocr_pages", fake_ocr_pages)
+    monkeypatch.setattr(analyze, "classify_document", fake_classify)
+    monkeypatch.setattr(analyze, "detect_language", fake_language)
+    monkeypatch.setattr(analyze, "notify_admin", no_notify)
+
+    result = asyncio.run(analyze.run_analysis(file_id))
+
+    async def no_analysis(*args, **kwargs):
+        raise AssertionError("run_analysis called although every stage is current")
+
+    monkeypatch.setattr(studyplan, "run_analysis", no_analysis)
+    prepared = asyncio.run(studyplan.prepare_plan(file_id))
+
+    assert prepared == {
+        "structure": result["structure"],
+        "pages_count": result["pages"],
+        "analysis": result["analysis"],
+    }